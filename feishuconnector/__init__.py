@@ -1,2 +1,12 @@
 from ._version import __version__
-from .manager import FeishuConnector
\ No newline at end of file
+from .auth import FileTokenStore, MemoryTokenStore, TokenStore
+from .manager import FeishuConnector
+from .batch import BatchResult, RecordResult
+from .sync import BitableSnapshot, SyncResult
+from .upsert import UpsertResult
+from .columnar import ColumnarTable
+from .scheduler import RequestScheduler, get_default_scheduler
+from .aio import AsyncFeishuConnector
+from .webhook import WebhookDispatcher
+from .writer import BufferedWriter
+from .metrics import CallbackHook, Hook, LoggingHook, PrometheusHook
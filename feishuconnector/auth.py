@@ -0,0 +1,158 @@
+import os
+import json
+import time
+import threading
+import contextlib
+from abc import ABC, abstractmethod
+from typing import Callable, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # windows, file store falls back to a process-local lock
+    fcntl = None
+
+
+# codes returned by the open api when the bearer token is expired or revoked
+INVALID_TOKEN_CODES = (99991663, 99991664, 99991677)
+
+
+class TokenStore(ABC):
+    """Where a tenant access token lives between refreshes.
+
+    ``load``/``save`` exchange ``(token, expires_at)`` with ``expires_at`` as an
+    epoch timestamp. ``lock`` guards a refresh so only one caller mints a new
+    token while the others wait and read the result.
+    """
+
+    @abstractmethod
+    def load(self) -> Optional[Tuple[str, float]]:
+        ...
+
+    @abstractmethod
+    def save(self, token: str, expires_at: float) -> None:
+        ...
+
+    @abstractmethod
+    def clear(self) -> None:
+        ...
+
+    @abstractmethod
+    def lock(self):
+        ...
+
+
+class MemoryTokenStore(TokenStore):
+
+    def __init__(self):
+        self._value = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        return self._value
+
+    def save(self, token, expires_at):
+        self._value = (token, expires_at)
+
+    def clear(self):
+        self._value = None
+
+    def lock(self):
+        return self._lock
+
+
+class FileTokenStore(TokenStore):
+    """Token kept in a json file so several worker processes share one token.
+
+    The refresh lock is an ``flock`` on ``<path>.lock``, so across a fleet of
+    processes on one host only one of them hits the auth endpoint. Both files
+    are created readable by their owner only; keep them in a private directory.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), mode=0o700, exist_ok=True)
+        self._thread_lock = threading.Lock()
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                d = json.load(f)
+            return d['token'], float(d['expires_at'])
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def save(self, token, expires_at):
+        tmp = f'{self.path}.{os.getpid()}.tmp'
+        # the token is a bearer credential, never world-readable
+        fd = os.open(tmp, os.O_CREAT | os.O_WRONLY | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'token': token, 'expires_at': expires_at}, f)
+        os.replace(tmp, self.path)
+
+    def clear(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    @contextlib.contextmanager
+    def lock(self):
+        with self._thread_lock:
+            if fcntl is None:
+                yield
+                return
+            fd = os.open(f'{self.path}.lock', os.O_CREAT | os.O_WRONLY | os.O_APPEND, 0o600)
+            with os.fdopen(fd, 'a') as fp:
+                fcntl.flock(fp.fileno(), fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(fp.fileno(), fcntl.LOCK_UN)
+
+
+class TokenManager:
+    """Expiry-aware tenant access token with single-flight refresh.
+
+    ``fetch`` mints a new token and returns ``(token, expire_seconds)`` as the
+    auth endpoint does. The token is refreshed ``refresh_margin`` seconds
+    before it expires; concurrent callers that find it stale queue on the
+    store lock and reuse the token minted by whoever got there first.
+    """
+
+    def __init__(self, fetch: Callable[[], Tuple[str, int]], store: Optional[TokenStore] = None, refresh_margin: float = 300):
+        self._fetch = fetch
+        self.store = store or MemoryTokenStore()
+        self.refresh_margin = refresh_margin
+        self._cached = None
+
+    def _fresh(self, value) -> bool:
+        return value is not None and time.time() < value[1] - self.refresh_margin
+
+    def get(self) -> str:
+        value = self._cached
+        if self._fresh(value):
+            return value[0]
+        with self.store.lock():
+            # another thread or process may have refreshed while we waited
+            value = self.store.load()
+            if not self._fresh(value):
+                token, expire = self._fetch()
+                value = (token, time.time() + expire)
+                self.store.save(*value)
+            self._cached = value
+        return value[0]
+
+    def invalidate(self, token: Optional[str] = None) -> None:
+        """Drop ``token`` (or the current one) so the next ``get`` refreshes."""
+        with self.store.lock():
+            value = self.store.load()
+            if value is not None and (token is None or value[0] == token):
+                self.store.clear()
+            cached = self._cached
+            if cached is not None and (token is None or cached[0] == token):
+                self._cached = None
+
+    @property
+    def expires_at(self) -> Optional[float]:
+        value = self._cached
+        return None if value is None else value[1]
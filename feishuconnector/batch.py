@@ -0,0 +1,80 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, List, Optional, Sequence, Tuple
+
+
+@dataclass
+class RecordResult:
+    record_id: Optional[str]
+    ok: bool
+    error: Optional[str] = None
+
+
+@dataclass
+class BatchResult:
+    """Per-record outcome of a batched write, in input order."""
+    results: List[RecordResult] = field(default_factory=list)
+    skipped: int = 0
+    requests: int = 0
+    elapsed: float = 0.0
+
+    @property
+    def succeeded(self) -> int:
+        return sum(1 for r in self.results if r.ok)
+
+    @property
+    def failed(self) -> List[RecordResult]:
+        return [r for r in self.results if not r.ok]
+
+    @property
+    def throughput(self) -> float:
+        """Succeeded records per second."""
+        return self.succeeded / self.elapsed if self.elapsed > 0 else 0.0
+
+    def summary(self) -> str:
+        return (f'(ok){self.succeeded} (failed){len(self.failed)} (skipped){self.skipped} '
+                f'(requests){self.requests} (elapsed){self.elapsed:.2f}s (rps){self.throughput:.1f}')
+
+
+def chunked(items: Sequence, size: int) -> List[Sequence]:
+    return [items[i: i + size] for i in range(0, len(items), size)]
+
+
+def run_chunks(fn: Callable[[Any], Any], chunks: Sequence, concurrency: int = 1,
+               retries: int = 0) -> Tuple[List[Tuple[Any, Optional[BaseException]]], int]:
+    """Call ``fn`` on every chunk through a bounded worker pool.
+
+    Each chunk is retried on its own up to ``retries`` times. Returns the
+    ``(value, error)`` pair of every chunk in input order, plus the number of
+    calls made.
+    """
+    calls = [0] * len(chunks)
+
+    def run(i):
+        err = None
+        for _ in range(retries + 1):
+            calls[i] += 1
+            try:
+                return fn(chunks[i]), None
+            except Exception as e:
+                err = e
+        return None, err
+
+    if concurrency <= 1 or len(chunks) <= 1:
+        out = [run(i) for i in range(len(chunks))]
+    else:
+        with ThreadPoolExecutor(max_workers=min(concurrency, len(chunks))) as executor:
+            out = list(executor.map(run, range(len(chunks))))
+    return out, sum(calls)
+
+
+class Timer:
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        self.elapsed = 0.0
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.start
@@ -0,0 +1,86 @@
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries expire ``ttl`` seconds after insertion.
+
+    With ``path`` set the entries are also kept in a json file, so a new
+    process starts warm. Values therefore have to be json serializable.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = 3600, path: Optional[str] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        if path is not None:
+            self._load()
+
+    def get(self, key: str, default=None) -> Any:
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and (item[1] is None or item[1] > time.time()):
+                self._data.move_to_end(key)
+                self.hits += 1
+                return item[0]
+            if item is not None:
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key: str, value: Any) -> None:
+        expires_at = None if self.ttl is None else time.time() + self.ttl
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+            self._save()
+
+    def invalidate(self, *keys: str) -> None:
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+            self._save()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._save()
+
+    def keys(self):
+        with self._lock:
+            return list(self._data.keys())
+
+    def stats(self) -> Dict[str, int]:
+        return {'size': len(self._data), 'hits': self.hits, 'misses': self.misses}
+
+    def __len__(self):
+        return len(self._data)
+
+    def _load(self):
+        try:
+            with open(self.path, 'r') as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return
+        now = time.time()
+        for key, value, expires_at in entries[-self.maxsize:]:
+            if expires_at is None or expires_at > now:
+                self._data[key] = (value, expires_at)
+
+    def _save(self):
+        if self.path is None:
+            return
+        tmp = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump([[k, v, e] for k, (v, e) in self._data.items()], f)
+        os.replace(tmp, self.path)
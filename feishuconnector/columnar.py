@@ -0,0 +1,288 @@
+import sys
+from array import array
+from typing import Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+
+# bitable field types, see the fields api
+TEXT, NUMBER, SINGLE_SELECT, MULTI_SELECT, DATETIME, CHECKBOX = 1, 2, 3, 4, 5, 7
+PHONE, URL, AUTO_NUMBER = 13, 15, 1005
+CREATED_TIME, MODIFIED_TIME = 1001, 1002
+PROGRESS, CURRENCY, RATING = 99002, 99003, 99004
+
+_NAT = np.iinfo(np.int64).min
+# short strings repeat often enough (names, codes, statuses) to be worth interning
+_INTERN_MAX = 64
+
+
+class _Mismatch(Exception):
+    """A value doesn't fit the buffer's type, the column falls back to objects."""
+
+
+def _text(v):
+    # text with mentions or links comes back as a list of segments
+    if isinstance(v, list):
+        return ''.join(str(s.get('text', '')) if isinstance(s, dict) else str(s) for s in v)
+    if isinstance(v, dict):
+        return v.get('text', v.get('link'))
+    return v
+
+
+class ObjectBuffer:
+    kind = 'object'
+
+    def __init__(self, values: Optional[List] = None):
+        self.values = values if values is not None else []
+
+    def __len__(self):
+        return len(self.values)
+
+    def extend(self, values: Sequence) -> None:
+        self.values.extend(values)
+
+    def tolist(self) -> List:
+        return list(self.values)
+
+    def to_numpy(self) -> np.ndarray:
+        out = np.empty(len(self.values), dtype=object)
+        out[:] = self.values
+        return out
+
+    def nbytes(self) -> int:
+        return 8 * len(self.values)
+
+
+class NumberBuffer:
+    """float64 values in a growable ``array``, NaN for empty cells."""
+    kind = 'number'
+
+    def __init__(self):
+        self.values = array('d')
+
+    def __len__(self):
+        return len(self.values)
+
+    def extend(self, values: Sequence) -> None:
+        try:
+            converted = [np.nan if v is None else float(v) for v in values]
+        except (TypeError, ValueError):
+            raise _Mismatch()
+        self.values.extend(converted)
+
+    def tolist(self) -> List:
+        return [None if v != v else v for v in self.values]
+
+    def to_numpy(self) -> np.ndarray:
+        return np.frombuffer(self.values, dtype=np.float64) if len(self.values) else np.empty(0, dtype=np.float64)
+
+    def nbytes(self) -> int:
+        return self.values.itemsize * len(self.values)
+
+
+class DateBuffer(NumberBuffer):
+    """ms epochs as int64, NaT for empty cells, viewed as datetime64[ms] without a copy."""
+    kind = 'datetime'
+
+    def __init__(self):
+        self.values = array('q')
+
+    def extend(self, values: Sequence) -> None:
+        try:
+            converted = [_NAT if v is None else int(v) for v in values]
+        except (TypeError, ValueError):
+            raise _Mismatch()
+        self.values.extend(converted)
+
+    def tolist(self) -> List:
+        return [None if v == _NAT else v for v in self.values]
+
+    def to_numpy(self) -> np.ndarray:
+        if not len(self.values):
+            return np.empty(0, dtype='datetime64[ms]')
+        return np.frombuffer(self.values, dtype=np.int64).view('datetime64[ms]')
+
+
+class BoolBuffer(NumberBuffer):
+    """Checkboxes, one byte each; an unchecked box is omitted by the api and reads as False."""
+    kind = 'bool'
+
+    def __init__(self):
+        self.values = array('b')
+
+    def extend(self, values: Sequence) -> None:
+        if any(v is not None and not isinstance(v, bool) for v in values):
+            raise _Mismatch()
+        self.values.extend(1 if v else 0 for v in values)
+
+    def tolist(self) -> List:
+        return [bool(v) for v in self.values]
+
+    def to_numpy(self) -> np.ndarray:
+        return np.frombuffer(self.values, dtype=np.int8).view(np.bool_) if len(self.values) else np.empty(0, dtype=np.bool_)
+
+
+class CategoryBuffer:
+    """Dictionary-encoded values: int32 codes into a list of distinct values, -1 for empty cells.
+
+    Used for single selects, and for multi selects with each option list
+    stored once as a tuple.
+    """
+    kind = 'category'
+
+    def __init__(self, multi: bool = False):
+        self.multi = multi
+        self.codes = array('i')
+        self.categories = []
+        self._index = {}
+
+    def __len__(self):
+        return len(self.codes)
+
+    def _code(self, v):
+        if v is None:
+            return -1
+        if self.multi:
+            v = tuple(_text(x) for x in v) if isinstance(v, list) else (_text(v),)
+        else:
+            v = _text(v)
+        if not isinstance(v, (str, tuple)):
+            raise _Mismatch()
+        code = self._index.get(v)
+        if code is None:
+            code = self._index[v] = len(self.categories)
+            self.categories.append(v)
+        return code
+
+    def extend(self, values: Sequence) -> None:
+        n = len(self.categories)
+        try:
+            converted = [self._code(v) for v in values]
+        except _Mismatch:
+            for v in self.categories[n:]:
+                del self._index[v]
+            del self.categories[n:]
+            raise
+        self.codes.extend(converted)
+
+    def tolist(self) -> List:
+        return [None if c < 0 else (list(self.categories[c]) if self.multi else self.categories[c]) for c in self.codes]
+
+    def to_numpy(self) -> np.ndarray:
+        return np.frombuffer(self.codes, dtype=np.int32) if len(self.codes) else np.empty(0, dtype=np.int32)
+
+    def to_categorical(self) -> pd.Categorical:
+        return pd.Categorical.from_codes(self.to_numpy(), categories=self.categories)
+
+    def to_objects(self) -> np.ndarray:
+        lookup = np.empty(len(self.categories) + 1, dtype=object)
+        lookup[:-1] = self.categories
+        lookup[-1] = None
+        # -1 picks the trailing None
+        return lookup[self.to_numpy()]
+
+    def nbytes(self) -> int:
+        return 4 * len(self.codes) + sum(sys.getsizeof(c) for c in self.categories)
+
+
+class StringBuffer(ObjectBuffer):
+    """Text cells as python strings, short ones interned so repeats share one object."""
+    kind = 'string'
+
+    def extend(self, values: Sequence) -> None:
+        intern = sys.intern
+        out = []
+        for v in values:
+            v = _text(v)
+            if v is not None and not isinstance(v, str):
+                raise _Mismatch()
+            out.append(intern(v) if v is not None and len(v) <= _INTERN_MAX else v)
+        self.values.extend(out)
+
+
+def buffer_for(field_type: Optional[int]):
+    if field_type in (NUMBER, PROGRESS, CURRENCY, RATING):
+        return NumberBuffer()
+    if field_type in (DATETIME, CREATED_TIME, MODIFIED_TIME):
+        return DateBuffer()
+    if field_type == CHECKBOX:
+        return BoolBuffer()
+    if field_type == SINGLE_SELECT:
+        return CategoryBuffer()
+    if field_type == MULTI_SELECT:
+        return CategoryBuffer(multi=True)
+    if field_type in (TEXT, PHONE, URL, AUTO_NUMBER):
+        return StringBuffer()
+    return ObjectBuffer()
+
+
+class ColumnarTable:
+    """Bitable records accumulated page by page into one typed buffer per field.
+
+    ``schema`` is the items list of the fields api; fields missing from it
+    (added after it was read) are kept as object columns. A value that
+    doesn't fit its field's buffer turns that column into an object column.
+    Once a numeric column has been exported with ``to_numpy``/``to_pandas``
+    its buffer can't grow any more, so convert after the last page.
+    """
+
+    def __init__(self, schema: Iterable[Dict] = (), field_names: Optional[Iterable[str]] = None):
+        keep = None if field_names is None else set(field_names)
+        self.record_ids = []
+        self.columns = {}
+        for f in schema:
+            if keep is None or f['field_name'] in keep:
+                self.columns[f['field_name']] = buffer_for(f.get('type'))
+
+    @property
+    def num_rows(self) -> int:
+        return len(self.record_ids)
+
+    def __len__(self):
+        return self.num_rows
+
+    def add(self, items: Sequence[Dict]) -> None:
+        if not items:
+            return
+        n = self.num_rows
+        fields = [r.get('fields') or {} for r in items]
+        for f in fields:
+            for k in f:
+                if k not in self.columns:
+                    self.columns[k] = ObjectBuffer([None] * n)
+        for k, buf in self.columns.items():
+            values = [f.get(k) for f in fields]
+            try:
+                buf.extend(values)
+            except _Mismatch:
+                self.columns[k] = ObjectBuffer(buf.tolist() + values)
+        self.record_ids.extend(sys.intern(r['record_id']) for r in items)
+
+    def nbytes(self) -> int:
+        """Rough size of the buffers, excluding the string objects themselves."""
+        return 8 * len(self.record_ids) + sum(b.nbytes() for b in self.columns.values())
+
+    def column(self, name: str) -> np.ndarray:
+        buf = self.columns[name]
+        return buf.to_objects() if isinstance(buf, CategoryBuffer) and buf.multi else buf.to_numpy()
+
+    def to_pandas(self, categorical: bool = True) -> pd.DataFrame:
+        """DataFrame indexed by record_id. Number, date and checkbox columns share memory
+        with the buffers where pandas allows it; single selects become Categoricals."""
+        data = {}
+        for name, buf in self.columns.items():
+            if isinstance(buf, CategoryBuffer):
+                data[name] = buf.to_categorical() if categorical and not buf.multi else buf.to_objects()
+            else:
+                data[name] = buf.to_numpy()
+        return pd.DataFrame(data, index=pd.Index(self.record_ids, name='record_id', dtype=object), copy=False)
+
+    def to_records(self) -> List[Dict]:
+        """Back to the api's ``{'record_id', 'fields'}`` shape, empty cells left out."""
+        names = list(self.columns)
+        columns = [self.columns[k].tolist() for k in names]
+        out = []
+        for i, rid in enumerate(self.record_ids):
+            out.append({'record_id': rid, 'fields': {k: col[i] for k, col in zip(names, columns) if col[i] is not None}})
+        return out
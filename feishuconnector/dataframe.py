@@ -0,0 +1,163 @@
+import datetime
+import decimal
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+
+_MISSING = object()
+
+
+def _to_native(v):
+    """Convert one cell of an object column to something the api accepts."""
+    if v is None or v is pd.NA or v is pd.NaT:
+        return _MISSING
+    if isinstance(v, (list, tuple, np.ndarray)):
+        return [x for x in (_to_native(x) for x in v) if x is not _MISSING]
+    if isinstance(v, float):
+        return _MISSING if v != v else float(v)
+    if isinstance(v, (str, bool, int)):
+        return v
+    if isinstance(v, np.generic):
+        return _to_native(v.item())
+    if isinstance(v, (datetime.datetime, datetime.date)):
+        # same as the vectorized path: naive values are taken as UTC
+        return int(pd.Timestamp(v).value // 10**6)
+    if isinstance(v, decimal.Decimal):
+        return float(v)
+    return v
+
+
+def _convert_column(s: pd.Series) -> list:
+    """Convert a column to a list of json-ready values, ``_MISSING`` for NaN/None/NaT."""
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        s = s.astype(object)
+    kind = s.dtype.kind
+    if kind == 'M':
+        # datetime -> ms epoch, tz-aware columns are taken in UTC
+        if getattr(s.dt, 'tz', None) is not None:
+            s = s.dt.tz_convert('UTC').dt.tz_localize(None)
+        mask = s.isna().to_numpy()
+        values = s.to_numpy(dtype='datetime64[ms]').astype('int64').tolist()
+    elif kind in 'iubf' and not pd.api.types.is_extension_array_dtype(s.dtype):
+        values = s.to_numpy().tolist()
+        mask = s.isna().to_numpy() if kind == 'f' else None
+    elif kind in 'iubf':
+        # nullable Int64 / boolean / Float64
+        mask = s.isna().to_numpy()
+        values = s.to_numpy(dtype=object, na_value=None).tolist()
+    else:
+        return [_to_native(v) for v in s.to_numpy(dtype=object)]
+    if mask is not None and mask.any():
+        for i in np.flatnonzero(mask).tolist():
+            values[i] = _MISSING
+    return values
+
+
+def df_to_records(df: pd.DataFrame) -> List[Dict]:
+    """Convert a DataFrame to a list of bitable field dicts, one per row.
+
+    Conversion is done column by column without touching ``df``. Datetimes
+    become ms epochs, numpy scalars become python numbers, array-like cells
+    become lists (multi-select), and NaN/None/NaT cells are left out.
+    """
+    names = [str(c) for c in df.columns]
+    columns = [_convert_column(df.iloc[:, i]) for i in range(df.shape[1])]
+    return [{k: v for k, v in zip(names, row) if v is not _MISSING} for row in zip(*columns)]
+
+
+def iter_df_records(df: pd.DataFrame, chunk_size: int) -> Iterator[List[Dict]]:
+    """Yield ``df_to_records`` of ``df`` in slices of at most ``chunk_size`` rows."""
+    for start in range(0, len(df), chunk_size):
+        yield df_to_records(df.iloc[start: start + chunk_size])
+
+
+class FrameBuilder:
+    """Build a DataFrame column-wise from pages of bitable records."""
+
+    def __init__(self):
+        self.record_ids = []
+        self.columns = {}
+
+    def add(self, items: Sequence[Dict]) -> None:
+        if not items:
+            return
+        n = len(self.record_ids)
+        fields = [r.get('fields') or {} for r in items]
+        for f in fields:
+            for k in f:
+                if k not in self.columns:
+                    self.columns[k] = [None] * n
+        for k, col in self.columns.items():
+            col.extend([f.get(k) for f in fields])
+        self.record_ids.extend(r.get('record_id') for r in items)
+
+    def to_df(self, parse_dates: Optional[Iterable[str]] = None) -> pd.DataFrame:
+        index = pd.Index(self.record_ids, name='record_id')
+        df = pd.DataFrame(self.columns, index=index)
+        for col in parse_dates or []:
+            if col in df.columns:
+                df[col] = pd.to_datetime(df[col], unit='ms')
+        return df
+
+
+def _cell_text(v):
+    # rich text / mention / link cells come back as a list of segments
+    if isinstance(v, list):
+        return ''.join(str(s.get('text', '')) if isinstance(s, dict) else str(s) for s in v)
+    if isinstance(v, dict):
+        return v.get('text', v.get('link', str(v)))
+    return v
+
+
+def _sheet_column(values: List) -> pd.Series:
+    """Type a column of sheet cells: int64/float64 when all non-empty cells are numbers, text otherwise."""
+    present = [v for v in values if v is not None and v != '']
+    if present and all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in present):
+        if len(present) == len(values) and all(isinstance(v, int) for v in present):
+            return pd.Series(values, dtype='int64')
+        return pd.Series([np.nan if v is None or v == '' else v for v in values], dtype='float64')
+    return pd.Series([None if v is None or v == '' else _cell_text(v) for v in values], dtype=object)
+
+
+def _pad(values: Sequence[Sequence]) -> List[List]:
+    width = max((len(r) for r in values), default=0)
+    return [list(r) + [None] * (width - len(r)) for r in values]
+
+
+def sheet_values_to_df(values: Sequence[Sequence], header: bool = True, parse_dates: Optional[Iterable[str]] = None) -> pd.DataFrame:
+    """Convert sheet rows to a DataFrame with typed columns.
+
+    With ``header`` the first row names the columns. Trailing columns with
+    neither a name nor a value are dropped. ``parse_dates`` columns are read
+    as sheet date serials (days since 1899-12-30) or date strings.
+    """
+    rows = _pad(values)
+    names = [None if v is None else str(_cell_text(v)) for v in rows[0]] if header and rows else None
+    if header:
+        rows = rows[1:]
+    width = max(len(names or []), len(rows[0]) if rows else 0)
+    while width and (names is None or names[width - 1] is None) and all(r[width - 1] in (None, '') for r in rows):
+        width -= 1
+    columns = [list(c) for c in zip(*rows)] if rows else [[] for _ in range(width)]
+    if names is None:
+        names = list(range(width))
+    names = [f'col{i}' if n is None else n for i, n in enumerate(names[:width])]
+    df = pd.DataFrame({name: _sheet_column(col) for name, col in zip(names, columns[:width])})
+    for col in parse_dates or []:
+        if col in df.columns:
+            if df[col].dtype.kind in 'if':
+                df[col] = pd.to_datetime(df[col], unit='D', origin='1899-12-30')
+            else:
+                df[col] = pd.to_datetime(df[col])
+    return df
+
+
+def sheet_values_to_array(values: Sequence[Sequence], dtype=None) -> np.ndarray:
+    """Convert sheet rows to a 2-d array, ragged rows padded; empty cells become NaN for float dtypes."""
+    rows = _pad(values)
+    if dtype is not None and np.dtype(dtype).kind == 'f':
+        rows = [[np.nan if v is None or v == '' else v for v in r] for r in rows]
+        return np.array(rows, dtype=dtype).reshape(len(rows), -1)
+    return np.array(rows, dtype=dtype if dtype is not None else object).reshape(len(rows), -1)
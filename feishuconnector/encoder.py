@@ -1,15 +1,128 @@
 import json
+import math
+import decimal
 import datetime
+from typing import Any, Optional, Union
+
 import numpy as np
+import pandas as pd
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _datetime64(obj):
+    """datetime64 scalars and arrays in the format of ``datetime`` values, NaT as None."""
+    values = np.asarray(obj)
+    out = np.char.replace(np.datetime_as_string(values, unit='s'), 'T', ' ').astype(object)
+    out[np.isnat(values)] = None
+    return out.tolist()
+
+
+# types _convert_datetime64 has to look into, anything else is left as is
+_CONTAINERS = (dict, list, tuple, np.ndarray, np.datetime64)
+
+
+def _convert_datetime64(obj):
+    """Replace datetime64 values nested in dicts and lists, returns ``obj`` itself when there are none."""
+    if type(obj) is dict:
+        out = None
+        for k, v in obj.items():
+            if type(v) in _CONTAINERS:
+                c = _convert_datetime64(v)
+                if c is not v:
+                    if out is None:
+                        out = dict(obj)
+                    out[k] = c
+        return obj if out is None else out
+    if type(obj) is list or type(obj) is tuple:
+        out = None
+        for i, v in enumerate(obj):
+            if type(v) in _CONTAINERS:
+                c = _convert_datetime64(v)
+                if c is not v:
+                    if out is None:
+                        out = list(obj)
+                    out[i] = c
+        return obj if out is None else out
+    if type(obj) is np.datetime64 or (type(obj) is np.ndarray and obj.dtype.kind == 'M'):
+        return _datetime64(obj)
+    return obj
+
+
+def _default(obj):
+    """Fallback for the types json can't serialize natively, shared by both backends."""
+    if obj is pd.NA:
+        return None
+    elif isinstance(obj, np.datetime64) or (isinstance(obj, np.ndarray) and obj.dtype.kind == 'M'):
+        return _datetime64(obj)
+    elif isinstance(obj, datetime.datetime):
+        # NaT is a datetime that isn't equal to itself
+        return None if obj != obj else obj.strftime("%Y-%m-%d %H:%M:%S")
+    elif isinstance(obj, datetime.date):
+        return obj.strftime("%Y-%m-%d")
+    elif isinstance(obj, np.generic):
+        return _clean(obj.item())
+    elif isinstance(obj, np.ndarray):
+        return _clean(obj.tolist())
+    elif isinstance(obj, decimal.Decimal):
+        return None if obj.is_nan() else float(obj)
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+
+def _clean(obj):
+    """Replace NaN/inf floats with None, recursively. Only the stdlib backend needs this."""
+    if isinstance(obj, float):
+        return obj if math.isfinite(obj) else None
+    if isinstance(obj, dict):
+        return {k: _clean(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_clean(v) for v in obj]
+    return obj
+
 
 class JsonEncoder(json.JSONEncoder):
     def default(self, obj):
-        if isinstance(obj, datetime.datetime):
-            return obj.strftime("%Y-%m-%d %H:%M:%S")
-        elif isinstance(obj, datetime.date):
-            return obj.strftime("%Y-%m-%d")
-        elif isinstance(obj, np.nan):
-            return 'None'
-        else:
-            return json.JSONEncoder.default(self,obj)
-        
\ No newline at end of file
+        return _default(obj)
+
+
+class JsonCodec:
+    """Stdlib json backend: compact, utf-8, NaN/inf as null."""
+    name = 'json'
+
+    def dumps(self, obj: Any) -> bytes:
+        return json.dumps(_clean(obj), cls=JsonEncoder, ensure_ascii=False, separators=(',', ':'), allow_nan=False).encode('utf-8')
+
+    def loads(self, data: Union[bytes, str]) -> Any:
+        # the api always answers utf-8, skip json's encoding detection
+        if isinstance(data, bytes):
+            data = data.decode('utf-8')
+        return json.loads(data)
+
+
+class OrjsonCodec:
+    """orjson backend, serializes numpy natively and writes NaN as null."""
+    name = 'orjson'
+
+    def __init__(self):
+        assert orjson is not None, 'orjson is not installed'
+        self._option = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+
+    def dumps(self, obj: Any) -> bytes:
+        # OPT_SERIALIZE_NUMPY would write datetime64 in its own format, convert them as the json backend does
+        return orjson.dumps(_convert_datetime64(obj), default=_default, option=self._option)
+
+    def loads(self, data: Union[bytes, str]) -> Any:
+        return orjson.loads(data)
+
+
+def get_codec(name: Optional[str] = None):
+    """``'orjson'``, ``'json'``, or the fastest installed backend when ``name`` is None."""
+    if name is None:
+        name = 'orjson' if orjson is not None else 'json'
+    if name == 'orjson':
+        return OrjsonCodec()
+    assert name == 'json', f'unknown codec {name}'
+    return JsonCodec()
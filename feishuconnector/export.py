@@ -0,0 +1,302 @@
+import os
+import re
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional
+
+from .manager import _col_letter, logger
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    import pyarrow.feather as feather
+except ImportError:
+    pa = None
+
+
+MANIFEST = 'manifest.json'
+
+
+def _arrow_column(values: List):
+    """float64 for numbers, bool, string; anything else (lists, dicts) as json text."""
+    present = [v for v in values if v is not None]
+    if present and all(isinstance(v, bool) for v in present):
+        return pa.array(values, type=pa.bool_())
+    if present and all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in present):
+        return pa.array(values, type=pa.float64())
+    return pa.array([v if v is None or isinstance(v, str) else json.dumps(v, ensure_ascii=False) for v in values], type=pa.string())
+
+
+def to_arrow(columns: Dict[str, List]):
+    names = list(columns)
+    return pa.Table.from_arrays([_arrow_column(columns[k]) for k in names], names=names)
+
+
+def _unify(schemas: List) -> 'pa.Schema':
+    """Union of the part schemas; a column typed differently in two parts becomes string."""
+    types = {}
+    for schema in schemas:
+        for f in schema:
+            if f.name not in types:
+                types[f.name] = f.type
+            elif types[f.name] != f.type:
+                types[f.name] = pa.string()
+    return pa.schema([(k, v) for k, v in types.items()])
+
+
+def _conform(table, schema):
+    arrays = []
+    for f in schema:
+        if f.name in table.column_names:
+            col = table.column(f.name)
+            arrays.append(col if col.type == f.type else col.cast(f.type))
+        else:
+            arrays.append(pa.nulls(len(table), type=f.type))
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+def _safe(name: str) -> str:
+    return re.sub(r'[^\w.-]+', '_', name).strip('_') or 'table'
+
+
+@dataclass
+class ExportResult:
+    exported: List[Dict] = field(default_factory=list)
+    skipped: List[Dict] = field(default_factory=list)
+    failed: Dict[str, str] = field(default_factory=dict)
+    elapsed: float = 0.0
+
+    @property
+    def rows(self) -> int:
+        return sum(t['rows'] for t in self.exported)
+
+    def summary(self) -> str:
+        return (f'(exported){len(self.exported)} (skipped){len(self.skipped)} (failed){len(self.failed)} '
+                f'(rows){self.rows} (elapsed){self.elapsed:.2f}s')
+
+
+class WikiExporter:
+    """Export every bitable table and sheet of a wiki space to one file each.
+
+    Tables are exported by ``concurrency`` workers. Every ``pages_per_part``
+    pages (bitables) or row blocks (sheets) are written to a part file and
+    the position reached is saved in ``directory/manifest.json``; a rerun
+    skips finished tables and continues unfinished ones from their last
+    part. Parts are merged into ``<title>_<key>.parquet`` (or ``.arrow``)
+    when a table is complete.
+    """
+
+    def __init__(self, fc, directory: str, concurrency: int = 4, pages_per_part: int = 20, format: str = 'parquet'):
+        assert pa is not None, 'export needs pyarrow, pip install feishuconnector[export]'
+        assert format in ('parquet', 'arrow'), f'unknown format {format}'
+        self.fc = fc
+        self.directory = directory
+        self.concurrency = concurrency
+        self.pages_per_part = pages_per_part
+        self.format = format
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(directory, '.parts'), exist_ok=True)
+        self.manifest = self._load()
+
+    # ---- manifest ----
+    def _load(self) -> Dict:
+        try:
+            with open(os.path.join(self.directory, MANIFEST)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {'tables': {}}
+
+    def _save(self):
+        # called with self._lock held
+        path = os.path.join(self.directory, MANIFEST)
+        tmp = f'{path}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.manifest, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, path)
+
+    def _update(self, key: str, **values):
+        with self._lock:
+            self.manifest['tables'].setdefault(key, {}).update(values)
+            self._save()
+
+    # ---- plan ----
+    def plan(self, space_id: str) -> List[Dict]:
+        """One task per bitable table and per sheet found under the space."""
+        tasks = []
+        for node in self.fc.iter_wiki_nodes(space_id):
+            title = node.get('title') or node['node_token']
+            if node.get('obj_type') == 'bitable':
+                for t in self.fc.get_bitable_tables(node['obj_token']):
+                    tasks.append({'kind': 'bitable', 'node_token': node['node_token'], 'table_id': t['table_id'],
+                                  'title': f'{title}_{t.get("name") or t["table_id"]}'})
+            elif node.get('obj_type') == 'sheet':
+                for s in self.fc.get_sheet_meta(node['obj_token'])['sheets']:
+                    if 'blockInfo' in s:
+                        # a bitable embedded in the sheet
+                        table_id = s['blockInfo']['blockToken'].split('_')[1]
+                        tasks.append({'kind': 'bitable', 'node_token': node['node_token'], 'table_id': table_id,
+                                      'title': f'{title}_{s.get("title") or table_id}'})
+                    else:
+                        tasks.append({'kind': 'sheet', 'node_token': node['node_token'], 'sheet_id': s['sheetId'],
+                                      'column_count': s.get('columnCount', 0), 'title': f'{title}_{s.get("title") or s["sheetId"]}'})
+        for t in tasks:
+            t['key'] = f'{t["node_token"]}_{t.get("table_id") or t["sheet_id"]}'
+        return tasks
+
+    def run(self, space_id: str, tasks: Optional[Iterable[Dict]] = None) -> ExportResult:
+        result = ExportResult()
+        start = time.perf_counter()
+        tasks = list(tasks) if tasks is not None else self.plan(space_id)
+        with self._lock:
+            self.manifest['space_id'] = space_id
+            self._save()
+        todo = []
+        for task in tasks:
+            state = self.manifest['tables'].get(task['key'], {})
+            if state.get('status') == 'done' and os.path.exists(os.path.join(self.directory, state['path'])):
+                result.skipped.append(state)
+            else:
+                todo.append(task)
+        with ThreadPoolExecutor(max_workers=max(1, self.concurrency)) as executor:
+            futures = {executor.submit(self._export, task): task for task in todo}
+            for future, task in futures.items():
+                try:
+                    result.exported.append(future.result())
+                except Exception as e:
+                    self._update(task['key'], status='failed', error=str(e))
+                    result.failed[task['key']] = str(e)
+                    logger.warning(f'fail to export {task["key"]}: {e}')
+        result.elapsed = time.perf_counter() - start
+        return result
+
+    # ---- one table ----
+    def _export(self, task: Dict) -> Dict:
+        key = task['key']
+        state = self.manifest['tables'].get(key) or {}
+        if state.get('status') == 'done':
+            # finished before but the output went missing
+            state = {}
+        self._update(key, **{k: v for k, v in task.items() if k != 'key'}, status='running',
+                     parts=state.get('parts', []), rows=state.get('rows', 0), cursor=state.get('cursor'))
+        if task['kind'] == 'bitable':
+            self._export_bitable(task, state.get('cursor'))
+        else:
+            self._export_sheet(task, state.get('cursor'), state.get('header'))
+        path = self._merge(task)
+        rows = self.manifest['tables'][key]['rows']
+        self._update(key, status='done', path=path, error=None)
+        self.fc.log(f'exported {key} to {path}. RowNum={rows}')
+        return self.manifest['tables'][key]
+
+    def _write_part(self, key: str, table, cursor, **values):
+        """Write one part and move the table's cursor past it, in that order."""
+        with self._lock:
+            state = self.manifest['tables'][key]
+            name = f'part-{len(state["parts"]):05d}.{self.format}'
+        part_dir = os.path.join(self.directory, '.parts', key)
+        os.makedirs(part_dir, exist_ok=True)
+        self._write(table, os.path.join(part_dir, name))
+        with self._lock:
+            state['parts'].append(name)
+            state['rows'] += table.num_rows
+            state['cursor'] = cursor
+            state.update(values)
+            self._save()
+
+    def _export_bitable(self, task: Dict, page_token: Optional[str]):
+        if page_token == 'end':
+            return
+        pages = self.fc.iter_bitable_records(task['node_token'], task['table_id'], page_token=page_token, pages=True)
+        columns, n, count = {'record_id': []}, 0, 0
+        for page in pages:
+            items = page.get('items') or []
+            for r in items:
+                fields = r.get('fields') or {}
+                for k in fields:
+                    if k not in columns:
+                        columns[k] = [None] * n
+                for k, col in columns.items():
+                    col.append(r.get('record_id') if k == 'record_id' else fields.get(k))
+                n += 1
+            count += 1
+            if not page.get('has_more') or count >= self.pages_per_part:
+                self._write_part(task['key'], to_arrow(columns), page.get('page_token') if page.get('has_more') else 'end')
+                columns, n, count = {'record_id': []}, 0, 0
+        if n:
+            self._write_part(task['key'], to_arrow(columns), 'end')
+
+    def _export_sheet(self, task: Dict, next_row: Optional[int], header: Optional[List[str]]):
+        if next_row == 'end':
+            return
+        last_col = _col_letter(max(task.get('column_count') or 1, 1) - 1)
+        sheet_range = f'{task["sheet_id"]}!A{next_row or 1}:{last_col}'
+        blocks, count = [], 0
+        for first_row, rows in self.fc.iter_sheet_data(task['node_token'], sheet_range, concurrency=1):
+            if header is None:
+                header = self._header(rows[0])
+                rows, first_row = rows[1:], first_row + 1
+            blocks.extend(rows)
+            count += 1
+            if count >= self.pages_per_part:
+                self._write_part(task['key'], self._sheet_table(header, blocks), first_row + len(rows), header=header)
+                blocks, count = [], 0
+        self._write_part(task['key'], self._sheet_table(header or [], blocks), 'end', header=header)
+
+    @staticmethod
+    def _header(row: List) -> List[str]:
+        names, seen = [], {}
+        for i, v in enumerate(row):
+            name = f'col{i}' if v is None or v == '' else str(v)
+            if name in seen:
+                seen[name] += 1
+                name = f'{name}_{seen[name]}'
+            seen.setdefault(name, 0)
+            names.append(name)
+        return names
+
+    @staticmethod
+    def _sheet_table(header: List[str], rows: List[List]):
+        columns = {name: [r[i] if i < len(r) else None for r in rows] for i, name in enumerate(header)}
+        return to_arrow(columns)
+
+    # ---- files ----
+    def _write(self, table, path: str):
+        tmp = f'{path}.tmp'
+        if self.format == 'parquet':
+            pq.write_table(table, tmp)
+        else:
+            feather.write_feather(table, tmp)
+        os.replace(tmp, path)
+
+    def _read(self, path: str):
+        return pq.read_table(path) if self.format == 'parquet' else feather.read_table(path)
+
+    def _merge(self, task: Dict) -> str:
+        """Concatenate the parts into the table's output file, one part in memory at a time."""
+        key = task['key']
+        part_dir = os.path.join(self.directory, '.parts', key)
+        parts = [os.path.join(part_dir, p) for p in self.manifest['tables'][key]['parts']]
+        schemas = [pq.read_schema(p) if self.format == 'parquet' else feather.read_table(p, memory_map=True).schema for p in parts]
+        schema = _unify(schemas)
+        name = f'{_safe(task["title"])}_{key}.{self.format}'
+        path = os.path.join(self.directory, name)
+        tmp = f'{path}.tmp'
+        if self.format == 'parquet':
+            with pq.ParquetWriter(tmp, schema) as writer:
+                for p in parts:
+                    writer.write_table(_conform(self._read(p), schema))
+        else:
+            with pa.ipc.new_file(tmp, schema) as writer:
+                for p in parts:
+                    writer.write_table(_conform(self._read(p), schema))
+        os.replace(tmp, path)
+        for p in parts:
+            os.remove(p)
+        try:
+            os.rmdir(part_dir)
+        except OSError:
+            pass
+        return name
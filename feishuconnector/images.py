@@ -0,0 +1,83 @@
+import io
+import os
+import json
+import hashlib
+from typing import Optional
+
+import pandas as pd
+
+from .cache import TTLCache
+
+
+def render_dataframe(df: pd.DataFrame, **options) -> bytes:
+    """Render ``df`` to PNG bytes in memory, ``options`` go to ``dataframe_image.export``."""
+    import dataframe_image as dfi
+
+    options.setdefault('table_conversion', 'matplotlib')
+    buf = io.BytesIO()
+    dfi.export(df, buf, **options)
+    return buf.getvalue()
+
+
+def dataframe_digest(df: pd.DataFrame, **options) -> Optional[str]:
+    """Content hash of ``df`` (values, index, columns, dtypes) and the render options.
+
+    Returns None for objects that can't be hashed reliably, e.g. a Styler.
+    """
+    if not isinstance(df, pd.DataFrame):
+        return None
+    h = hashlib.sha256()
+    h.update(json.dumps([list(map(str, df.columns)), list(map(str, df.dtypes)), list(map(str, df.index.names)), options],
+                        sort_keys=True, default=str).encode('utf-8'))
+    try:
+        h.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    except TypeError:
+        # unhashable cells such as lists
+        h.update(df.to_json(orient='split', date_format='iso', default_handler=str).encode('utf-8'))
+    return h.hexdigest()
+
+
+class ImageCache:
+    """Rendered PNGs by DataFrame digest, and uploaded ``image_key`` by PNG hash.
+
+    PNGs are kept in an in-memory LRU of ``maxsize`` entries and, with
+    ``directory`` set, as files there; image keys are persisted to
+    ``directory/image_keys.json`` so restarted processes skip the upload too.
+    """
+
+    def __init__(self, maxsize: int = 128, directory: Optional[str] = None, key_ttl: Optional[float] = None):
+        self.directory = directory
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+        self.pngs = TTLCache(maxsize=maxsize, ttl=None)
+        self.image_keys = TTLCache(maxsize=max(maxsize, 1024), ttl=key_ttl,
+                                   path=None if directory is None else os.path.join(directory, 'image_keys.json'))
+
+    def get_png(self, digest: str) -> Optional[bytes]:
+        png = self.pngs.get(digest)
+        if png is None and self.directory is not None:
+            try:
+                with open(os.path.join(self.directory, f'{digest}.png'), 'rb') as f:
+                    png = f.read()
+                self.pngs.set(digest, png)
+            except FileNotFoundError:
+                pass
+        return png
+
+    def put_png(self, digest: str, png: bytes) -> None:
+        self.pngs.set(digest, png)
+        if self.directory is not None:
+            path = os.path.join(self.directory, f'{digest}.png')
+            tmp = f'{path}.{os.getpid()}.tmp'
+            with open(tmp, 'wb') as f:
+                f.write(png)
+            os.replace(tmp, path)
+
+    def get_image_key(self, png: bytes) -> Optional[str]:
+        return self.image_keys.get(hashlib.sha256(png).hexdigest())
+
+    def put_image_key(self, png: bytes, image_key: str) -> None:
+        self.image_keys.set(hashlib.sha256(png).hexdigest(), image_key)
+
+    def stats(self):
+        return {'png': self.pngs.stats(), 'image_key': self.image_keys.stats()}
@@ -1,187 +1,707 @@
 
+import re
+import time
 import uuid
-import requests
 import json
-import tempfile
-from .encoder import JsonEncoder
-from typing import BinaryIO, Dict
+import logging
+import functools
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from .encoder import get_codec
+from .auth import INVALID_TOKEN_CODES, TokenManager, TokenStore
+from .batch import BatchResult, RecordResult, Timer, chunked, run_chunks
+from .cache import TTLCache
+from .columnar import ColumnarTable
+from .dataframe import FrameBuilder, df_to_records, iter_df_records, sheet_values_to_array, sheet_values_to_df
+from .images import ImageCache, dataframe_digest, render_dataframe
+from .metrics import REQUEST, Hook, Instrumentation, OperationEvent, RequestEvent
+from .query import compile_filter, match
+from .scheduler import RequestScheduler, endpoint_key, get_default_scheduler
+from .sync import BitableSnapshot, SyncResult
+from .transport import Transport, Timeout
+from .upsert import KeyIndex, UpsertResult, plan_upsert
+from .webhook import WebhookDispatcher, build_image_elements, build_webhook_msg
+from typing import BinaryIO, Dict, Iterable, Optional, Tuple, Union
+
+import requests
 
 import pandas as pd
-import dataframe_image as dfi
 from requests_toolbelt import MultipartEncoder
 
 
+logger = logging.getLogger('feishuconnector')
+
+# default open api root, see ``FeishuConnector(base_url=...)``
+BASE_URL = 'https://open.feishu.cn/open-apis'
+
+# largest page_size accepted by the bitable records list api
+MAX_PAGE_SIZE = 500
+# largest number of records per batch_create / batch_update call
+MAX_BATCH_SIZE = 500
+# largest number of rows per sheet values write
+MAX_SHEET_ROWS = 5000
+# ranges per values_batch_get call, keeps the query string short
+MAX_BATCH_RANGES = 50
+
+
 def create_unique_record_id(prefix='rec'):
     """Generate a unique record id for Feishu Bitable randomly."""
     
     return prefix + uuid.uuid4().hex[:10]
 
+def _col_letter(idx):
+    # 0 -> 'A', 25 -> 'Z', 26 -> 'AA'
+    letters = ''
+    idx += 1
+    while idx:
+        idx, rem = divmod(idx - 1, 26)
+        letters = chr(ord('A') + rem) + letters
+    return letters
+
+
+def _col_index(letters):
+    idx = 0
+    for ch in letters.upper():
+        idx = idx * 26 + ord(ch) - ord('A') + 1
+    return idx - 1
+
+
+def _parse_range(cells):
+    """'A10:C5009' -> ('A', 10, 'C', 5009)"""
+    m = re.match(r'^([A-Za-z]+)(\d+)(?::([A-Za-z]+)(\d+))?$', cells)
+    assert m is not None, f'unsupported sheet range {cells}'
+    c0, r0, c1, r1 = m.groups()
+    return c0.upper(), int(r0), (c1 or c0).upper(), int(r1 or r0)
+
+
+def _split_range(sheet_range):
+    """'e792af!A2:C' -> ('e792af', 'A', 2, 'C', None), missing bounds are None."""
+    sheet_id, _, cells = sheet_range.partition('!')
+    if not cells:
+        return sheet_id, None, None, None, None
+    m = re.match(r'^([A-Za-z]+)?(\d+)?(?::([A-Za-z]+)?(\d+)?)?$', cells)
+    assert m is not None, f'unsupported sheet range {sheet_range}'
+    c0, r0, c1, r1 = m.groups()
+    if ':' not in cells:
+        c1, r1 = c0, r0
+    return sheet_id, c0 and c0.upper(), r0 and int(r0), c1 and c1.upper(), r1 and int(r1)
+
+
+def _is_empty_row(row):
+    return all(v is None or v == '' for v in row)
+
+
 class FeishuConnector:
 
-    def __init__(self, webhooks: Dict[str, str]):
+    def __init__(self, webhooks: Dict[str, str], pool_size: int = 10, timeout: Optional[Timeout] = (5, 60), gzip: bool = True,
+                 resolver_ttl: Optional[float] = 3600, resolver_size: int = 1024, resolver_path: Optional[str] = None,
+                 scheduler: Optional[RequestScheduler] = None, codec=None,
+                 image_cache_size: int = 128, image_cache_dir: Optional[str] = None, base_url: str = BASE_URL,
+                 hooks: Optional[Iterable[Hook]] = None, metrics_level: int = REQUEST):
         self.app_id = None
         self.app_secret = None
-        self.token = None
+        self._tokens = None
         self._webhooks = webhooks
         assert self._webhooks is not None, 'you should put a webhook config here'
         assert 'default' in self._webhooks, 'you should put a test webhook here with key \"default\"'
+        self._dispatcher = None
+        self._writers = []
+        # open api root, e.g. a local mock server or the lark suite domain
+        self.base_url = base_url.rstrip('/')
+        # every call goes through this pooled keep-alive session
+        self._http = Transport(pool_size=pool_size, timeout=timeout, gzip=gzip)
+        # request/response (de)serialization, orjson when installed
+        self._codec = codec or get_codec()
+        # rate limits, retries and adaptive concurrency, shared process-wide by default
+        self._scheduler = scheduler or get_default_scheduler()
+        # node_token -> (obj_token, obj_type) and node_token/table_id -> app_token
+        self.resolver = TTLCache(maxsize=resolver_size, ttl=resolver_ttl, path=resolver_path)
+        # rendered report PNGs and their uploaded image keys
+        self.images = ImageCache(maxsize=image_cache_size, directory=image_cache_dir)
+        # per-request and per-operation events, nothing is measured without hooks
+        self.metrics = Instrumentation(hooks or (), level=metrics_level)
 
-    def init(self, app_id: str, app_secret: str) -> None:
+    def init(self, app_id: str, app_secret: str, token_store: Optional[TokenStore] = None, refresh_margin: float = 300) -> None:
+        """Set the app credentials and fetch the first tenant access token.
+
+        The token is refreshed ``refresh_margin`` seconds before it expires.
+        Pass a ``FileTokenStore`` as ``token_store`` to share one token between
+        worker processes on the same host.
+        """
         self.app_id = app_id
         self.app_secret = app_secret
-        self.token = self.get_tenant_access_token()
+        self._tokens = TokenManager(self._fetch_tenant_access_token, store=token_store, refresh_margin=refresh_margin)
+        self._tokens.get()
+
+    @property
+    def token(self) -> Optional[str]:
+        if self._tokens is None:
+            return None
+        return self._tokens.get()
 
     def log(self, msg: str):
-        print(f'[FeishuC] {msg}')
+        logger.info(msg)
+
+    @property
+    def scheduler(self) -> RequestScheduler:
+        return self._scheduler
+
+    def close(self) -> None:
+        for writer in self._writers:
+            writer.close()
+        self._writers = []
+        if self._dispatcher is not None:
+            self._dispatcher.close()
+            self._dispatcher = None
+        self._http.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _request(self, method: str, url: str, idempotent: Optional[bool] = None, **kwargs) -> Tuple[requests.Response, dict]:
+        """Send one api call through the scheduler and decode its json body.
+
+        Throttled calls are retried by the scheduler, transient failures only
+        when the call is ``idempotent``: by default GET, PUT and anything
+        sent with a ``client_token``. A call rejected with an invalid-token
+        code is retried once with a freshly minted token. Nothing is retried
+        if the body is a stream that can't be replayed.
+        """
+        key = endpoint_key(method, url)
+        replayable = not hasattr(kwargs.get('data'), 'read')
+        if idempotent is None:
+            idempotent = method in ('GET', 'PUT') or bool((kwargs.get('params') or {}).get('client_token'))
+        attempts = [0]
+
+        def send():
+            if self.metrics.requests_enabled:
+                return self._instrumented_send(key, method, url, attempts, kwargs)
+            r = self._http.request(method, url, **kwargs)
+            try:
+                d = self._codec.loads(r.content)
+            except ValueError:
+                # e.g. an html error page from a gateway
+                d = {}
+            return r, d
+
+        r, d = self._scheduler.execute(key, send, retry=replayable, idempotent=idempotent)
+        headers = kwargs.get('headers') or {}
+        if d.get('code') in INVALID_TOKEN_CODES and 'Authorization' in headers and self._tokens is not None and replayable:
+            self.log(f'tenant access token rejected (code){d.get("code")}, refreshing')
+            self._tokens.invalidate(headers['Authorization'][len('Bearer '):])
+            kwargs['headers'] = {**headers, 'Authorization': f'Bearer {self.token}'}
+            r, d = self._scheduler.execute(key, send, idempotent=idempotent)
+        return r, d
+
+    def _instrumented_send(self, key, method, url, attempts, kwargs):
+        data = kwargs.get('data')
+        sent = len(data) if isinstance(data, (bytes, str)) else 0
+        attempt = attempts[0]
+        attempts[0] += 1
+        t = time.perf_counter()
+        try:
+            r = self._http.request(method, url, **kwargs)
+        except Exception as e:
+            self.metrics.request(RequestEvent(key, None, None, time.perf_counter() - t, sent, 0, attempt, type(e).__name__))
+            raise
+        try:
+            d = self._codec.loads(r.content)
+        except ValueError:
+            d = {}
+        self.metrics.request(RequestEvent(key, r.status_code, d.get('code'), time.perf_counter() - t, sent, len(r.content), attempt))
+        return r, d
+
+    def _operation(self, operation, target, **fields):
+        if self.metrics.operations_enabled:
+            self.metrics.operation(OperationEvent(operation, target, **fields))
 
     # important functions
-    def get_bitable_records(self, node_token, table_id):
-        d = self.get_node_detail(node_token)
-        app_token = d['obj_token']
-        obj_type = d['obj_type']
-        if obj_type == 'sheet':
-            # app token should be refactored
-            sheet_meta = self.get_sheet_meta(app_token)
-            for sht_info in sheet_meta['sheets']:
-                if 'blockInfo' in sht_info:
-                    token = sht_info['blockInfo']['blockToken']
-                    _app, _table = token.split('_')
-                    if _table == table_id:
-                        app_token = _app
-                        break
-            self.log(f'[bitable] get from sheet: (node){node_token} (bi){app_token} (table){table_id}')
-        elif obj_type == 'bitable':
-            # just do nothing
-            self.log(f'[bitable] get from sheet: (node){node_token} (bi){app_token} (table){table_id}')
-        else:
-            assert False, f'fail to get a correct node detail {d}'
-        has_more = True
+    def get_bitable_records(self, node_token, table_id, page_size=MAX_PAGE_SIZE):
         total_num = None
-        page_token = None
         records = []
         try_num = 0
-        while has_more:
-            if (page_token is None) and (try_num > 0):
-                raise Exception('page_token is None while has more records to fetch.')
-            d = self._get_bitable_records(app_token, table_id, page_token=page_token)
-            try_num += 1
-            has_more = d['has_more']
-            total_num = d['total']
-            if total_num != 0:
-                records.extend(d['items'])
-            page_token = d.get('page_token', None)
+        with Timer() as t:
+            for page in self.iter_bitable_records(node_token, table_id, page_size=page_size, pages=True):
+                try_num += 1
+                total_num = page['total']
+                records.extend(page.get('items') or [])
         item_num = len(records)
         self.log(f'records from {node_token} table {table_id} with {try_num} requests. ApiTotal={total_num}, RecordNum={item_num}')
+        self._operation('get_bitable_records', f'{node_token}/{table_id}', records=item_num, pages=try_num, requests=try_num, elapsed=t.elapsed)
         return records
 
+    def iter_bitable_records(self, node_token, table_id, page_size=MAX_PAGE_SIZE, page_token=None, pages=False, prefetch=True,
+                             filter=None, field_names=None, view_id=None):
+        """Yield the records of a bitable as the pages arrive.
+
+        While the caller works on one page the next one is already being
+        fetched in a background thread. With ``pages=True`` the raw page dicts
+        are yielded instead of records; their ``page_token`` can be saved and
+        passed back as ``page_token`` to resume an interrupted scan.
+        ``filter`` (a records-api formula), ``field_names`` and ``view_id``
+        are passed through to the server.
+        """
+        app_token = self.resolve_bitable(node_token, table_id)
+        page_size = min(page_size, MAX_PAGE_SIZE)
+        fetch = functools.partial(self._get_bitable_records, app_token, table_id, page_size=page_size,
+                                  filter=filter, field_names=field_names, view_id=view_id)
+        executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+        future = None
+        try:
+            d = fetch(page_token=page_token)
+            while True:
+                has_more = d['has_more']
+                page_token = d.get('page_token', None)
+                if has_more:
+                    if page_token is None:
+                        raise Exception('page_token is None while has more records to fetch.')
+                    if executor is not None:
+                        future = executor.submit(fetch, page_token=page_token)
+                if pages:
+                    yield d
+                else:
+                    yield from d.get('items') or []
+                if not has_more:
+                    break
+                d = future.result() if future is not None else fetch(page_token=page_token)
+                future = None
+        finally:
+            if future is not None:
+                future.cancel()
+            if executor is not None:
+                executor.shutdown(wait=False)
+
     def insert_bitable_records(self, node_token, table_id, records):
         # to depreciated...
         self.log('insert_bitable_records will be replaced by append_bitable_records')
         return self.append_bitable_records(node_token, table_id, records)
 
-    def append_bitable_records(self, node_token, table_id, records):
-        d = self.get_node_detail(node_token)
-        app_token = d['obj_token']
-        obj_type = d['obj_type']
-        if obj_type == 'sheet':
-            # app token should be refactored
-            sheet_meta = self.get_sheet_meta(app_token)
-            for sht_info in sheet_meta['sheets']:
-                if 'blockInfo' in sht_info:
-                    token = sht_info['blockInfo']['blockToken']
-                    _app, _table = token.split('_')
-                    if _table == table_id:
-                        app_token = _app
-                        break
-            self.log(f'[bitable] get from sheet: (node){node_token} (bi){app_token} (table){table_id}')
-        elif obj_type == 'bitable':
-            # just do nothing
-            self.log(f'[bitable] get from sheet: (node){node_token} (bi){app_token} (table){table_id}')
-        else:
-            assert False, f'fail to get a correct node detail {d}'
-        num_inserted = 0
-        try_num = 0
+    def append_bitable_records(self, node_token, table_id, records, chunk_size=MAX_BATCH_SIZE, concurrency=1, retries=2):
+        result = self.batch_append_bitable_records(node_token, table_id, records, chunk_size=chunk_size, concurrency=concurrency, retries=retries)
+        num_inserted = result.succeeded
         item_num = len(records)
-        while num_inserted < item_num:
-            end = min(item_num, num_inserted + 100)
-            rs = records[num_inserted: end]
-            self._append_bitable_record(app_token, table_id, rs)
-            num_inserted = end
-            try_num += 1
-        self.log(f'records to {node_token} table {table_id} with {try_num} requests. ItemNum={num_inserted}, RecordNum={item_num}')
+        self.log(f'records to {node_token} table {table_id} with {result.requests} requests. ItemNum={num_inserted}, RecordNum={item_num}')
+        assert not result.failed, f'fail to append {len(result.failed)} of {item_num} records: {result.failed[0].error}'
         return num_inserted
+
+    def batch_append_bitable_records(self, node_token, table_id, records, chunk_size=MAX_BATCH_SIZE, concurrency=1, retries=2) -> BatchResult:
+        """Insert ``records`` (a list of field dicts) in chunks of up to ``chunk_size``.
+
+        With ``concurrency > 1`` the chunks are sent through a bounded worker
+        pool. A failed chunk is retried on its own, up to ``retries`` times,
+        under the same ``client_token`` so a retry can't insert twice. The
+        result lists the created record ids in input order.
+        """
+        result = BatchResult()
+        if not records:
+            return result
+        app_token = self.resolve_bitable(node_token, table_id)
+        chunks = [(str(uuid.uuid4()), c) for c in chunked(records, min(chunk_size, MAX_BATCH_SIZE))]
+
+        def fn(c):
+            return self._append_bitable_record(app_token, table_id, c[1], client_token=c[0])
+
+        with Timer() as t:
+            outcomes, result.requests = run_chunks(fn, chunks, concurrency=concurrency, retries=retries)
+        result.elapsed = t.elapsed
+        for (_, chunk), (created, err) in zip(chunks, outcomes):
+            if err is None:
+                result.results.extend(RecordResult(r.get('record_id'), True) for r in created)
+            else:
+                logger.warning(f'Failed to append {len(chunk)} records: {err}')
+                result.results.extend(RecordResult(None, False, str(err)) for _ in chunk)
+        self._operation('batch_append_bitable_records', f'{node_token}/{table_id}', records=result.succeeded, batches=len(chunks),
+                        requests=result.requests, retries=result.requests - len(chunks), failed=len(result.failed), elapsed=result.elapsed)
+        return result
     
-    def append_bitable_df(self, node_token, table_id, df: pd.DataFrame):
-        d = self.get_node_detail(node_token)
-        app_token = d['obj_token']
-        self.log(f'[bitable] get from sheet: (node){node_token} (bi){app_token} (table){table_id}')
-        self._append_bitable_df(app_token, table_id, df)
-        self.log(f'data to {node_token} table {table_id} with 1 request. RecordNum={len(df)}')
+    def append_bitable_df(self, node_token, table_id, df: pd.DataFrame, chunk_size=MAX_BATCH_SIZE, concurrency=1, retries=2):
+        """Append the rows of ``df`` as records, the frame itself is left untouched."""
+        return self.append_bitable_records(node_token, table_id, df_to_records(df), chunk_size=chunk_size, concurrency=concurrency, retries=retries)
 
-    def get_sheet_data(self, node_token, sheet_id):
-        app_token = self.get_app_token(node_token)
-        values = self._get_sheet_data(app_token, sheet_id)
+    def get_bitable_df(self, node_token, table_id, page_size=MAX_PAGE_SIZE, parse_dates=None) -> pd.DataFrame:
+        """Fetch a bitable as a DataFrame indexed by record_id, built column by column.
+
+        Date fields come back as ms epochs; list them in ``parse_dates`` to get
+        datetime columns instead.
+        """
+        builder = FrameBuilder()
+        for page in self.iter_bitable_records(node_token, table_id, page_size=page_size, pages=True):
+            builder.add(page.get('items') or [])
+        df = builder.to_df(parse_dates=parse_dates)
+        self.log(f'dataframe from {node_token} table {table_id}. Shape={df.shape}')
+        return df
+
+    def get_bitable_columns(self, node_token, table_id, field_names=None, page_size=MAX_PAGE_SIZE) -> ColumnarTable:
+        """Fetch a bitable into typed column buffers laid out from the table's field schema.
+
+        Numbers, dates and checkboxes are packed into arrays, selects are
+        dictionary encoded and short strings interned; each page is dropped
+        right after it's ingested. Much smaller than ``get_bitable_records``
+        for large tables, and ``.to_pandas()`` reuses the buffers.
+        """
+        app_token = self.resolve_bitable(node_token, table_id)
+        table = ColumnarTable(self.get_bitable_fields(app_token, table_id), field_names=field_names)
+        page_num = 0
+        with Timer() as t:
+            for page in self.iter_bitable_records(node_token, table_id, page_size=page_size, pages=True, field_names=field_names):
+                table.add(page.get('items') or [])
+                page_num += 1
+        self.log(f'columns from {node_token} table {table_id} with {page_num} requests. RecordNum={table.num_rows}, Bytes={table.nbytes()}')
+        self._operation('get_bitable_columns', f'{node_token}/{table_id}', records=table.num_rows, pages=page_num, requests=page_num, elapsed=t.elapsed)
+        return table
+
+    def sync_bitable(self, snapshot: BitableSnapshot, modified_field=None, full_scan_interval=3600) -> SyncResult:
+        """Bring ``snapshot`` up to date with only the records changed since the last sync.
+
+        ``modified_field`` names a "last modified time" field of the table.
+        Records modified on or after the day of the snapshot's high-water mark
+        are fetched (the api filters dates by day) and the ones past the mark
+        are applied. Without ``modified_field``, or on the first run, the
+        whole table is pulled. Deleted records are detected by an id-only scan
+        at most every ``full_scan_interval`` seconds.
+        """
+        result = SyncResult()
+        app_token = self.resolve_bitable(snapshot.node_token, snapshot.table_id)
+        table_id = snapshot.table_id
+        hwm = snapshot.high_water_mark
+        if modified_field is None or hwm is None:
+            ids = []
+            for page in self._iter_search_bitable_records(app_token, table_id, {'automatic_fields': True}):
+                result.requests += 1
+                items = page.get('items') or []
+                ids.extend(r['record_id'] for r in items)
+                result.changed += snapshot.apply(items, modified_field)
+            result.deleted = snapshot.retain(ids)
+            result.full_scan = True
+        else:
+            body = {
+                'automatic_fields': True,
+                'filter': {
+                    'conjunction': 'and',
+                    'conditions': [{'field_name': modified_field, 'operator': 'isGreaterEqual', 'value': ['ExactDate', str(hwm)]}],
+                },
+            }
+            for page in self._iter_search_bitable_records(app_token, table_id, body):
+                result.requests += 1
+                items = [r for r in page.get('items') or [] if (r.get('last_modified_time') or r['fields'].get(modified_field) or 0) >= hwm]
+                result.changed += snapshot.apply(items, modified_field)
+            last_scan = snapshot.last_full_scan
+            if last_scan is None or time.time() - last_scan >= full_scan_interval:
+                ids = []
+                for page in self._iter_search_bitable_records(app_token, table_id, {'field_names': [modified_field]}):
+                    result.requests += 1
+                    ids.extend(r['record_id'] for r in page.get('items') or [])
+                result.deleted = snapshot.retain(ids)
+                result.full_scan = True
+        result.high_water_mark = snapshot.high_water_mark
+        self.log(f'synced {snapshot.node_token} table {table_id} with {result.requests} requests. '
+                 f'(changed){result.changed} (deleted){result.deleted} (full_scan){result.full_scan} (hwm){result.high_water_mark}')
+        return result
+
+    def get_sheet_data(self, node_token, sheet_id, block_rows=MAX_SHEET_ROWS, concurrency=4):
+        """Rows of ``sheet_id`` (a sheet id, optionally with a range), read in row blocks.
+
+        Ranges longer than ``block_rows`` rows are split into blocks that are
+        fetched ``concurrency`` at a time and put back together in order.
+        Without explicit bounds the sheet meta row/column counts are used and
+        empty rows (no end row given) and columns (no columns given) after the
+        data are dropped; explicit bounds are returned as the api returns them.
+        """
+        values = []
+        with Timer() as t:
+            for _, rows in self.iter_sheet_data(node_token, sheet_id, block_rows=block_rows, concurrency=concurrency):
+                values.extend(rows)
+        if _split_range(sheet_id)[1] is None and values:
+            width = max(len(r) for r in values)
+            while width and all(len(r) < width or r[width - 1] is None or r[width - 1] == '' for r in values):
+                width -= 1
+            values = [r[:width] for r in values]
         sz = len(values)
         self.log(f'data from {node_token} sheet {sheet_id} with {sz} rows')
+        self._operation('get_sheet_data', f'{node_token}/{sheet_id}', records=sz, elapsed=t.elapsed)
         return values
 
-    def append_sheet_data(self, node_token, sheet_id, values):
+    def iter_sheet_data(self, node_token, sheet_range, block_rows=MAX_SHEET_ROWS, concurrency=4):
+        """Yield ``(first_row, rows)`` blocks of a sheet range in order, ``first_row`` is 1-based.
+
+        Up to ``concurrency`` blocks are fetched ahead of the one being
+        consumed. When the range has no end row, empty rows are held back
+        until more data follows them, so the empty grid below the data is
+        never yielded.
+        """
+        sheet_token = self.get_app_token(node_token)
+        open_ended = _split_range(sheet_range)[4] is None
+        blocks = self._partition_sheet_range(sheet_token, sheet_range, block_rows)
+        fetch = functools.partial(self._get_sheet_data, sheet_token)
+        executor = ThreadPoolExecutor(max_workers=concurrency) if concurrency > 1 and len(blocks) > 1 else None
+        futures = deque()
+        pending = []
+        try:
+            for i, (first_row, rng) in enumerate(blocks):
+                if executor is None:
+                    rows = fetch(rng)
+                else:
+                    while len(futures) < concurrency and i + len(futures) < len(blocks):
+                        futures.append(executor.submit(fetch, blocks[i + len(futures)][1]))
+                    rows = futures.popleft().result()
+                start = first_row - len(pending)
+                rows = pending + rows
+                end = len(rows)
+                while open_ended and end and _is_empty_row(rows[end - 1]):
+                    end -= 1
+                pending = rows[end:]
+                if end:
+                    yield start, rows[:end]
+        finally:
+            for f in futures:
+                f.cancel()
+            if executor is not None:
+                executor.shutdown(wait=False)
+
+    def _partition_sheet_range(self, sheet_token, sheet_range, block_rows):
+        sheet_id, c0, r0, c1, r1 = _split_range(sheet_range)
+        if c0 is None or c1 is None or r1 is None:
+            sheet_meta = self.get_sheet_meta(sheet_token)
+            sheet = next((s for s in sheet_meta['sheets'] if s['sheetId'] == sheet_id), None)
+            assert sheet is not None, f'fail to find sheet {sheet_id} in {sheet_token}'
+            c0 = c0 or 'A'
+            c1 = c1 or _col_letter(max(sheet['columnCount'], 1) - 1)
+            r1 = r1 or sheet['rowCount']
+        r0 = r0 or 1
+        return [(r, f'{sheet_id}!{c0}{r}:{c1}{min(r + block_rows - 1, r1)}') for r in range(r0, r1 + 1, block_rows)]
+
+    def get_sheet_ranges(self, node_token, ranges, concurrency=4):
+        """Fetch many ranges of one spreadsheet through values_batch_get, results in input order.
+
+        Up to ``MAX_BATCH_RANGES`` ranges go in each request.
+        """
+        sheet_token = self.get_app_token(node_token)
+        groups = chunked(list(ranges), MAX_BATCH_RANGES)
+        fn = functools.partial(self._batch_get_sheet_data, sheet_token)
+        outcomes, try_num = run_chunks(fn, groups, concurrency=concurrency)
+        values = []
+        for group, (res, err) in zip(groups, outcomes):
+            assert err is None, f'fail to get_sheet_ranges {group[0]}..{group[-1]}: {err}'
+            values.extend(res)
+        self.log(f'data from {node_token} with {try_num} requests. RangeNum={len(values)}')
+        return values
+
+    def get_sheet_df(self, node_token, sheet_range, header=True, parse_dates=None, block_rows=MAX_SHEET_ROWS, concurrency=4) -> pd.DataFrame:
+        """Read a sheet range into a DataFrame with int/float/text columns, the first row as header."""
+        values = self.get_sheet_data(node_token, sheet_range, block_rows=block_rows, concurrency=concurrency)
+        return sheet_values_to_df(values, header=header, parse_dates=parse_dates)
+
+    def get_sheet_array(self, node_token, sheet_range, dtype=None, block_rows=MAX_SHEET_ROWS, concurrency=4):
+        """Read a sheet range into a 2-d numpy array, e.g. ``dtype=float`` for a numeric block."""
+        values = self.get_sheet_data(node_token, sheet_range, block_rows=block_rows, concurrency=concurrency)
+        return sheet_values_to_array(values, dtype=dtype)
+
+    def append_sheet_data(self, node_token, sheet_id, values, chunk_size=MAX_SHEET_ROWS, concurrency=1, retries=2):
+        """Append rows below the data of ``sheet_id`` (a sheet id, optionally with a range).
+
+        By default every chunk goes through ``values_append`` one after
+        another, stopping at the first failure. A ``values_append`` is never
+        retried: repeating one whose response was lost would append its rows
+        twice.
+
+        With ``concurrency > 1`` only the first chunk is appended, to learn
+        where the data ends; the rest are written to explicit row ranges
+        below it, ``concurrency`` at a time, each retried up to ``retries``
+        times. Those rows are reserved by position only, so anything else
+        appending to the same sheet meanwhile (another process, a sheet
+        ``buffered_writer``) lands in the same rows and is overwritten. Use
+        it only when this call is the sheet's single writer.
+        """
         app_token = self.get_app_token(node_token)
         sz = len(values)
+        if sz == 0:
+            return 0
+        chunks = chunked(values, min(chunk_size, MAX_SHEET_ROWS))
+        with Timer() as t:
+            if concurrency > 1:
+                outcomes, try_num = self._write_sheet_chunks(app_token, sheet_id, chunks, concurrency, retries)
+            else:
+                outcomes, try_num = self._append_sheet_chunks(app_token, sheet_id, chunks)
         row_inserted = 0
-        try_num = 0
-        while row_inserted < sz:
-            end = min(sz, row_inserted + 5000)
-            rs = values[row_inserted: end]
-            self._append_sheet_data(app_token, sheet_id, rs)
-            row_inserted = end
-            try_num += 1
+        failed = sum(len(rs) for rs, (_, err) in zip(chunks, outcomes) if err is not None)
+        self._operation('append_sheet_data', f'{node_token}/{sheet_id}', records=sz - failed, batches=len(chunks), requests=try_num,
+                        failed=failed, elapsed=t.elapsed)
+        for rs, (_, err) in zip(chunks, outcomes):
+            assert err is None, f'fail to append_sheet_data after {row_inserted} rows: {err}'
+            row_inserted += len(rs)
         self.log(f'data to {node_token} table {sheet_id} with {try_num} requests. RowNum={row_inserted}, RecordNum={sz}')
         return row_inserted
 
+    def _append_sheet_chunks(self, sheet_token, sheet_range, chunks):
+        # serial values_append, not idempotent, never retried; chunks after a failure aren't sent
+        outcomes, calls = [], 0
+        for rs in chunks:
+            if outcomes and outcomes[-1][1] is not None:
+                outcomes.append((None, outcomes[-1][1]))
+                continue
+            calls += 1
+            try:
+                outcomes.append((self._append_sheet_data(sheet_token, sheet_range, rs), None))
+            except Exception as e:
+                outcomes.append((None, e))
+        return outcomes, calls
+
+    def _write_sheet_chunks(self, sheet_token, sheet_range, chunks, concurrency, retries):
+        # not idempotent, never retried
+        outcomes, try_num = run_chunks(functools.partial(self._append_sheet_data, sheet_token, sheet_range), chunks[:1])
+        res, err = outcomes[0]
+        if err is not None or len(chunks) == 1:
+            return outcomes + [(None, err)] * (len(chunks) - 1), try_num
+        # e.g. 'e792af!A10:C5009', the next chunk starts right below it
+        sheet_id, updated = res['data']['updates']['updatedRange'].split('!')
+        first_col, _, _, last_row = _parse_range(updated)
+        width = max(len(row) for c in chunks for row in c)
+        col0 = _col_index(first_col)
+        col1 = _col_letter(col0 + max(width, 1) - 1)
+        ranges = []
+        start = last_row + 1
+        for rs in chunks[1:]:
+            ranges.append(f'{sheet_id}!{first_col}{start}:{col1}{start + len(rs) - 1}')
+            start += len(rs)
+        try_num += self._ensure_sheet_rows(sheet_token, sheet_id, start - 1)
+
+        def fn(i):
+            return self._put_sheet_data(sheet_token, ranges[i], chunks[i + 1])
+
+        rest, n = run_chunks(fn, range(len(ranges)), concurrency=concurrency, retries=retries)
+        return outcomes + rest, try_num + n
+
     # utility funcs
     def get_tenant_access_token(self):
+        token, _ = self._fetch_tenant_access_token()
+        return token
+
+    def _fetch_tenant_access_token(self):
         payload = {'app_id': self.app_id, 'app_secret': self.app_secret}
-        r = requests.post('https://open.feishu.cn/open-apis/auth/v3/tenant_access_token/internal', data=payload)
-        d = json.loads(r.text)
+        r, d = self._request('POST', f'{self.base_url}/auth/v3/tenant_access_token/internal', data=payload, idempotent=True)
         assert d.get('code') == 0, f'fail to create tenant access token rsp={r.text}'
         token = d['tenant_access_token']
-        self.log(f'access token fetched: {token}')
-        return token
+        expire = d.get('expire', 7200)
+        self.log(f'access token fetched, expires in {expire}s')
+        return token, expire
+
+    def _iter_pages(self, url, params=None, page_size=50):
+        """Yield the ``data`` of every page of a list api paged by has_more/page_token."""
+        params = {**(params or {}), 'page_size': page_size}
+        while True:
+            headers = {'Authorization': f'Bearer {self.token}'}
+            r, d = self._request('GET', url, params=params, headers=headers)
+            assert d.get('code') == 0, f'fail to list {url}={r.text}'
+            data = d['data']
+            yield data
+            if not data.get('has_more'):
+                break
+            params['page_token'] = data.get('page_token')
+            if params['page_token'] is None:
+                raise Exception('page_token is None while has more items to fetch.')
 
     def get_wiki_spaces(self):
-        headers = {'Authorization': f'Bearer {self.token}'}
-        r = requests.get(f'https://open.feishu.cn/open-apis/wiki/v2/spaces', params={}, headers=headers)
-        d = json.loads(r.text)
-        assert d.get('code') == 0, f'fail to get_wiki_spaces={r.text}'
-        return d['data']['items']
+        return [item for data in self._iter_pages(f'{self.base_url}/wiki/v2/spaces') for item in data.get('items') or []]
 
-    def get_nodes(self, space_id):
-        headers = {'Authorization': f'Bearer {self.token}'}
-        r = requests.get(f'https://open.feishu.cn/open-apis/wiki/v2/spaces/{space_id}/nodes', params={}, headers=headers)
-        d = json.loads(r.text)
-        assert d.get('code') == 0, f'fail to get_nodes={r.text}'
-        nodes = d['data']['items']
-        return nodes
+    def get_nodes(self, space_id, parent_node_token=None):
+        """Child nodes of ``parent_node_token``, or the top level nodes of the space, all pages."""
+        params = {'parent_node_token': parent_node_token} if parent_node_token else {}
+        pages = self._iter_pages(f'{self.base_url}/wiki/v2/spaces/{space_id}/nodes', params=params)
+        return [item for data in pages for item in data.get('items') or []]
+
+    def iter_wiki_nodes(self, space_id, parent_node_token=None):
+        """Walk the node tree of a space depth first, each node before its children."""
+        stack = [iter(self.get_nodes(space_id, parent_node_token))]
+        while stack:
+            node = next(stack[-1], None)
+            if node is None:
+                stack.pop()
+                continue
+            yield node
+            if node.get('has_child'):
+                stack.append(iter(self.get_nodes(space_id, node['node_token'])))
+
+    def export_wiki_space(self, space_id, directory, concurrency=4, pages_per_part=20, format='parquet'):
+        """Export every bitable table and sheet under a wiki space to ``directory``, one parquet (or arrow) file each.
+
+        Progress is checkpointed in ``directory/manifest.json``; running it
+        again after an interruption skips finished tables and continues the
+        others from their last written part. Needs pyarrow. Returns an
+        ``ExportResult``.
+        """
+        from .export import WikiExporter
+
+        exporter = WikiExporter(self, directory, concurrency=concurrency, pages_per_part=pages_per_part, format=format)
+        result = exporter.run(space_id)
+        self.log(f'space {space_id} exported to {directory}. {result.summary()}')
+        return result
 
     def get_node_detail(self, node_token):
         headers = {'Authorization': f'Bearer {self.token}'}
-        r = requests.get(f'https://open.feishu.cn/open-apis/wiki/v2/spaces/get_node', params={'token': node_token}, headers=headers)
-        d = json.loads(r.text)
+        r, d = self._request('GET', f'{self.base_url}/wiki/v2/spaces/get_node', params={'token': node_token}, headers=headers)
         assert d.get('code') == 0, f'fail to get_node_detail={r.text}'
         detail = d['data']['node']
         return detail
 
     def get_app_token(self, node_token):
-        detail = self.get_node_detail(node_token)
-        app_token = detail['obj_token']
+        app_token, _ = self._resolve_node(node_token)
         return app_token
 
+    # ---- node resolution ----
+    def _resolve_node(self, node_token):
+        cached = self.resolver.get(node_token)
+        if cached is not None:
+            return tuple(cached)
+        d = self.get_node_detail(node_token)
+        value = (d['obj_token'], d['obj_type'])
+        self.resolver.set(node_token, list(value))
+        return value
+
+    def resolve_bitable(self, node_token, table_id):
+        """Resolve a wiki node to the app token of its bitable ``table_id``.
+
+        A bitable embedded in a sheet lives under its own app token, found in
+        the ``blockInfo`` of the sheet meta. Results are kept in ``self.resolver``.
+        """
+        key = f'{node_token}/{table_id}'
+        app_token = self.resolver.get(key)
+        if app_token is not None:
+            return app_token
+        app_token, obj_type = self._resolve_node(node_token)
+        if obj_type == 'sheet':
+            sheet_meta = self.get_sheet_meta(app_token)
+            for sht_info in sheet_meta['sheets']:
+                if 'blockInfo' in sht_info:
+                    token = sht_info['blockInfo']['blockToken']
+                    _app, _table = token.split('_')
+                    if _table == table_id:
+                        app_token = _app
+                        break
+            self.log(f'[bitable] get from sheet: (node){node_token} (bi){app_token} (table){table_id}')
+        elif obj_type == 'bitable':
+            self.log(f'[bitable] get from bitable: (node){node_token} (bi){app_token} (table){table_id}')
+        else:
+            assert False, f'fail to get a correct node detail (node){node_token} (type){obj_type}'
+        self.resolver.set(key, app_token)
+        return app_token
+
+    def invalidate_resolution(self, node_token=None, table_id=None):
+        """Forget cached resolutions, for one table, one node or everything."""
+        if node_token is None:
+            self.resolver.clear()
+        elif table_id is not None:
+            self.resolver.invalidate(f'{node_token}/{table_id}')
+        else:
+            prefix = f'{node_token}/'
+            self.resolver.invalidate(node_token, *[k for k in self.resolver.keys() if k.startswith(prefix)])
+
     # sheet funcs
     def get_sheet_meta(self, sheet_token):
         headers = {'Authorization': f'Bearer {self.token}'}
-        r = requests.get(f'https://open.feishu.cn/open-apis/sheets/v2/spreadsheets/{sheet_token}/metainfo', params={}, headers=headers)
-        d = json.loads(r.text)
+        r, d = self._request('GET', f'{self.base_url}/sheets/v2/spreadsheets/{sheet_token}/metainfo', params={}, headers=headers)
         assert d.get('code') == 0, f'fail to get_sheet_meta={r.text}'
         return d['data']
 
@@ -196,70 +716,129 @@ class FeishuConnector:
                 'values': values
             }
         }
-        dt = json.dumps(d, cls=JsonEncoder)
-        req = requests.post(f'https://open.feishu.cn/open-apis/sheets/v2/spreadsheets/{sheet_token}/values_append', data=dt, headers=headers)
-        res = json.loads(req.text)
+        dt = self._codec.dumps(d)
+        req, res = self._request('POST', f'{self.base_url}/sheets/v2/spreadsheets/{sheet_token}/values_append', data=dt, headers=headers)
         assert res.get('code') == 0, f'fail to _append_sheet_data={req.text}'
         cell_num = res['data']['updates']['updatedCells']
         row_num = res['data']['updates']['updatedRows']
-        self.log(f'_append_sheet_data, res={req.text}')
         self.log(f'sheet data appended. (sheet_range){sheet_range} (cells){cell_num} (rows){row_num}')
         # assert d.get('code') == 0, f'fail to get_sheet_meta={r.text}'
         return res
 
+    def _put_sheet_data(self, sheet_token, sheet_range, values):
+        headers = {
+            'Authorization': f'Bearer {self.token}',
+            'Content-Type': 'application/json; charset=utf-8'
+        }
+        dt = self._codec.dumps({'valueRange': {'range': sheet_range, 'values': values}})
+        r, d = self._request('PUT', f'{self.base_url}/sheets/v2/spreadsheets/{sheet_token}/values', data=dt, headers=headers)
+        assert d.get('code') == 0, f'fail to _put_sheet_data={r.text}'
+        self.log(f'sheet data written. (sheet_range){sheet_range} (rows){len(values)}')
+        return d['data']
+
+    def _ensure_sheet_rows(self, sheet_token, sheet_id, row_count):
+        """Grow the grid of ``sheet_id`` to at least ``row_count`` rows, returns the number of calls made."""
+        sheet_meta = self.get_sheet_meta(sheet_token)
+        current = next((s['rowCount'] for s in sheet_meta['sheets'] if s['sheetId'] == sheet_id), None)
+        assert current is not None, f'fail to find sheet {sheet_id} in {sheet_token}'
+        calls = 1
+        headers = {
+            'Authorization': f'Bearer {self.token}',
+            'Content-Type': 'application/json; charset=utf-8'
+        }
+        while current < row_count:
+            length = min(row_count - current, MAX_SHEET_ROWS)
+            dt = self._codec.dumps({'dimension': {'sheetId': sheet_id, 'majorDimension': 'ROWS', 'length': length}})
+            r, d = self._request('POST', f'{self.base_url}/sheets/v2/spreadsheets/{sheet_token}/dimension_range', data=dt, headers=headers)
+            assert d.get('code') == 0, f'fail to _ensure_sheet_rows={r.text}'
+            current += length
+            calls += 1
+        return calls
+
     def _get_sheet_data(self, sheet_token, sheet_range):
         headers = {'Authorization': f'Bearer {self.token}'}
-        r = requests.get(f'https://open.feishu.cn/open-apis/sheets/v2/spreadsheets/{sheet_token}/values/{sheet_range}', params={}, headers=headers)
-        d = json.loads(r.text)
-        assert d.get('code') == 0, f'fail to _get_sheet_data={d.text}'
-        values = d['data']['valueRange']['values']
+        r, d = self._request('GET', f'{self.base_url}/sheets/v2/spreadsheets/{sheet_token}/values/{sheet_range}', params={}, headers=headers)
+        assert d.get('code') == 0, f'fail to _get_sheet_data={r.text}'
+        values = d['data']['valueRange'].get('values') or []
         sz = len(values)
         self.log(f'sheet data fetched. (sheet_range){sheet_range} (rows){sz}')
         return values
 
+    def _batch_get_sheet_data(self, sheet_token, ranges):
+        headers = {'Authorization': f'Bearer {self.token}'}
+        params = {'ranges': ','.join(ranges)}
+        r, d = self._request('GET', f'{self.base_url}/sheets/v2/spreadsheets/{sheet_token}/values_batch_get', params=params, headers=headers)
+        assert d.get('code') == 0, f'fail to _batch_get_sheet_data={r.text}'
+        value_ranges = d['data']['valueRanges']
+        self.log(f'sheet data fetched. (ranges){len(ranges)} (rows){sum(len(v.get("values") or []) for v in value_ranges)}')
+        return [v.get('values') or [] for v in value_ranges]
+
     # ---- bitable ----
     def get_bitable_detail(self, app_token):
         headers = {'Authorization': f'Bearer {self.token}'}
-        r = requests.get(f'https://open.feishu.cn/open-apis/bitable/v1/apps/{app_token}', params={}, headers=headers)
-        d = json.loads(r.text)
+        r, d = self._request('GET', f'{self.base_url}/bitable/v1/apps/{app_token}', params={}, headers=headers)
         assert d.get('code') == 0, f'fail to get_bitable_detail={r.text}'
         return d['data']['app']
 
     def get_bitable_tables(self, app_token):
-        headers = {'Authorization': f'Bearer {self.token}'}
-        r = requests.get(f'https://open.feishu.cn/open-apis/bitable/v1/apps/{app_token}/tables/', params={}, headers=headers)
-        d = json.loads(r.text)
-        assert d.get('code') == 0, f'fail to get_bitable_tables={r.text}'
-        return d['data']['items']
+        pages = self._iter_pages(f'{self.base_url}/bitable/v1/apps/{app_token}/tables', page_size=100)
+        return [item for data in pages for item in data.get('items') or []]
+
+    def get_bitable_fields(self, app_token, table_id):
+        """Field schema of a table: ``field_name``, ``type`` and ``property`` of every field."""
+        pages = self._iter_pages(f'{self.base_url}/bitable/v1/apps/{app_token}/tables/{table_id}/fields', page_size=100)
+        return [item for data in pages for item in data.get('items') or []]
 
     def get_bitable_views(self, app_token, table_id):
         headers = {'Authorization': f'Bearer {self.token}'}
-        r = requests.get(f'https://open.feishu.cn/open-apis/bitable/v1/apps/{app_token}/tables/{table_id}/views', params={}, headers=headers)
-        d = json.loads(r.text)
+        r, d = self._request('GET', f'{self.base_url}/bitable/v1/apps/{app_token}/tables/{table_id}/views', params={}, headers=headers)
         assert d.get('code') == 0, f'fail to get_bitable_views={r.text}'
         return d['data']['items']
 
-    def _get_bitable_records(self, app_token, table_id, page_token=None):
+    def _get_bitable_records(self, app_token, table_id, page_token=None, page_size=100, filter=None, field_names=None, view_id=None):
         headers = {'Authorization': f'Bearer {self.token}'}
         params = {
-            'page_size': 100,
-            'page_token': page_token
+            'page_size': page_size,
+            'page_token': page_token,
+            'filter': filter,
+            'field_names': None if field_names is None else json.dumps(list(field_names), ensure_ascii=False),
+            'view_id': view_id,
         }
-        r = requests.get(f'https://open.feishu.cn/open-apis/bitable/v1/apps/{app_token}/tables/{table_id}/records', params=params, headers=headers)
-        d = json.loads(r.text)
+        r, d = self._request('GET', f'{self.base_url}/bitable/v1/apps/{app_token}/tables/{table_id}/records', params=params, headers=headers)
         assert d.get('code') == 0, f'fail to get_bitable_records={r.text}'
         data = d['data']
         total_num = data['total']
         # total为0时data中没有item字段
-        if total_num == 0:
-            sz = 0
-        else:
-            sz = len(data['items'])
+        sz = len(data.get('items') or [])
         page_token = data.get('page_token', None)
         self.log(f'bitable records fetched. (table_id){table_id} (num){sz} (page_t){page_token} (total){total_num}')
         return data
 
-    def _append_bitable_record(self, app_token, table_id, records):
+    def _search_bitable_records(self, app_token, table_id, body, page_token=None, page_size=MAX_PAGE_SIZE):
+        headers = {
+            'Authorization': f'Bearer {self.token}',
+            'Content-Type': 'application/json; charset=utf-8'
+        }
+        params = {'page_size': page_size, 'page_token': page_token}
+        dt = self._codec.dumps(body)
+        r, d = self._request('POST', f'{self.base_url}/bitable/v1/apps/{app_token}/tables/{table_id}/records/search', params=params, data=dt, headers=headers, idempotent=True)
+        assert d.get('code') == 0, f'fail to _search_bitable_records={r.text}'
+        data = d['data']
+        self.log(f'bitable records searched. (table_id){table_id} (num){len(data.get("items") or [])} (total){data.get("total")}')
+        return data
+
+    def _iter_search_bitable_records(self, app_token, table_id, body):
+        page_token = None
+        while True:
+            data = self._search_bitable_records(app_token, table_id, body, page_token=page_token)
+            yield data
+            page_token = data.get('page_token')
+            if not data.get('has_more'):
+                break
+            if page_token is None:
+                raise Exception('page_token is None while has more records to fetch.')
+
+    def _append_bitable_record(self, app_token, table_id, records, client_token=None):
         headers = {
             'Authorization': f'Bearer {self.token}',
             'Content-Type': 'application/json; charset=utf-8'
@@ -267,158 +846,186 @@ class FeishuConnector:
         ds = []
         for r in records:
             ds.append({'fields': r})
-        dt = json.dumps({'records': ds})
-        r = requests.post(f'https://open.feishu.cn/open-apis/bitable/v1/apps/{app_token}/tables/{table_id}/records/batch_create', data=dt, headers=headers)
-        d = json.loads(r.text)
+        dt = self._codec.dumps({'records': ds})
+        params = {'client_token': client_token} if client_token else {}
+        r, d = self._request('POST', f'{self.base_url}/bitable/v1/apps/{app_token}/tables/{table_id}/records/batch_create', params=params, data=dt, headers=headers)
         sz = len(records)
         assert d.get('code') == 0, f'fail to _append_bitable_record={r.text}'
         self.log(f'bitable records inserted. (table_id){table_id} (num){sz}')
         return d['data']['records']
     
-    def _append_bitable_df(self, app_token, table_id, df: pd.DataFrame):
-        
+    def _batch_update_bitable_records(self, app_token, table_id, records):
         headers = {
             'Authorization': f'Bearer {self.token}',
             'Content-Type': 'application/json; charset=utf-8'
         }
-        
-        # Convert timestamp data to int
-        timestamp_columns = df.select_dtypes(include='datetime').columns
-        for col in timestamp_columns:
-            df[col] = (df[col].astype(int) / 10**6).astype(int)
-        self.log(f'Timestamp columns: {timestamp_columns.tolist()}, converted to int')
-        
-        # Convert dataframe to format required by Feishu API
-        records = []
-        for _, row in df.iterrows():
-            records.append({
-                'record_id': create_unique_record_id(),
-                'fields': row.to_dict(),
-            })
-            
-        dt = json.dumps({'records': records}, indent=4)
-        r = requests.post(f'https://open.feishu.cn/open-apis/bitable/v1/apps/{app_token}/tables/{table_id}/records/batch_create', data=dt, headers=headers)
-        d = json.loads(r.text)
+        dt = self._codec.dumps({'records': [{'record_id': r['record_id'], 'fields': r['fields']} for r in records]})
+        r, d = self._request('POST', f'{self.base_url}/bitable/v1/apps/{app_token}/tables/{table_id}/records/batch_update', data=dt, headers=headers, idempotent=True)
         sz = len(records)
-        assert d.get('code') == 0, f'fail to _append_bitable_df={r.text}'
-        self.log(f'bitable records inserted. (table_id){table_id} (num){sz}')
+        assert d.get('code') == 0, f'fail to _batch_update_bitable_records={r.text}'
+        self.log(f'bitable records updated. (table_id){table_id} (num){sz}')
         return d['data']['records']
 
-    def upload_images(self, image_binary: BinaryIO) -> str:
-        import json
+    def _append_bitable_df(self, app_token, table_id, df: pd.DataFrame):
+        created = []
+        for records in iter_df_records(df, MAX_BATCH_SIZE):
+            created.extend(self._append_bitable_record(app_token, table_id, records, client_token=str(uuid.uuid4())))
+        return created
 
+    def upload_images(self, image_binary: Union[BinaryIO, bytes]) -> str:
+        """Upload an image and return its ``image_key``; the same bytes are only uploaded once."""
+        content = image_binary if isinstance(image_binary, bytes) else image_binary.read()
+        image_key = self.images.get_image_key(content)
+        if image_key is not None:
+            self.log(f'image upload skipped, cached (image_key){image_key}')
+            return image_key
         form = {'image_type': 'message',
-                'image': (image_binary)}
+                'image': ('image.png', content, 'image/png')}
         multi_form = MultipartEncoder(form)
-        self.log(f'(multi_form){multi_form}')
         headers = {
             'Authorization': f'Bearer {self.token}',
         }
         headers['Content-Type'] = multi_form.content_type
-        rsp = requests.post('https://open.feishu.cn/open-apis/im/v1/images', headers=headers, data=multi_form)
-        self.log(rsp.headers['X-Tt-Logid'])  # for debug or oncall
-        d = json.loads(rsp.text)
+        # encoded up front so the body can be replayed on retry
+        rsp, d = self._request('POST', f'{self.base_url}/im/v1/images', headers=headers, data=multi_form.to_string())
+        self.log(rsp.headers.get('X-Tt-Logid'))  # for debug or oncall
         assert d.get('code') == 0, f'fail to upload image rsp={rsp.text}'
         image_key = d['data']['image_key']
-        self.log(f'access token fetched: {image_key}')
+        self.images.put_image_key(content, image_key)
+        self.log(f'image uploaded: {image_key}')
         return image_key
 
     def send_image(self, fp, title, target=None):
         image_key = self.upload_images(fp)
-        elements = [{
-            "tag": "img",
-            "title": {
-                "tag": "plain_text",
-                "content": title,
-            },
-            "img_key": image_key,
-            "mode": "fit_horizontal",
-            "alt": {
-                "tag": "plain_text",
-                "content": "",
-            },
-            "compact_width": True,
-        }]
+        elements = build_image_elements(image_key, title)
         self.send_webhook_msg(target=target, title=title, elements=elements)
 
-    def send_dataframe(self, df: pd.DataFrame, title: str, target=None):
+    def render_dataframe(self, df: pd.DataFrame, **options) -> bytes:
+        """PNG of ``df``, rendered once per distinct content and render options."""
+        digest = dataframe_digest(df, **options)
+        png = None if digest is None else self.images.get_png(digest)
+        if png is None:
+            png = render_dataframe(df, **options)
+            if digest is not None:
+                self.images.put_png(digest, png)
+        return png
+
+    def send_dataframe(self, df: pd.DataFrame, title: str, target=None, **options):
         try:
-            with tempfile.TemporaryFile() as fp:
-                dfi.export(df, fp, table_conversion='matplotlib')
-                fp.seek(0)
-                self.send_image(fp, title, target)
-        except Exception as e:
-            self.log(e)
+            self.send_image(self.render_dataframe(df, **options), title, target)
+        except Exception:
+            logger.exception(f'fail to send dataframe {title!r}')
+
+    def send_dataframes(self, items: Iterable[Tuple[pd.DataFrame, str, Optional[str]]], processes: Optional[int] = None, **options):
+        """Send several ``(df, title, target)`` reports, rendering cache misses in a process pool."""
+        items = list(items)
+        digests = [dataframe_digest(df, **options) for df, _, _ in items]
+        pngs = [None if d is None else self.images.get_png(d) for d in digests]
+        missing = [i for i, png in enumerate(pngs) if png is None]
+        if len(missing) > 1 and processes != 1:
+            with ProcessPoolExecutor(max_workers=processes) as executor:
+                futures = {i: executor.submit(render_dataframe, items[i][0], **options) for i in missing}
+                for i, future in futures.items():
+                    try:
+                        pngs[i] = future.result()
+                    except Exception:
+                        logger.exception(f'fail to render dataframe {items[i][1]!r}')
+        else:
+            for i in missing:
+                try:
+                    pngs[i] = render_dataframe(items[i][0], **options)
+                except Exception:
+                    logger.exception(f'fail to render dataframe {items[i][1]!r}')
+        for i in missing:
+            if pngs[i] is not None and digests[i] is not None:
+                self.images.put_png(digests[i], pngs[i])
+        for (_, title, target), png in zip(items, pngs):
+            if png is None:
+                continue
+            try:
+                self.send_image(png, title, target)
+            except Exception:
+                logger.exception(f'fail to send dataframe {title!r}')
+
+    def enable_webhook_dispatcher(self, **kwargs) -> WebhookDispatcher:
+        """Send webhook messages from a background worker from now on.
+
+        Keyword arguments go to ``WebhookDispatcher`` (rate, coalesce_window,
+        dedupe_window, max_batch, max_queue). ``close()`` flushes the queue.
+        """
+        if self._dispatcher is None:
+            self._dispatcher = WebhookDispatcher(self._webhooks, self._codec.dumps, log=self.log, **kwargs)
+        return self._dispatcher
+
+    def buffered_writer(self, node_token, table_id=None, sheet_range=None, **kwargs):
+        """A ``BufferedWriter`` appending to a bitable table, or to a sheet range when ``sheet_range`` is given.
+
+        Keyword arguments go to ``BufferedWriter`` (max_rows, max_delay,
+        max_buffer, journal, fsync). ``close()`` flushes every writer.
+        """
+        from .writer import BufferedWriter
+
+        writer = BufferedWriter(self, node_token, table_id=table_id, sheet_range=sheet_range, **kwargs)
+        self._writers.append(writer)
+        return writer
+
+    @property
+    def webhook_dispatcher(self) -> Optional[WebhookDispatcher]:
+        return self._dispatcher
 
     def send_webhook_msg(self, target=None, title=None, content=None, success=True, buttons=None, elements=None):
         '''
         buttons = [(content, url), (content, url)]
         '''
-        msg = {
-                "msg_type": "interactive",
-                "card": {
-                    "config": {
-                        "wide_screen_mode": True
-                    },
-                    "elements": [{
-                        "tag": "div",
-                        "text":  {
-                            "content": content or '',
-                            "tag": "lark_md"
-                        }
-                    }] if elements is None else elements,
-                    "header": {
-                        "template": "green" if success else "red",
-                        "title": {
-                            "content": title or '',
-                            "tag": "plain_text"
-                        }
-                    }
-                }
-            }
-        if buttons:
-            actions = []
-            for (_c, _u) in buttons:
-                actions.append({
-                    "tag": "button",
-                    "text": {
-                        "content": _c,
-                        "tag": "plain_text"
-                    },
-                    "type": "primary",
-                    "url": _u
-                })
-            msg['card']['elements'].append({
-                "actions": actions,
-                "tag": "action"
-            })
+        if self._dispatcher is not None:
+            self._dispatcher.submit(target, title=title, content=content, success=success, buttons=buttons, elements=elements)
+            return
+        msg = build_webhook_msg(title=title, content=content, success=success, buttons=buttons, elements=elements)
         try:
             url = self._webhooks[target] if target is not None else self._webhooks['default']
         except KeyError:
             url = ''
         if url:
-            rsp = requests.post(
-                url=url, json=msg, headers={
+            rsp = self._http.post(
+                url=url, data=self._codec.dumps(msg), headers={
                     "Content-Type": "application/json"
                 })
             self.log(rsp.text)
         else:
-            self.log('cannot find proper webhook')
+            logger.warning('cannot find proper webhook')
 
-    def get_filtered_records(self, node_token, table_id, filter_conditions):
+    def get_filtered_records(self, node_token, table_id, filter_conditions, field_names=None, view_id=None):
         """
         根据给定的条件筛选飞书多维表格中的记录。
 
+        能用公式表达的条件(数字/字符串的等于、范围、in)下推到服务端过滤, 其余条件在本地筛选。
+
         :param node_token: 飞书多维表格的节点令牌
         :param table_id: 飞书多维表格的ID
-        :param filter_conditions: 筛选条件，字典格式，字段名作为键，期望值作为值
+        :param filter_conditions: 筛选条件，字典格式，字段名作为键，期望值作为值;
+            值也可以是 {'>=': 1, '<': 10} / {'in': [...]} 形式的运算符字典, 或者对字段值做判断的函数
+        :param field_names: 只返回这些字段
+        :param view_id: 只在该视图中查询
         :return: 符合条件的记录列表
         """
-        all_records = self.get_bitable_records(node_token, table_id)
-        filtered_records = [record for record in all_records if
-                            all(record['fields'].get(key) == value for key, value in filter_conditions.items())]
-        # print('filtered_records:',filtered_records)
-        return filtered_records
+        formula, local = compile_filter(filter_conditions)
+        fetch_fields = field_names
+        if field_names is not None and local:
+            # 本地筛选用到的字段也要取回来, 筛选后再去掉
+            fetch_fields = list(field_names) + [k for k, _ in local if k not in field_names]
+        records = []
+        pages = 0
+        for page in self.iter_bitable_records(node_token, table_id, pages=True, filter=formula, field_names=fetch_fields, view_id=view_id):
+            pages += 1
+            for record in page.get('items') or []:
+                if match(record['fields'], local):
+                    records.append(record)
+        if fetch_fields is not field_names:
+            keep = set(field_names)
+            for record in records:
+                record['fields'] = {k: v for k, v in record['fields'].items() if k in keep}
+        self.log(f'records from {node_token} table {table_id} with {pages} requests. (filter){formula} (local){len(local)} (num){len(records)}')
+        return records
 
     def update_bitable_record(self, node_token, table_id, filter_conditions, update_field, new_value):
         """
@@ -429,48 +1036,88 @@ class FeishuConnector:
         """
         return self.update_bitable_records(node_token, table_id, filter_conditions, {update_field: new_value})
 
-    def update_bitable_records(self, node_token, table_id, filter_conditions, update_fields):
+    def update_bitable_records(self, node_token, table_id, filter_conditions, update_fields, chunk_size=MAX_BATCH_SIZE, concurrency=4):
         """
         更新飞书多维表格中符合条件的记录的指定字段（更新多字段）。
 
+        只发送值有变化的字段, 没有变化的记录直接跳过; 通过 records/batch_update 批量并发更新。
+
         :param node_token: 飞书多维表格的节点令牌
         :param table_id: 飞书多维表格的ID
         :param filter_conditions: 筛选条件，字典格式，字段名作为键，期望值作为值
         :param update_fields: 字典格式：{‘更新的字段名1’：‘新的字段值1’，‘更新的字段名2’：‘新的字段值2’}
+        :param chunk_size: 每个请求更新的记录数, 最大500
+        :param concurrency: 并发请求数
+        :return: BatchResult, 每条记录的更新结果
         """
-        # 获取节点详情以确定使用的app_token
-        d = self.get_node_detail(node_token)
-        app_token = d['obj_token']
-        # 获取符合条件的记录
-        records = self.get_filtered_records(node_token, table_id, filter_conditions)
-        updated_num = 0
+        # 获取符合条件的记录, 只取需要比较的字段
+        records = self.get_filtered_records(node_token, table_id, filter_conditions, field_names=list(update_fields))
+        updates = []
         for record in records:
-            # 构建更新后的记录
-            updated_record = {
-                'record_id': record['record_id'],  # 需要指定记录ID
-                'fields': {
-                    **record['fields'],  # 保留原有字段
-                    **update_fields  # 更新指定字段
-                }
-            }
-            updated_count = 0
-            # 调用API更新记录
-            headers = {
-                'Authorization': f'Bearer {self.token}',
-                'Content-Type': 'application/json; charset=utf-8'
-            }
-            record_id = record['record_id']
-            # print('record:',record)
-
-            url = f'https://open.feishu.cn/open-apis/bitable/v1/apps/{app_token}/tables/{table_id}/records/{record_id}'
-            response = requests.put(url, headers=headers, json=updated_record)
-            # print('response:',response.json())
-            # 检查API调用是否成功
-            if response.status_code == 200:
-                # print('api调用成功')
-                updated_count += 1
-            else:
-                # print('api调用失败')
-                self.log(f'Failed to update record {record["record_id"]}: {response.text}')
-        # 返回更新的记录数量
-        return updated_num
+            # 只保留值有变化的字段
+            changed = {k: v for k, v in update_fields.items() if record['fields'].get(k) != v}
+            if changed:
+                updates.append({'record_id': record['record_id'], 'fields': changed})
+        result = self.batch_update_bitable_records(node_token, table_id, updates, chunk_size=chunk_size, concurrency=concurrency)
+        result.skipped += len(records) - len(updates)
+        return result
+
+    def batch_update_bitable_records(self, node_token, table_id, records, chunk_size=MAX_BATCH_SIZE, concurrency=4) -> BatchResult:
+        """Update ``[{'record_id': ..., 'fields': {...}}, ...]`` through records/batch_update.
+
+        Records are sent in chunks of up to ``chunk_size`` with at most
+        ``concurrency`` requests in flight. A failed chunk marks each of its
+        records as failed without aborting the others.
+        """
+        result = BatchResult()
+        if not records:
+            return result
+        app_token = self.resolve_bitable(node_token, table_id)
+        chunks = chunked(records, min(chunk_size, MAX_BATCH_SIZE))
+        fn = functools.partial(self._batch_update_bitable_records, app_token, table_id)
+        with Timer() as t:
+            outcomes, result.requests = run_chunks(fn, chunks, concurrency=concurrency)
+        result.elapsed = t.elapsed
+        for chunk, (_, err) in zip(chunks, outcomes):
+            for r in chunk:
+                result.results.append(RecordResult(r['record_id'], err is None, None if err is None else str(err)))
+            if err is not None:
+                logger.warning(f'Failed to update {len(chunk)} records: {err}')
+        self.log(f'records updated in {node_token} table {table_id}. {result.summary()}')
+        self._operation('batch_update_bitable_records', f'{node_token}/{table_id}', records=result.succeeded, batches=len(chunks),
+                        requests=result.requests, retries=result.requests - len(chunks), failed=len(result.failed), elapsed=result.elapsed)
+        return result
+
+    def upsert_bitable_records(self, node_token, table_id, records, keys, dry_run=False, chunk_size=MAX_BATCH_SIZE,
+                               concurrency=4, retries=2) -> UpsertResult:
+        """Insert or update ``records`` (field dicts) matched on the ``keys`` field(s).
+
+        The table is scanned once, fetching only the key and input fields, into
+        an index of key -> record_id and field hashes. Unknown keys are
+        appended, known keys are updated with just the fields whose value
+        changed, and unchanged rows send nothing. With ``dry_run=True``
+        nothing is written; ``result.plan`` holds the inserts and updates.
+        """
+        keys = [keys] if isinstance(keys, str) else list(keys)
+        records = list(records)
+        fields = list(dict.fromkeys(name for r in records for name in r if name not in keys))
+        index = KeyIndex(keys, fields)
+        for page in self.iter_bitable_records(node_token, table_id, pages=True, field_names=keys + fields):
+            index.add(page.get('items') or [])
+        plan = plan_upsert(index, records)
+        result = UpsertResult(plan, dry_run=dry_run, duplicates=index.duplicates)
+        if index.duplicates:
+            self.log(f'{index.duplicates} records in {node_token} table {table_id} share a key with an earlier one, only the first is updated')
+        if not dry_run:
+            result.inserted = self.batch_append_bitable_records(node_token, table_id, plan.inserts, chunk_size=chunk_size,
+                                                                concurrency=concurrency, retries=retries)
+            result.updated = self.batch_update_bitable_records(node_token, table_id, plan.updates, chunk_size=chunk_size,
+                                                               concurrency=concurrency)
+        self.log(f'records upserted in {node_token} table {table_id} on {keys}. (existing){len(index)} {result.summary()}')
+        return result
+
+    def upsert_bitable_df(self, node_token, table_id, df: pd.DataFrame, keys, dry_run=False, chunk_size=MAX_BATCH_SIZE,
+                          concurrency=4, retries=2) -> UpsertResult:
+        """``upsert_bitable_records`` for the rows of ``df``, NaN cells leave the existing value alone."""
+        return self.upsert_bitable_records(node_token, table_id, df_to_records(df), keys, dry_run=dry_run, chunk_size=chunk_size,
+                                           concurrency=concurrency, retries=retries)
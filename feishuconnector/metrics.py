@@ -0,0 +1,233 @@
+import bisect
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+
+# instrumentation levels: nothing, one summary per operation, every api call as well
+OFF, SUMMARY, REQUEST = 0, 1, 2
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class RequestEvent:
+    """One attempt of one api call, retries included."""
+    endpoint: str
+    status: Optional[int]
+    code: Optional[int]
+    elapsed: float
+    bytes_sent: int
+    bytes_received: int
+    # 0 for the first try, >0 for retries of the same call
+    attempt: int = 0
+    # exception class name when no response came back
+    error: Optional[str] = None
+
+
+@dataclass
+class OperationEvent:
+    """Summary of one connector call such as ``get_bitable_records``."""
+    operation: str
+    target: str
+    records: int = 0
+    pages: int = 0
+    batches: int = 0
+    requests: int = 0
+    retries: int = 0
+    failed: int = 0
+    elapsed: float = 0.0
+
+
+class Hook:
+    """Base class of instrumentation hooks, override what you need."""
+
+    def on_request(self, event: RequestEvent) -> None:
+        pass
+
+    def on_operation(self, event: OperationEvent) -> None:
+        pass
+
+
+class Instrumentation:
+    """Fans request and operation events out to hooks.
+
+    The connectors check ``requests_enabled`` / ``operations_enabled`` before
+    timing or building anything, so with no hooks or ``level=OFF`` the hot
+    path pays one attribute lookup per call.
+    """
+
+    def __init__(self, hooks: Iterable[Hook] = (), level: int = REQUEST):
+        self.hooks = list(hooks)
+        self.level = level
+        self._update()
+
+    def _update(self):
+        self.requests_enabled = bool(self.hooks) and self.level >= REQUEST
+        self.operations_enabled = bool(self.hooks) and self.level >= SUMMARY
+
+    def add_hook(self, hook: Hook) -> Hook:
+        self.hooks.append(hook)
+        self._update()
+        return hook
+
+    def remove_hook(self, hook: Hook) -> None:
+        self.hooks.remove(hook)
+        self._update()
+
+    def set_level(self, level: int) -> None:
+        self.level = level
+        self._update()
+
+    def request(self, event: RequestEvent) -> None:
+        for hook in self.hooks:
+            try:
+                hook.on_request(event)
+            except Exception:
+                # a broken hook must not fail the api call
+                logger.exception(f'instrumentation hook {hook!r} failed')
+
+    def operation(self, event: OperationEvent) -> None:
+        for hook in self.hooks:
+            try:
+                hook.on_operation(event)
+            except Exception:
+                logger.exception(f'instrumentation hook {hook!r} failed')
+
+
+class CallbackHook(Hook):
+    """Calls ``fn(event)`` with every RequestEvent and OperationEvent."""
+
+    def __init__(self, fn: Callable[[object], None]):
+        self.fn = fn
+
+    def on_request(self, event):
+        self.fn(event)
+
+    def on_operation(self, event):
+        self.fn(event)
+
+
+class LoggingHook(Hook):
+    """Writes events to a ``logging`` logger, requests at DEBUG and operations at INFO by default."""
+
+    def __init__(self, logger_name: str = 'feishuconnector.metrics', request_level: int = logging.DEBUG,
+                 operation_level: int = logging.INFO):
+        self.logger = logging.getLogger(logger_name)
+        self.request_level = request_level
+        self.operation_level = operation_level
+
+    def on_request(self, e):
+        if self.logger.isEnabledFor(self.request_level):
+            self.logger.log(self.request_level, f'{e.endpoint} (status){e.status} (code){e.code} (elapsed){e.elapsed * 1000:.1f}ms '
+                                                f'(sent){e.bytes_sent} (received){e.bytes_received} (attempt){e.attempt}'
+                                                + (f' (error){e.error}' if e.error else ''))
+
+    def on_operation(self, e):
+        if self.logger.isEnabledFor(self.operation_level):
+            self.logger.log(self.operation_level, f'{e.operation} {e.target} (records){e.records} (pages){e.pages} (batches){e.batches} '
+                                                  f'(requests){e.requests} (retries){e.retries} (failed){e.failed} (elapsed){e.elapsed:.2f}s')
+
+
+class _Histogram:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        if i < len(self.counts):
+            self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+class PrometheusHook(Hook):
+    """Prometheus-style counters and histograms kept in process.
+
+    ``render()`` returns them in the text exposition format, ready to be
+    served from a ``/metrics`` handler; ``counters()`` returns them as a dict.
+    """
+
+    def __init__(self, prefix: str = 'feishu', buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.prefix = prefix
+        self.buckets = tuple(sorted(buckets))
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def _inc(self, name, labels, value=1):
+        key = (name, labels)
+        self._counters[key] = self._counters.get(key, 0) + value
+
+    def _observe(self, name, labels, value):
+        key = (name, labels)
+        h = self._histograms.get(key)
+        if h is None:
+            h = self._histograms[key] = _Histogram(self.buckets)
+        h.observe(value)
+
+    def on_request(self, e):
+        p = self.prefix
+        endpoint = (('endpoint', e.endpoint),)
+        with self._lock:
+            self._inc(f'{p}_requests_total', endpoint + (('status', str(e.status)), ('code', str(e.code))))
+            self._inc(f'{p}_request_bytes_total', endpoint + (('direction', 'sent'),), e.bytes_sent)
+            self._inc(f'{p}_request_bytes_total', endpoint + (('direction', 'received'),), e.bytes_received)
+            if e.attempt:
+                self._inc(f'{p}_retries_total', endpoint)
+            if e.error is not None:
+                self._inc(f'{p}_request_errors_total', endpoint + (('error', e.error),))
+            self._observe(f'{p}_request_duration_seconds', endpoint, e.elapsed)
+
+    def on_operation(self, e):
+        p = self.prefix
+        op = (('operation', e.operation),)
+        with self._lock:
+            self._inc(f'{p}_operations_total', op)
+            self._inc(f'{p}_operation_records_total', op, e.records)
+            self._inc(f'{p}_operation_failed_records_total', op, e.failed)
+            self._inc(f'{p}_operation_requests_total', op, e.requests)
+            self._observe(f'{p}_operation_duration_seconds', op, e.elapsed)
+
+    def counters(self) -> Dict[str, Dict[Tuple, float]]:
+        out = {}
+        with self._lock:
+            for (name, labels), value in self._counters.items():
+                out.setdefault(name, {})[labels] = value
+        return out
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            seen = set()
+            for (name, labels), value in sorted(self._counters.items()):
+                if name not in seen:
+                    seen.add(name)
+                    lines.append(f'# TYPE {name} counter')
+                lines.append(f'{name}{_labels(labels)} {value}')
+            for (name, labels), h in sorted(self._histograms.items(), key=lambda x: x[0]):
+                if name not in seen:
+                    seen.add(name)
+                    lines.append(f'# TYPE {name} histogram')
+                cumulative = 0
+                for bound, n in zip(h.buckets, h.counts):
+                    cumulative += n
+                    lines.append(f'{name}_bucket{_labels(labels + (("le", repr(float(bound))),))} {cumulative}')
+                lines.append(f'{name}_bucket{_labels(labels + (("le", "+Inf"),))} {h.count}')
+                lines.append(f'{name}_sum{_labels(labels)} {h.sum}')
+                lines.append(f'{name}_count{_labels(labels)} {h.count}')
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(labels: Tuple) -> str:
+    if not labels:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in labels)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + '}'
@@ -0,0 +1,112 @@
+import math
+import decimal
+import numbers
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+# condition operator -> (formula operator, local predicate)
+_OPERATORS = {
+    '=': ('=', lambda a, b: a == b),
+    '!=': ('!=', lambda a, b: a != b),
+    '>': ('>', lambda a, b: a is not None and a > b),
+    '>=': ('>=', lambda a, b: a is not None and a >= b),
+    '<': ('<', lambda a, b: a is not None and a < b),
+    '<=': ('<=', lambda a, b: a is not None and a <= b),
+}
+_ALIASES = {'eq': '=', '==': '=', 'ne': '!=', 'gt': '>', 'gte': '>=', 'lt': '<', 'lte': '<='}
+
+
+def _literal(value) -> Optional[str]:
+    """Formula literal for ``value``, or None if the server can't compare it reliably."""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, numbers.Integral):
+        return str(int(value))
+    if isinstance(value, numbers.Real):
+        value = float(value)
+        if not math.isfinite(value):
+            # nan/inf have no formula literal, compared locally
+            return None
+        # plain digits, formulas don't accept exponent notation such as 1e+20
+        return format(decimal.Decimal(repr(value)), 'f')
+    if isinstance(value, str) and '"' not in value:
+        return f'"{value}"'
+    return None
+
+
+def _field(name: str) -> Optional[str]:
+    return None if ']' in name else f'CurrentValue.[{name}]'
+
+
+def _compile_one(name: str, op: str, value: Any) -> Tuple[Optional[str], Callable[[Any], bool]]:
+    if op == 'in':
+        values = list(value)
+        local = lambda v: v in values
+        literals = [_literal(v) for v in values]
+        if not values or _field(name) is None or None in literals:
+            return None, local
+        parts = [f'{_field(name)}={lit}' for lit in literals]
+        return (parts[0] if len(parts) == 1 else f'OR({", ".join(parts)})'), local
+    op = _ALIASES.get(op, op)
+    assert op in _OPERATORS, f'unsupported filter operator {op}'
+    formula_op, fn = _OPERATORS[op]
+    local = lambda v: fn(v, value)
+    lit = _literal(value)
+    if lit is None or _field(name) is None:
+        return None, local
+    return f'{_field(name)}{formula_op}{lit}', local
+
+
+def _operators(cond) -> List[Tuple[str, Any]]:
+    # a dict of known operators, anything else (a url or user cell, say) is a value to match
+    if isinstance(cond, dict) and cond and all(op == 'in' or op in _OPERATORS or op in _ALIASES for op in cond):
+        return list(cond.items())
+    return [('=', cond)]
+
+
+def compile_filter(conditions: Optional[Dict[str, Any]]) -> Tuple[Optional[str], List[Tuple[str, Callable[[Any], bool]]]]:
+    """Split ``filter_conditions`` into a records-api filter formula and local predicates.
+
+    Each condition maps a field name to one of:
+
+    - a plain value, matched by equality
+    - a dict of operators, e.g. ``{'>=': 10, '<': 20}`` or ``{'in': ['a', 'b']}``;
+      a dict with any other key is a plain value
+    - a callable taking the field value, always evaluated locally
+
+    Numbers and strings are pushed to the server. Anything it can't express
+    (booleans, lists, dates, callables) is returned as ``(field, predicate)``
+    pairs to be checked on the fetched records.
+    """
+    formulas = []
+    local = []
+    for name, cond in (conditions or {}).items():
+        if callable(cond):
+            local.append((name, cond))
+            continue
+        ops = _operators(cond)
+        for op, value in ops:
+            formula, predicate = _compile_one(name, op, value)
+            if formula is None:
+                local.append((name, predicate))
+            else:
+                formulas.append(formula)
+    if not formulas:
+        return None, local
+    return (formulas[0] if len(formulas) == 1 else f'AND({", ".join(formulas)})'), local
+
+
+def compile_local(conditions: Optional[Dict[str, Any]]) -> List[Tuple[str, Callable[[Any], bool]]]:
+    """Predicates for every condition, to evaluate ``filter_conditions`` entirely locally."""
+    local = []
+    for name, cond in (conditions or {}).items():
+        if callable(cond):
+            local.append((name, cond))
+            continue
+        ops = _operators(cond)
+        local.extend((name, _compile_one(name, op, value)[1]) for op, value in ops)
+    return local
+
+
+def match(fields: Dict[str, Any], predicates: List[Tuple[str, Callable[[Any], bool]]]) -> bool:
+    return all(fn(fields.get(name)) for name, fn in predicates)
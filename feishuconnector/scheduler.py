@@ -0,0 +1,203 @@
+import re
+import time
+import random
+import threading
+from typing import Callable, Dict, Optional, Tuple
+from urllib.parse import urlparse
+
+import requests
+
+
+# feishu codes worth retrying: frequency limits, write conflicts, transient backend errors.
+# Only the frequency limits are safe for every call, the rest may follow a write that went through
+THROTTLE_CODES = {99991400, 1254290, 90217}
+RETRYABLE_CODES = THROTTLE_CODES | {1254291, 1254607, 1255040}
+
+# requests per second (rate, burst) for endpoint keys, see endpoint_key
+DEFAULT_RATES = {
+    'POST auth/v3/tenant_access_token/internal': (5, 5),
+}
+DEFAULT_RATE = (50, 50)
+
+_ID_SEGMENT = re.compile(r'^(v\d+|[a-z_]+)$')
+
+
+def endpoint_key(method: str, url: str) -> str:
+    """``'GET https://.../open-apis/bitable/v1/apps/bascX/tables/tblY/records'`` -> ``'GET bitable/v1/apps/:id/tables/:id/records'``"""
+    path = urlparse(url).path
+    if '/open-apis/' in path:
+        path = path.split('/open-apis/', 1)[1]
+    segments = [s if _ID_SEGMENT.match(s) else ':id' for s in path.strip('/').split('/')]
+    return f'{method.upper()} {"/".join(segments)}'
+
+
+class TokenBucket:
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """Take one token, sleeping until one is available. Returns the time waited."""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+
+class AdaptiveLimiter:
+    """AIMD cap on requests in flight.
+
+    The cap grows by ``increase`` every time ``limit`` requests succeed in a
+    row and is multiplied by ``decrease`` when one is throttled or can't
+    reach the server. Other failures leave it as it is.
+    """
+
+    def __init__(self, initial: int = 8, minimum: int = 1, maximum: int = 64, increase: float = 1.0, decrease: float = 0.5):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increase = increase
+        self.decrease = decrease
+        self.in_flight = 0
+        self._cond = threading.Condition()
+
+    def acquire(self) -> None:
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+
+    def release(self, throttled: bool = False, failed: bool = False) -> None:
+        with self._cond:
+            self.in_flight -= 1
+            if throttled:
+                self.limit = max(self.minimum, self.limit * self.decrease)
+            elif not failed:
+                self.limit = min(self.maximum, self.limit + self.increase / self.limit)
+            self._cond.notify_all()
+
+
+class RequestScheduler:
+    """Sits between connector methods and the network.
+
+    Every call waits for a token of its endpoint's bucket and a slot of the
+    adaptive concurrency limiter, then is retried with exponential backoff
+    and full jitter, honouring ``Retry-After``. Throttled calls (HTTP 429,
+    frequency-limit codes) are rejected before anything is written and are
+    always retried; 5xx, other retryable codes and network errors only
+    for calls marked idempotent. One scheduler is shared by every connector
+    of the process unless one is passed explicitly.
+    """
+
+    def __init__(self, rates: Optional[Dict[str, Tuple[float, float]]] = None, default_rate: Tuple[float, float] = DEFAULT_RATE,
+                 max_retries: int = 5, base_delay: float = 0.5, max_delay: float = 30.0, limiter: Optional[AdaptiveLimiter] = None):
+        self.rates = {**DEFAULT_RATES, **(rates or {})}
+        self.default_rate = default_rate
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.limiter = limiter or AdaptiveLimiter()
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._stats = {'requests': 0, 'retries': 0, 'throttled': 0, 'errors': 0}
+
+    def bucket(self, key: str) -> TokenBucket:
+        with self._lock:
+            b = self._buckets.get(key)
+            if b is None:
+                b = self._buckets[key] = TokenBucket(*self.rates.get(key, self.default_rate))
+            return b
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def _delay(self, attempt: int, r: Optional[requests.Response]) -> float:
+        if r is not None:
+            for header in ('Retry-After', 'x-ogw-ratelimit-reset'):
+                value = r.headers.get(header)
+                if value:
+                    try:
+                        return min(self.max_delay, float(value))
+                    except ValueError:
+                        pass
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def execute(self, key: str, send: Callable[[], Tuple[requests.Response, dict]], retry: bool = True,
+                idempotent: bool = False) -> Tuple[requests.Response, dict]:
+        """Run ``send`` under the limits of endpoint ``key``.
+
+        ``retry=False`` sends exactly once, for bodies that can't be replayed.
+        ``idempotent`` marks calls that are safe to repeat (reads, PUTs,
+        writes carrying a ``client_token``): only those are retried after a
+        5xx, a transient feishu code, a connection error or a timeout, any of
+        which may come after the server already applied the call.
+        """
+        bucket = self.bucket(key)
+        attempt = 0
+        while True:
+            bucket.acquire()
+            self.limiter.acquire()
+            self._count('requests')
+            r, err, throttled, retryable = None, None, False, False
+            # only a response below 500 counts as a success for the limiter
+            unreachable, failed = False, True
+            try:
+                r, d = send()
+                code = d.get('code')
+                throttled = r.status_code == 429 or code in THROTTLE_CODES
+                retryable = throttled or (idempotent and (r.status_code >= 500 or code in RETRYABLE_CODES))
+                failed = r.status_code >= 500
+            except (requests.ConnectionError, requests.Timeout) as e:
+                err = e
+                retryable = idempotent
+                unreachable = True
+            finally:
+                # a failing network backs off like throttling, it mustn't raise the cap
+                self.limiter.release(throttled=throttled or unreachable, failed=failed)
+            if throttled:
+                self._count('throttled')
+            if not retryable or not retry or attempt >= self.max_retries:
+                if err is not None:
+                    self._count('errors')
+                    raise err
+                return r, d
+            self._count('retries')
+            time.sleep(self._delay(attempt, r))
+            attempt += 1
+
+    def state(self) -> Dict:
+        """Snapshot for monitoring: counters, concurrency cap and bucket levels."""
+        with self._lock:
+            stats = dict(self._stats)
+            buckets = {k: round(b.tokens, 2) for k, b in self._buckets.items()}
+        stats.update({
+            'concurrency_limit': int(self.limiter.limit),
+            'in_flight': self.limiter.in_flight,
+            'buckets': buckets,
+        })
+        return stats
+
+
+_default_scheduler = None
+_default_lock = threading.Lock()
+
+
+def get_default_scheduler() -> RequestScheduler:
+    global _default_scheduler
+    with _default_lock:
+        if _default_scheduler is None:
+            _default_scheduler = RequestScheduler()
+        return _default_scheduler
@@ -0,0 +1,126 @@
+import json
+import time
+import sqlite3
+import threading
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional
+
+import pandas as pd
+
+from .query import compile_local, match
+
+
+@dataclass
+class SyncResult:
+    changed: int = 0
+    deleted: int = 0
+    requests: int = 0
+    full_scan: bool = False
+    high_water_mark: Optional[int] = None
+
+
+class BitableSnapshot:
+    """Local SQLite copy of one bitable, keyed by ``record_id``.
+
+    Besides the records it keeps the high-water mark (largest last-modified
+    time seen, ms epoch) and the time of the last id scan, so that
+    ``FeishuConnector.sync_bitable`` only fetches what changed since the
+    previous run. Several tables can share one database file.
+    """
+
+    def __init__(self, path: str, node_token: str, table_id: str):
+        self.path = path
+        self.node_token = node_token
+        self.table_id = table_id
+        self.key = f'{node_token}/{table_id}'
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute('CREATE TABLE IF NOT EXISTS records ('
+                               'target TEXT NOT NULL, record_id TEXT NOT NULL, fields TEXT NOT NULL, modified INTEGER, '
+                               'PRIMARY KEY (target, record_id))')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS meta (target TEXT NOT NULL, key TEXT NOT NULL, value TEXT, '
+                               'PRIMARY KEY (target, key))')
+
+    # ---- meta ----
+    def _get_meta(self, key):
+        row = self._conn.execute('SELECT value FROM meta WHERE target=? AND key=?', (self.key, key)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def _set_meta(self, key, value):
+        self._conn.execute('INSERT OR REPLACE INTO meta (target, key, value) VALUES (?, ?, ?)', (self.key, key, json.dumps(value)))
+
+    @property
+    def high_water_mark(self) -> Optional[int]:
+        with self._lock:
+            return self._get_meta('high_water_mark')
+
+    @property
+    def last_full_scan(self) -> Optional[float]:
+        with self._lock:
+            return self._get_meta('last_full_scan')
+
+    # ---- writes, used by sync ----
+    def apply(self, records: Iterable[Dict], modified_field: Optional[str] = None) -> int:
+        """Upsert fetched records and advance the high-water mark, returns the number applied."""
+        rows = []
+        hwm = None
+        for r in records:
+            modified = r.get('last_modified_time')
+            if modified is None and modified_field is not None:
+                modified = r['fields'].get(modified_field)
+            if modified is not None:
+                hwm = modified if hwm is None else max(hwm, modified)
+            rows.append((self.key, r['record_id'], json.dumps(r['fields'], ensure_ascii=False), modified))
+        with self._lock, self._conn:
+            self._conn.executemany('INSERT OR REPLACE INTO records (target, record_id, fields, modified) VALUES (?, ?, ?, ?)', rows)
+            current = self._get_meta('high_water_mark')
+            if hwm is not None and (current is None or hwm > current):
+                self._set_meta('high_water_mark', hwm)
+        return len(rows)
+
+    def retain(self, record_ids: Iterable[str]) -> int:
+        """Delete every record not in ``record_ids``, returns the number deleted."""
+        with self._lock, self._conn:
+            self._conn.execute('CREATE TEMP TABLE IF NOT EXISTS _alive (record_id TEXT PRIMARY KEY)')
+            self._conn.execute('DELETE FROM _alive')
+            self._conn.executemany('INSERT OR IGNORE INTO _alive VALUES (?)', ((rid,) for rid in record_ids))
+            cur = self._conn.execute('DELETE FROM records WHERE target=? AND record_id NOT IN (SELECT record_id FROM _alive)', (self.key,))
+            self._conn.execute('DELETE FROM _alive')
+            self._set_meta('last_full_scan', time.time())
+            return cur.rowcount
+
+    def clear(self) -> None:
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM records WHERE target=?', (self.key,))
+            self._conn.execute('DELETE FROM meta WHERE target=?', (self.key,))
+
+    # ---- reads, no api calls ----
+    def get(self, record_id: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._conn.execute('SELECT fields FROM records WHERE target=? AND record_id=?', (self.key, record_id)).fetchone()
+        return None if row is None else {'record_id': record_id, 'fields': json.loads(row[0])}
+
+    def records(self, filter_conditions: Optional[Dict] = None) -> List[Dict]:
+        """Records of the local copy, optionally filtered like ``get_filtered_records``."""
+        predicates = compile_local(filter_conditions)
+        with self._lock:
+            rows = self._conn.execute('SELECT record_id, fields FROM records WHERE target=? ORDER BY record_id', (self.key,)).fetchall()
+        out = []
+        for rid, fields in rows:
+            fields = json.loads(fields)
+            if match(fields, predicates):
+                out.append({'record_id': rid, 'fields': fields})
+        return out
+
+    def to_df(self, filter_conditions: Optional[Dict] = None) -> pd.DataFrame:
+        records = self.records(filter_conditions)
+        index = pd.Index([r['record_id'] for r in records], name='record_id')
+        return pd.DataFrame([r['fields'] for r in records], index=index)
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM records WHERE target=?', (self.key,)).fetchone()[0]
+
+    def close(self) -> None:
+        self._conn.close()
@@ -0,0 +1,69 @@
+import threading
+from typing import Optional, Tuple, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+Timeout = Union[float, Tuple[float, float]]
+
+
+class Transport:
+    """Pooled keep-alive HTTP transport shared by all calls of a connector.
+
+    One ``requests.Session`` is kept for the lifetime of the transport, so
+    consecutive requests to open.feishu.cn reuse the same TCP+TLS connections
+    instead of handshaking for every page or batch.
+    """
+
+    def __init__(self, pool_size: int = 10, timeout: Optional[Timeout] = (5, 60), gzip: bool = True):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.gzip = gzip
+        self._lock = threading.Lock()
+        self._session = None
+
+    @property
+    def session(self) -> requests.Session:
+        # created lazily so an unused connector never opens a pool
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    self._session = self._create_session()
+        return self._session
+
+    def _create_session(self) -> requests.Session:
+        s = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size, pool_block=False)
+        s.mount('https://', adapter)
+        s.mount('http://', adapter)
+        if self.gzip:
+            s.headers['Accept-Encoding'] = 'gzip, deflate'
+        else:
+            s.headers['Accept-Encoding'] = 'identity'
+        return s
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        kwargs.setdefault('timeout', self.timeout)
+        return self.session.request(method, url, **kwargs)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request('POST', url, **kwargs)
+
+    def put(self, url: str, **kwargs) -> requests.Response:
+        return self.request('PUT', url, **kwargs)
+
+    def close(self):
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,126 @@
+import json
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from .batch import BatchResult
+from .encoder import _default
+
+
+def _canonical(v):
+    # 3 and 3.0 compare equal, whatever number type the api or the caller used
+    if isinstance(v, float) and v.is_integer():
+        return int(v)
+    if isinstance(v, (list, tuple)):
+        return [_canonical(x) for x in v]
+    if isinstance(v, dict):
+        return {k: _canonical(x) for k, x in v.items()}
+    return v
+
+
+def _fallback(obj):
+    try:
+        return _default(obj)
+    except TypeError:
+        return str(obj)
+
+
+def _dumps(v) -> str:
+    return json.dumps(_canonical(v), sort_keys=True, ensure_ascii=False, default=_fallback)
+
+
+def value_hash(v) -> int:
+    return hash(_dumps(v))
+
+
+def record_key(fields: Dict, keys: Sequence[str]) -> Optional[Tuple]:
+    """Key tuple of a record, None when any key field is empty."""
+    values = tuple(fields.get(k) for k in keys)
+    if any(v is None or v == '' for v in values):
+        return None
+    return tuple(_dumps(v) for v in values)
+
+
+class KeyIndex:
+    """key -> (record_id, per-field value hashes) of the existing records of a table.
+
+    Only hashes of the compared ``fields`` are kept, not the values, so the
+    index stays small even for large tables.
+    """
+
+    def __init__(self, keys: Sequence[str], fields: Sequence[str]):
+        self.keys = list(keys)
+        self.fields = list(fields)
+        self.entries = {}
+        self.duplicates = 0
+        self.unkeyed = 0
+
+    def add(self, items: Iterable[Dict]) -> None:
+        for r in items:
+            f = r.get('fields') or {}
+            key = record_key(f, self.keys)
+            if key is None:
+                self.unkeyed += 1
+            elif key in self.entries:
+                self.duplicates += 1
+            else:
+                self.entries[key] = (r['record_id'], tuple(value_hash(f.get(name)) for name in self.fields))
+
+    def __len__(self):
+        return len(self.entries)
+
+
+@dataclass
+class UpsertPlan:
+    inserts: List[Dict] = field(default_factory=list)
+    updates: List[Dict] = field(default_factory=list)
+    unchanged: int = 0
+    unkeyed: int = 0
+
+    def summary(self) -> str:
+        return f'(insert){len(self.inserts)} (update){len(self.updates)} (unchanged){self.unchanged} (unkeyed){self.unkeyed}'
+
+
+@dataclass
+class UpsertResult:
+    plan: UpsertPlan
+    dry_run: bool = False
+    inserted: Optional[BatchResult] = None
+    updated: Optional[BatchResult] = None
+    duplicates: int = 0
+
+    def summary(self) -> str:
+        s = self.plan.summary()
+        if self.dry_run:
+            return f'(dry_run) {s}'
+        return f'{s} (inserted){self.inserted.succeeded} (updated){self.updated.succeeded} ' \
+               f'(failed){len(self.inserted.failed) + len(self.updated.failed)}'
+
+
+def plan_upsert(index: KeyIndex, records: Iterable[Dict]) -> UpsertPlan:
+    """Split field dicts into inserts, updates carrying only the changed fields, and untouched rows.
+
+    A field missing from an input record is left as it is. When several
+    input records share a key the last one wins.
+    """
+    plan = UpsertPlan()
+    latest = {}
+    for fields in records:
+        key = record_key(fields, index.keys)
+        if key is None:
+            plan.unkeyed += 1
+            continue
+        latest[key] = {**latest.get(key, {}), **fields}
+    positions = {name: i for i, name in enumerate(index.fields)}
+    for key, fields in latest.items():
+        entry = index.entries.get(key)
+        if entry is None:
+            plan.inserts.append(fields)
+            continue
+        record_id, hashes = entry
+        # key fields matched already, only the others can differ
+        changed = {k: v for k, v in fields.items() if k in positions and hashes[positions[k]] != value_hash(v)}
+        if changed:
+            plan.updates.append({'record_id': record_id, 'fields': changed})
+        else:
+            plan.unchanged += 1
+    return plan
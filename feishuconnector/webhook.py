@@ -0,0 +1,249 @@
+import time
+import logging
+import hashlib
+import threading
+from collections import deque
+from typing import Callable, Dict, List, Optional
+
+from .scheduler import TokenBucket
+from .transport import Transport
+
+logger = logging.getLogger('feishuconnector')
+
+
+class WebhookDispatcher:
+    """Queue webhook cards and send them from background threads, one per target.
+
+    Each target gets its own worker, keep-alive session and token bucket
+    (Feishu custom bots accept about 5 messages per second), so a slow or
+    throttled webhook only delays its own messages. Messages to one target
+    that arrive within ``coalesce_window`` seconds are merged into a single
+    card of up to ``max_batch`` messages. A message identical to one sent to
+    the same target in the last ``dedupe_window`` seconds is dropped, and so
+    is anything submitted while the queues already hold ``max_queue`` messages.
+    """
+
+    def __init__(self, webhooks: Dict[str, str], dumps: Callable, log: Optional[Callable[[str], None]] = None,
+                 rate: float = 4, burst: float = 5, coalesce_window: float = 1.0, dedupe_window: float = 60.0,
+                 max_batch: int = 10, max_queue: int = 1000, timeout=(5, 30)):
+        self._webhooks = webhooks
+        self._dumps = dumps
+        self.log = log or logger.info
+        self.rate = rate
+        self.burst = burst
+        self.coalesce_window = coalesce_window
+        self.dedupe_window = dedupe_window
+        self.max_batch = max_batch
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._queues = {}
+        self._threads = {}
+        self._recent = {}
+        self._depth = 0
+        # messages taken off a queue whose card is still being sent
+        self._in_flight = 0
+        self._flushing = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._stats = {'submitted': 0, 'sent_cards': 0, 'sent_messages': 0, 'dropped': 0, 'deduped': 0, 'failed': 0}
+
+    def submit(self, target: Optional[str], **msg) -> bool:
+        """Queue ``send_webhook_msg`` keyword arguments for ``target``, returns False if dropped."""
+        target = target if target is not None else 'default'
+        if not self._webhooks.get(target):
+            logger.warning('cannot find proper webhook')
+            return False
+        key = self._fingerprint(target, msg)
+        now = time.monotonic()
+        with self._cond:
+            self._stats['submitted'] += 1
+            if self._closed or self._depth >= self.max_queue:
+                self._stats['dropped'] += 1
+                return False
+            seen = self._recent.get(key)
+            if seen is not None and now - seen < self.dedupe_window:
+                self._stats['deduped'] += 1
+                return False
+            self._recent[key] = now
+            # forget fingerprints that left the dedupe window
+            if len(self._recent) > 4 * self.max_queue:
+                self._recent = {k: t for k, t in self._recent.items() if now - t < self.dedupe_window}
+            self._queues.setdefault(target, deque()).append((now, msg))
+            self._depth += 1
+            if target not in self._threads:
+                thread = threading.Thread(target=self._run, args=(target,), name=f'feishu-webhook-{target}', daemon=True)
+                self._threads[target] = thread
+                thread.start()
+            self._cond.notify_all()
+        return True
+
+    def _fingerprint(self, target, msg) -> str:
+        return hashlib.sha1(self._dumps([target, msg])).hexdigest()
+
+    def _run(self, target):
+        queue = self._queues[target]
+        transport = Transport(pool_size=1, timeout=self.timeout)
+        bucket = TokenBucket(self.rate, self.burst)
+        try:
+            while True:
+                with self._cond:
+                    while True:
+                        messages = self._take_ready(queue)
+                        if messages:
+                            break
+                        if self._closed and not queue:
+                            return
+                        self._cond.wait(timeout=self._next_deadline(queue))
+                bucket.acquire()
+                try:
+                    self._send(transport, target, messages)
+                finally:
+                    with self._cond:
+                        self._in_flight -= len(messages)
+                        self._cond.notify_all()
+        finally:
+            transport.close()
+
+    def _take_ready(self, queue) -> List[Dict]:
+        # called with self._cond held
+        if not queue:
+            return []
+        if not (self._closed or self._flushing or time.monotonic() - queue[0][0] >= self.coalesce_window
+                or len(queue) >= self.max_batch):
+            return []
+        messages = [queue.popleft()[1] for _ in range(min(self.max_batch, len(queue)))]
+        self._depth -= len(messages)
+        self._in_flight += len(messages)
+        return messages
+
+    def _next_deadline(self, queue) -> Optional[float]:
+        if not queue:
+            return None
+        return max(0.0, queue[0][0] + self.coalesce_window - time.monotonic())
+
+    def _send(self, transport, target, messages: List[Dict]):
+        url = self._webhooks[target]
+        msg = build_webhook_msg(**messages[0]) if len(messages) == 1 else merge_webhook_msgs(messages)
+        try:
+            rsp = transport.post(url, data=self._dumps(msg), headers={'Content-Type': 'application/json'})
+            d = rsp.json()
+            ok = d.get('code', d.get('StatusCode')) == 0
+        except Exception as e:
+            rsp, ok = e, False
+        with self._cond:
+            if ok:
+                self._stats['sent_cards'] += 1
+                self._stats['sent_messages'] += len(messages)
+            else:
+                self._stats['failed'] += len(messages)
+        if not ok:
+            logger.warning(f'fail to send webhook to {target}: {getattr(rsp, "text", rsp)}')
+
+    def stats(self) -> Dict[str, int]:
+        with self._cond:
+            return {**self._stats, 'queue_depth': self._depth, 'in_flight': self._in_flight}
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Send everything queued now, ignoring the coalesce window, and wait until it's sent.
+        Returns False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            self._flushing += 1
+            self._cond.notify_all()
+            try:
+                while self._depth > 0 or self._in_flight > 0:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        return False
+                    self._cond.wait(remaining)
+                return True
+            finally:
+                self._flushing -= 1
+
+    def close(self, timeout: Optional[float] = 30) -> None:
+        """Flush the queues and stop the workers, later submits are dropped."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+            threads = list(self._threads.values())
+        for thread in threads:
+            thread.join(None if deadline is None else max(0.0, deadline - time.monotonic()))
+
+
+def merge_webhook_msgs(messages: List[Dict]) -> Dict:
+    """Fold several ``send_webhook_msg`` keyword sets into one card, separated by rules."""
+    elements = []
+    for i, m in enumerate(messages):
+        if i:
+            elements.append({'tag': 'hr'})
+        card = build_webhook_msg(**{**m, 'title': None})['card']
+        if m.get('title'):
+            elements.append({'tag': 'div', 'text': {'content': f'**{m["title"]}**', 'tag': 'lark_md'}})
+        elements.extend(card['elements'])
+    titles = [m.get('title') for m in messages]
+    title = titles[0] if len(set(titles)) == 1 else f'{titles[0] or ""} (+{len(messages) - 1} more)'
+    success = all(m.get('success', True) for m in messages)
+    return build_webhook_msg(title=title, success=success, elements=elements)
+
+
+def build_webhook_msg(title=None, content=None, success=True, buttons=None, elements=None):
+    '''
+    buttons = [(content, url), (content, url)]
+    '''
+    msg = {
+            "msg_type": "interactive",
+            "card": {
+                "config": {
+                    "wide_screen_mode": True
+                },
+                "elements": [{
+                    "tag": "div",
+                    "text":  {
+                        "content": content or '',
+                        "tag": "lark_md"
+                    }
+                }] if elements is None else elements,
+                "header": {
+                    "template": "green" if success else "red",
+                    "title": {
+                        "content": title or '',
+                        "tag": "plain_text"
+                    }
+                }
+            }
+        }
+    if buttons:
+        actions = []
+        for (_c, _u) in buttons:
+            actions.append({
+                "tag": "button",
+                "text": {
+                    "content": _c,
+                    "tag": "plain_text"
+                },
+                "type": "primary",
+                "url": _u
+            })
+        msg['card']['elements'].append({
+            "actions": actions,
+            "tag": "action"
+        })
+    return msg
+
+
+def build_image_elements(image_key, title):
+    return [{
+        "tag": "img",
+        "title": {
+            "tag": "plain_text",
+            "content": title,
+        },
+        "img_key": image_key,
+        "mode": "fit_horizontal",
+        "alt": {
+            "tag": "plain_text",
+            "content": "",
+        },
+        "compact_width": True,
+    }]
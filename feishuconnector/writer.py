@@ -0,0 +1,313 @@
+import os
+import time
+import uuid
+import threading
+from collections import deque
+from typing import Dict, Iterable, List, Optional
+
+from .batch import Timer
+from .manager import MAX_BATCH_SIZE, MAX_SHEET_ROWS, logger
+
+
+class BufferedWriter:
+    """Collect small appends to one bitable table or sheet range and send them in full batches.
+
+    ``write`` only queues rows; a background thread sends them once
+    ``max_rows`` are waiting or the oldest has waited ``max_delay`` seconds,
+    one batch at a time so the order is kept. When ``max_buffer`` rows are
+    waiting, ``write`` blocks until the worker catches up.
+
+    With ``journal`` set to a file path every accepted write is appended to
+    it before ``write`` returns, and every sent batch is acknowledged in it;
+    a writer opened on the same journal after a crash sends whatever was
+    left unacknowledged first. Bitable batches keep their ``client_token``
+    across retries and restarts, so a batch that was sent but not
+    acknowledged isn't inserted twice.
+
+    A failed bitable batch stays at the head of the buffer and is retried
+    after ``retry_delay`` seconds, doubling up to ``max_retry_delay``. Sheet
+    appends have no such token and a failure (a timeout, a 5xx) may come
+    after the rows were written, so a sheet writer never resends on its
+    own: it stops with the batch at the head of the buffer, ``error`` set
+    and ``write`` refusing rows, until ``resume`` is told whether the batch
+    is to be sent again. A sheet journal replayed with a batch that was
+    sent but not acknowledged stops the same way.
+    """
+
+    def __init__(self, fc, node_token: str, table_id: Optional[str] = None, sheet_range: Optional[str] = None,
+                 max_rows: Optional[int] = None, max_delay: float = 1.0, max_buffer: Optional[int] = None,
+                 journal: Optional[str] = None, fsync: bool = False, retry_delay: float = 1.0, max_retry_delay: float = 60.0):
+        assert (table_id is None) != (sheet_range is None), 'pass either table_id or sheet_range'
+        self.fc = fc
+        self.node_token = node_token
+        self.table_id = table_id
+        self.sheet_range = sheet_range
+        self.target = f'{node_token}/{table_id or sheet_range}'
+        limit = MAX_BATCH_SIZE if table_id is not None else MAX_SHEET_ROWS
+        self.max_rows = min(max_rows or limit, limit)
+        self.max_delay = max_delay
+        self.max_buffer = max(max_buffer or 20 * self.max_rows, self.max_rows)
+        self.fsync = fsync
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        # resolved once, not on every flush
+        if table_id is not None:
+            self._app_token = fc.resolve_bitable(node_token, table_id)
+        else:
+            self._app_token = fc.get_app_token(node_token)
+        self._rows = deque()
+        # arrival time of the oldest buffered row
+        self._since = None
+        # (client_token, size) of the batch at the head of the buffer, kept until it's sent
+        self._batch = None
+        self._retry_at = 0.0
+        self._delay = retry_delay
+        self._flushing = 0
+        # why a sheet writer stopped sending, see resume
+        self.error = None
+        self._closed = False
+        self._stopped = False
+        self._cond = threading.Condition()
+        self._stats = {'written': 0, 'sent': 0, 'batches': 0, 'failed_batches': 0, 'blocked': 0, 'replayed': 0}
+        self._journal_path = journal
+        self._journal = None
+        if journal is not None:
+            self._open_journal()
+        self._thread = threading.Thread(target=self._run, name=f'feishu-writer-{self.target}', daemon=True)
+        self._thread.start()
+
+    def write(self, rows: Iterable, timeout: Optional[float] = None) -> bool:
+        """Queue rows (field dicts for a bitable, lists of cell values for a sheet).
+
+        Blocks while the buffer is full; returns False if ``timeout`` seconds
+        pass first, in which case none of the rows were queued.
+        """
+        rows = list(rows)
+        if not rows:
+            return True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            assert not self._closed, f'writer to {self.target} is closed'
+            assert self.error is None, f'writer to {self.target} stopped, call resume(): {self.error}'
+            if self._rows and len(self._rows) + len(rows) > self.max_buffer:
+                self._stats['blocked'] += 1
+                self._cond.notify_all()
+                while self._rows and len(self._rows) + len(rows) > self.max_buffer:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        return False
+                    self._cond.wait(remaining)
+            if self._journal is not None:
+                self._log_journal({'rows': rows})
+            self._rows.extend(rows)
+            if self._since is None:
+                self._since = time.monotonic()
+            self._stats['written'] += len(rows)
+            self._cond.notify_all()
+        return True
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Send everything buffered now. False on timeout or when a batch fails to send."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            failures = self._stats['failed_batches']
+            self._flushing += 1
+            self._retry_at = 0.0
+            self._cond.notify_all()
+            try:
+                while self._rows:
+                    if self._stats['failed_batches'] > failures or self._stopped or self.error is not None:
+                        return False
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        return False
+                    self._cond.wait(remaining)
+                return True
+            finally:
+                self._flushing -= 1
+
+    def close(self, timeout: Optional[float] = 30) -> None:
+        """Flush and stop the worker. Rows that couldn't be sent stay in the journal, if there is one."""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._retry_at = 0.0
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+            left = len(self._rows)
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+        if left:
+            kept = f', kept in {self._journal_path}' if self._journal_path else ''
+            logger.warning(f'writer to {self.target} closed with {left} rows unsent{kept}')
+
+    def resume(self, resend: bool) -> None:
+        """Restart a sheet writer stopped on the batch at the head of the buffer.
+
+        Check the sheet first: ``resend=True`` sends the batch again,
+        ``resend=False`` drops it as already written.
+        """
+        with self._cond:
+            if self.error is None:
+                return
+            if not resend and self._batch is not None:
+                size = self._batch[1]
+                for _ in range(size):
+                    self._rows.popleft()
+                self._batch = None
+                if not self._rows:
+                    self._since = None
+                if self._journal is not None:
+                    self._ack(size)
+            self.error = None
+            self._retry_at = 0.0
+            self._cond.notify_all()
+
+    def stats(self) -> Dict[str, int]:
+        with self._cond:
+            return {**self._stats, 'buffered': len(self._rows)}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # ---- worker ----
+    def _ready(self, now: float) -> bool:
+        if not self._rows or now < self._retry_at or self.error is not None:
+            return False
+        return (self._closed or self._flushing > 0 or len(self._rows) >= self.max_rows
+                or now - self._since >= self.max_delay)
+
+    def _wait_time(self, now: float) -> Optional[float]:
+        if not self._rows or self.error is not None:
+            return None
+        if now < self._retry_at:
+            return self._retry_at - now
+        return max(0.0, self._since + self.max_delay - now)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                now = time.monotonic()
+                while not self._stopped and not self._ready(now):
+                    if self._closed and (not self._rows or self.error is not None):
+                        return
+                    self._cond.wait(self._wait_time(now))
+                    now = time.monotonic()
+                if self._stopped:
+                    return
+                if self._batch is None:
+                    self._batch = (str(uuid.uuid4()) if self.table_id is not None else None, min(self.max_rows, len(self._rows)))
+                    if self._journal is not None:
+                        self._log_journal({'batch': self._batch[0], 'size': self._batch[1]})
+                token, size = self._batch
+                rows = [self._rows[i] for i in range(size)]
+            err = self._send(token, rows)
+            with self._cond:
+                if err is None:
+                    for _ in range(size):
+                        self._rows.popleft()
+                    self._batch = None
+                    self._delay = self.retry_delay
+                    self._stats['sent'] += size
+                    self._stats['batches'] += 1
+                    if not self._rows:
+                        self._since = None
+                    if self._journal is not None:
+                        self._ack(size)
+                else:
+                    self._stats['failed_batches'] += 1
+                    if self.table_id is None:
+                        # the rows may be in the sheet already, only the caller can tell
+                        self.error = err
+                    self._retry_at = time.monotonic() + self._delay
+                    self._delay = min(self._delay * 2, self.max_retry_delay)
+                self._cond.notify_all()
+
+    def _send(self, token, rows: List) -> Optional[Exception]:
+        with Timer() as t:
+            try:
+                if self.table_id is not None:
+                    self.fc._append_bitable_record(self._app_token, self.table_id, rows, client_token=token)
+                else:
+                    self.fc._append_sheet_data(self._app_token, self.sheet_range, rows)
+                err = None
+            except Exception as e:
+                err = e
+        if err is not None:
+            logger.warning(f'fail to flush {len(rows)} rows to {self.target}: {err}')
+        self.fc._operation('buffered_write', self.target, records=0 if err else len(rows), batches=1, requests=1,
+                           failed=len(rows) if err else 0, elapsed=t.elapsed)
+        return err
+
+    # ---- journal ----
+    def _open_journal(self):
+        """Load what a previous writer left unacknowledged, then start a compacted journal."""
+        rows, batch = self._replay(self._journal_path)
+        self._rows.extend(rows)
+        self._batch = batch
+        if rows:
+            self._since = time.monotonic() - self.max_delay
+            self._stats['replayed'] = len(rows)
+            self.fc.log(f'writer to {self.target} replays {len(rows)} rows from {self._journal_path}')
+        if batch is not None and self.table_id is None:
+            self.error = f'a batch of {batch[1]} rows was sent before {self._journal_path} was closed and may be in the sheet'
+            logger.warning(f'writer to {self.target} stopped: {self.error}, call resume()')
+        tmp = f'{self._journal_path}.tmp'
+        dumps = self.fc._codec.dumps
+        with open(tmp, 'wb') as f:
+            f.write(dumps({'target': self.target}) + b'\n')
+            if rows:
+                f.write(dumps({'rows': rows}) + b'\n')
+            if batch is not None:
+                f.write(dumps({'batch': batch[0], 'size': batch[1]}) + b'\n')
+        os.replace(tmp, self._journal_path)
+        self._journal = open(self._journal_path, 'ab')
+
+    def _replay(self, path: str):
+        rows, batch = deque(), None
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            return [], None
+        loads = self.fc._codec.loads
+        with f:
+            for line in f:
+                try:
+                    entry = loads(line)
+                except ValueError:
+                    # a write torn by the crash, nothing after it was acknowledged
+                    break
+                if 'target' in entry:
+                    assert entry['target'] == self.target, f'journal {path} belongs to {entry["target"]}, not {self.target}'
+                elif 'rows' in entry:
+                    rows.extend(entry['rows'])
+                elif 'batch' in entry:
+                    batch = (entry['batch'], entry['size'])
+                elif 'ack' in entry:
+                    for _ in range(entry['ack']):
+                        rows.popleft()
+                    batch = None
+        return list(rows), batch
+
+    def _log_journal(self, entry: Dict):
+        # called with self._cond held
+        self._journal.write(self.fc._codec.dumps(entry) + b'\n')
+        self._journal.flush()
+        if self.fsync:
+            os.fsync(self._journal.fileno())
+
+    def _ack(self, size: int):
+        if self._rows:
+            self._log_journal({'ack': size})
+        else:
+            # everything is sent, start over with an empty journal
+            self._journal.truncate(0)
+            self._log_journal({'target': self.target})
@@ -38,4 +38,9 @@ setup(
         'requests-toolbelt >= 0.9.1',
         'dataframe-image-cn >= 0.1.1',
     ],
+    extras_require={
+        'fast': ['orjson >= 3.6'],
+        'async': ['aiohttp >= 3.8'],
+        'export': ['pyarrow >= 8'],
+    },
 )
@@ -0,0 +1,222 @@
+"""Throughput benchmark of the connector against the local mock server.
+
+    python test/bench.py                                   # 1k, 10k and 100k rows
+    python test/bench.py --sizes 1000000 --workloads read,df_read --latency 0.05
+    python test/bench.py --out after.json --compare before.json
+
+Each workload runs in a fresh process, so ``peak_rss_mb`` is the high-water
+mark of that workload alone. Per-request latencies are measured around the
+connector's transport. Results are written as JSON for regression comparison.
+"""
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import resource
+import datetime
+import multiprocessing as mp
+from typing import Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from mock_server import MockConfig, MockServer, seed_fields  # noqa: E402
+
+
+WORKLOADS = ['read', 'df_read', 'append', 'df_append', 'update', 'sheet_append']
+NODE, TABLE = 'wikbench', 'tblbench'
+SHEET_NODE, SHEET = 'wiksheet', 'shtbench'
+
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+def _rss_mb() -> float:
+    # ru_maxrss is in KiB on linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024 / (1024 if sys.platform == 'darwin' else 1)
+
+
+def _connector(base_url, args):
+    from feishuconnector import FeishuConnector, RequestScheduler
+
+    # the benchmark measures the client, not the production rate limits
+    scheduler = RequestScheduler(rates={'POST auth/v3/tenant_access_token/internal': (1000, 1000)},
+                                 default_rate=(args['rate'], args['rate']), base_delay=0.05)
+    fc = FeishuConnector({'default': f'{base_url.rsplit("/open-apis", 1)[0]}/webhook/default'},
+                         base_url=base_url, scheduler=scheduler, pool_size=max(10, args['concurrency']))
+    fc.log = lambda msg: None
+    latencies = []
+    send = fc._http.request
+
+    def timed(method, url, **kwargs):
+        t = time.perf_counter()
+        try:
+            return send(method, url, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - t)
+
+    fc._http.request = timed
+    fc.init('cli_bench', 'secret')
+    return fc, latencies
+
+
+def _records(n: int) -> List[Dict]:
+    return [seed_fields(i) for i in range(n)]
+
+
+def _run_workload(name: str, size: int, base_url: str, args: Dict, out):
+    """Child process body: set up, time one workload, report through ``out``."""
+    try:
+        out.put(_measure(name, size, base_url, args))
+    except Exception as e:
+        out.put({'workload': name, 'rows': size, 'error': f'{type(e).__name__}: {e}'[:500]})
+
+
+def _measure(name: str, size: int, base_url: str, args: Dict) -> Dict:
+    import pandas as pd
+
+    fc, latencies = _connector(base_url, args)
+    c = args['concurrency']
+    # inputs are built before the clock starts, outside the measurement
+    if name in ('append', 'update'):
+        records = _records(size)
+        if name == 'update':
+            records = [{'record_id': f'rec{i:09d}', 'fields': {'count': -i}} for i in range(size)]
+    elif name == 'df_append':
+        df = pd.DataFrame(_records(size))
+        df['date'] = pd.to_datetime(df['date'], unit='ms')
+    elif name == 'sheet_append':
+        values = [[i, f'name {i}', i * 0.5, 'x', None] for i in range(size)]
+    baseline_rss = _rss_mb()
+    latencies.clear()
+    t = time.perf_counter()
+    if name == 'read':
+        rows = len(fc.get_bitable_records(NODE, TABLE))
+    elif name == 'df_read':
+        rows = len(fc.get_bitable_df(NODE, TABLE, parse_dates=['date']))
+    elif name == 'append':
+        rows = fc.batch_append_bitable_records(NODE, TABLE, records, concurrency=c).succeeded
+    elif name == 'df_append':
+        rows = fc.append_bitable_df(NODE, TABLE, df, concurrency=c)
+    elif name == 'update':
+        rows = fc.batch_update_bitable_records(NODE, TABLE, records, concurrency=c).succeeded
+    elif name == 'sheet_append':
+        rows = fc.append_sheet_data(SHEET_NODE, SHEET, values, concurrency=c)
+    else:
+        raise ValueError(f'unknown workload {name}')
+    elapsed = time.perf_counter() - t
+    state = fc.scheduler.state()
+    fc.close()
+    return {
+        'workload': name,
+        'rows': size,
+        'processed': rows,
+        'elapsed_s': round(elapsed, 4),
+        'records_per_sec': round(rows / elapsed, 1) if elapsed else None,
+        'requests': len(latencies),
+        'retries': state['retries'],
+        'p50_ms': round(_percentile(latencies, 50) * 1000, 2),
+        'p99_ms': round(_percentile(latencies, 99) * 1000, 2),
+        'peak_rss_mb': round(_rss_mb(), 1),
+        'baseline_rss_mb': round(baseline_rss, 1),
+    }
+
+
+def run(workloads: List[str], sizes: List[int], config: MockConfig, args: Dict) -> List[Dict]:
+    results = []
+    ctx = mp.get_context('spawn')
+    with MockServer(config=config) as server:
+        for size in sizes:
+            for name in workloads:
+                server.mock.reset()
+                server.add_bitable(NODE, TABLE, rows=size if name in ('read', 'df_read', 'update') else 0)
+                server.add_sheet(SHEET_NODE, SHEET)
+                out = ctx.Queue()
+                p = ctx.Process(target=_run_workload, args=(name, size, server.base_url, args, out))
+                p.start()
+                try:
+                    result = out.get(timeout=args['timeout'])
+                except Exception:
+                    result = {'workload': name, 'rows': size, 'error': f'no result (exit code {p.exitcode})'}
+                p.join()
+                stats = server.mock.stats
+                result['server_requests'] = {k: v['requests'] for k, v in stats.items()}
+                result['server_bytes_out'] = sum(v['bytes_out'] for v in stats.values())
+                results.append(result)
+                print(_format(result), flush=True)
+    return results
+
+
+def _format(r: Dict) -> str:
+    if 'error' in r:
+        return f'{r["workload"]:13s} {r["rows"]:>8d}  {r["error"]}'
+    return (f'{r["workload"]:13s} {r["rows"]:>8d} rows {r["elapsed_s"]:8.2f} s {r["records_per_sec"]:>10.0f} rec/s '
+            f'{r["requests"]:>6d} req  p50 {r["p50_ms"]:7.1f} ms  p99 {r["p99_ms"]:7.1f} ms  {r["peak_rss_mb"]:7.0f} MiB')
+
+
+def compare(results: List[Dict], baseline: List[Dict]) -> None:
+    """Print the records/sec and peak memory ratio of every workload found in both runs."""
+    before = {(r['workload'], r['rows']): r for r in baseline if 'error' not in r}
+    for r in results:
+        b = before.get((r['workload'], r['rows']))
+        if b is None or 'error' in r:
+            continue
+        speed = r['records_per_sec'] / b['records_per_sec'] if b['records_per_sec'] else float('nan')
+        memory = r['peak_rss_mb'] / b['peak_rss_mb'] if b['peak_rss_mb'] else float('nan')
+        print(f'{r["workload"]:13s} {r["rows"]:>8d}  speed x{speed:5.2f}  memory x{memory:5.2f}  '
+              f'requests {b["requests"]} -> {r["requests"]}')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', default='1000,10000,100000', help='comma separated row counts')
+    parser.add_argument('--workloads', default=','.join(WORKLOADS), help=f'comma separated, from {",".join(WORKLOADS)}')
+    parser.add_argument('--concurrency', type=int, default=4, help='concurrency of the append/update calls')
+    parser.add_argument('--rate', type=float, default=1000, help='client side requests per second per endpoint')
+    parser.add_argument('--latency', type=float, default=0.01, help='mock server latency per call, seconds')
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--rate-limit', type=float, default=None, help='mock server calls per second')
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--timeout', type=float, default=3600, help='seconds allowed per workload')
+    parser.add_argument('--out', default='bench_results.json')
+    parser.add_argument('--compare', default=None, help='earlier results file to compare against')
+    args = parser.parse_args(argv)
+    workloads = args.workloads.split(',')
+    for name in workloads:
+        assert name in WORKLOADS, f'unknown workload {name}'
+    sizes = [int(s) for s in args.sizes.split(',')]
+    config = MockConfig(latency=args.latency, jitter=args.jitter, rate_limit=args.rate_limit, error_rate=args.error_rate)
+    client = {'concurrency': args.concurrency, 'rate': args.rate, 'timeout': args.timeout}
+
+    from feishuconnector import __version__
+    from feishuconnector.encoder import get_codec
+    results = run(workloads, sizes, config, client)
+    report = {
+        'meta': {
+            'time': datetime.datetime.now().isoformat(timespec='seconds'),
+            'version': __version__,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'codec': get_codec().name,
+            'mock': vars(config),
+            'client': client,
+        },
+        'results': results,
+    }
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'results written to {args.out}')
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f)['results'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""Micro-benchmark of the payload codecs on a 100k-cell batch_create body.
+
+    python test/bench_encoder.py
+"""
+import os
+import sys
+import json
+import time
+import datetime
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from feishuconnector.encoder import JsonCodec, get_codec, orjson  # noqa: E402
+
+
+ROWS, COLS = 10000, 10
+
+
+def make_payload():
+    rng = np.random.default_rng(0)
+    floats = rng.random((ROWS, COLS // 2))
+    floats[rng.random(floats.shape) < 0.05] = np.nan
+    ints = rng.integers(0, 10**6, (ROWS, COLS // 2))
+    records = []
+    for i in range(ROWS):
+        fields = {f'f{j}': floats[i, j] for j in range(COLS // 2)}
+        fields.update({f'i{j}': ints[i, j] for j in range(COLS // 2)})
+        records.append({'fields': fields})
+    return {'records': records}
+
+
+def native(payload):
+    # what the old code path needed: python scalars only, NaN replaced
+    return {'records': [{'fields': {k: (None if v != v else v.item()) for k, v in r['fields'].items()}} for r in payload['records']]}
+
+
+def bench(fn, repeat=5):
+    best = float('inf')
+    for _ in range(repeat):
+        t = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - t)
+    return best, out
+
+
+def main():
+    payload = make_payload()
+    plain = native(payload)
+    rows = []
+    t, body = bench(lambda: json.dumps(plain, indent=4).encode('utf-8'))
+    rows.append(('json.dumps(indent=4), pre-converted', t, len(body)))
+    codecs = [JsonCodec()] + ([get_codec('orjson')] if orjson is not None else [])
+    for codec in codecs:
+        t, body = bench(lambda: codec.dumps(payload))
+        rows.append((f'{codec.name}.dumps', t, len(body)))
+    text = json.dumps(plain)
+    t, _ = bench(lambda: json.loads(text.encode('utf-8').decode('utf-8')))
+    rows.append(('json.loads(r.text)', t, len(text)))
+    for codec in codecs:
+        t, _ = bench(lambda: codec.loads(text.encode('utf-8')))
+        rows.append((f'{codec.name}.loads(r.content)', t, len(text)))
+    print(f'{ROWS * COLS} cells, {datetime.datetime.now():%Y-%m-%d %H:%M}')
+    for name, t, size in rows:
+        print(f'{name:40s} {t * 1000:8.1f} ms {size / 1024:8.0f} KiB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,703 @@
+"""Local stand-in for the parts of the Feishu Open API that feishuconnector calls.
+
+    python test/mock_server.py --port 8700 --latency 0.02 --rate-limit 50
+
+Point a connector at it with ``FeishuConnector(webhooks, base_url=server.base_url)``
+and webhooks at ``server.webhook_url(name)``. Bitables and sheets are created
+with ``server.add_bitable`` / ``server.add_sheet`` or, for a server in another
+process, ``POST /_mock/bitable`` and ``POST /_mock/sheet``. Seeded rows are
+generated from their index on demand, so a 1M row table costs no memory until
+it's written to. ``GET /_mock/stats`` returns per-endpoint counters,
+``POST /_mock/config`` changes latency, limits and error injection on the fly.
+
+The ``filter`` formulas built by ``feishuconnector.query.compile_filter``
+(comparisons of ``CurrentValue.[field]`` with a number or string, joined by
+AND/OR) and the condition filters of records/search are evaluated, and
+``automatic_fields`` adds created/last modified times; sorts and views are
+accepted but not evaluated.
+"""
+import re
+import json
+import time
+import random
+import argparse
+import threading
+from dataclasses import asdict, dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, unquote, urlparse
+
+
+PREFIX = '/open-apis'
+SELECT_OPTIONS = ['open', 'in progress', 'done', 'blocked']
+# path segments that are part of an api name rather than an id
+API_WORDS = {'auth', 'tenant_access_token', 'internal', 'wiki', 'spaces', 'get_node', 'nodes', 'im', 'images', 'sheets',
+             'spreadsheets', 'metainfo', 'values', 'values_append', 'values_batch_get', 'dimension_range', 'bitable',
+             'apps', 'tables', 'records', 'batch_create', 'batch_update', 'search', 'fields', 'views', 'webhook', '_mock'}
+BASE_TIME = 1700000000000
+# field schema of the generated records, as the fields api returns it
+SEED_SCHEMA = [
+    {'field_id': 'fldname', 'field_name': 'name', 'type': 1},
+    {'field_id': 'fldamount', 'field_name': 'amount', 'type': 2},
+    {'field_id': 'fldcount', 'field_name': 'count', 'type': 2},
+    {'field_id': 'fldstatus', 'field_name': 'status', 'type': 3,
+     'property': {'options': [{'name': o} for o in SELECT_OPTIONS]}},
+    {'field_id': 'flddate', 'field_name': 'date', 'type': 5},
+]
+
+
+@dataclass
+class MockConfig:
+    # seconds added to every api call, plus up to ``jitter`` more
+    latency: float = 0.0
+    jitter: float = 0.0
+    # largest page_size honoured by the records list/search apis
+    page_limit: int = 500
+    # api calls per second over all endpoints, None for unlimited; excess calls get 429 / 99991400
+    rate_limit: Optional[float] = None
+    # fraction of api calls answered with ``error_status`` / ``error_code``
+    error_rate: float = 0.0
+    error_status: int = 500
+    error_code: int = 1254607
+    # tenant access token lifetime in seconds
+    token_expire: int = 7200
+    seed: int = 0
+
+
+def _col_index(letters):
+    idx = 0
+    for ch in letters.upper():
+        idx = idx * 26 + ord(ch) - ord('A') + 1
+    return idx - 1
+
+
+def _col_letter(idx):
+    letters = ''
+    idx += 1
+    while idx:
+        idx, rem = divmod(idx - 1, 26)
+        letters = chr(ord('A') + rem) + letters
+    return letters
+
+
+def seed_fields(i: int) -> Dict:
+    """Fields of the ``i``-th generated record: text, numbers, a single select and a date."""
+    return {
+        'name': f'item {i}',
+        'amount': round((i * 7919 % 100000) / 100, 2),
+        'count': i % 1000,
+        'status': SELECT_OPTIONS[i % len(SELECT_OPTIONS)],
+        'date': BASE_TIME + i * 60000,
+    }
+
+
+_COMPARE = {
+    '=': lambda a, b: a == b,
+    '!=': lambda a, b: a != b,
+    '>': lambda a, b: a > b,
+    '>=': lambda a, b: a >= b,
+    '<': lambda a, b: a < b,
+    '<=': lambda a, b: a <= b,
+}
+
+
+def _split_args(text: str) -> List[str]:
+    """Top level comma separated arguments of a formula function."""
+    args, depth, quoted, start = [], 0, False, 0
+    for i, ch in enumerate(text):
+        if ch == '"':
+            quoted = not quoted
+        elif not quoted and ch == '(':
+            depth += 1
+        elif not quoted and ch == ')':
+            depth -= 1
+        elif not quoted and depth == 0 and ch == ',':
+            args.append(text[start:i])
+            start = i + 1
+    args.append(text[start:])
+    return [a.strip() for a in args]
+
+
+def parse_formula(formula: str):
+    """Predicate on a record's fields for a records-api filter formula, ValueError if unsupported."""
+    formula = formula.strip()
+    m = re.match(r'^(AND|OR)\((.*)\)$', formula, re.S)
+    if m:
+        parts = [parse_formula(a) for a in _split_args(m.group(2))]
+        combine = all if m.group(1) == 'AND' else any
+        return lambda fields: combine(p(fields) for p in parts)
+    m = re.match(r'^CurrentValue\.\[([^\]]+)\](!=|>=|<=|=|>|<)(.+)$', formula, re.S)
+    if m is None:
+        raise ValueError(formula)
+    name, op, literal = m.groups()
+    value = literal[1:-1] if literal.startswith('"') and literal.endswith('"') else float(literal)
+    compare = _COMPARE[op]
+
+    def predicate(fields):
+        v = fields.get(name)
+        if v is None or isinstance(v, str) != isinstance(value, str):
+            return op == '!='
+        return compare(v, value)
+
+    return predicate
+
+
+_DAY_MS = 86400000
+# search api condition operator -> comparison of the cell value with the condition value
+_CONDITIONS = {
+    'is': lambda a, b: a == b,
+    'isNot': lambda a, b: a != b,
+    'isGreater': lambda a, b: a > b,
+    'isGreaterEqual': lambda a, b: a >= b,
+    'isLess': lambda a, b: a < b,
+    'isLessEqual': lambda a, b: a <= b,
+}
+
+
+def parse_conditions(search_filter: Dict):
+    """Predicate on a record's fields for the ``filter`` of records/search.
+
+    Dates given as ``['ExactDate', ms]`` compare by (utc) day, as the api
+    does; other values are compared as numbers when the cell is one.
+    """
+    parts = []
+    for cond in search_filter.get('conditions') or []:
+        name, op, value = cond['field_name'], cond['operator'], cond.get('value') or []
+        if op in ('isEmpty', 'isNotEmpty'):
+            empty = op == 'isEmpty'
+            parts.append(lambda f, name=name, empty=empty: (f.get(name) in (None, '', [])) == empty)
+            continue
+        if op not in _CONDITIONS:
+            raise ValueError(op)
+        compare = _CONDITIONS[op]
+        if value and value[0] == 'ExactDate':
+            day = int(value[1]) // _DAY_MS
+            parts.append(lambda f, name=name, compare=compare, day=day:
+                         f.get(name) is not None and compare(int(f[name]) // _DAY_MS, day))
+        else:
+            target = value[0] if value else None
+
+            def predicate(f, name=name, compare=compare, target=target):
+                v = f.get(name)
+                if v is None:
+                    return compare is _CONDITIONS['isNot']
+                if isinstance(v, (int, float)) and not isinstance(v, bool):
+                    return compare(v, float(target))
+                return compare(str(v), target)
+
+            parts.append(predicate)
+    combine = any if search_filter.get('conjunction') == 'or' else all
+    return lambda fields: combine(p(fields) for p in parts)
+
+
+class Table:
+    """A bitable table of ``seeded`` generated records plus whatever was written to it.
+
+    Every record has a created and a last modified time (ms epoch): seeded
+    records one second apart ending just before the table was made, written
+    ones the time of the write. With ``modified_field`` set they also show
+    the modified time in that field, like a "last modified time" column.
+    """
+
+    def __init__(self, seeded: int = 0, modified_field: Optional[str] = None):
+        self.seeded = seeded
+        self.modified_field = modified_field
+        self.overrides = {}
+        self.appended = []
+        self.appended_fields = {}
+        self.client_tokens = {}
+        self.deleted = set()
+        self.created_at = int(time.time() * 1000)
+        self._clock = self.created_at
+        # record_id -> (created_time, last_modified_time) of written records
+        self.times = {}
+
+    def __len__(self):
+        return self.seeded + len(self.appended)
+
+    def record_id(self, i: int) -> str:
+        return f'rec{i:09d}'
+
+    def _now(self) -> int:
+        # strictly increasing, two writes never share a modified time
+        self._clock = max(int(time.time() * 1000), self._clock + 1)
+        return self._clock
+
+    def get(self, i: int, automatic: bool = False) -> Dict:
+        if i < self.seeded:
+            rid = self.record_id(i)
+            fields = seed_fields(i)
+            if rid in self.overrides:
+                fields.update(self.overrides[rid])
+        else:
+            rid = self.appended[i - self.seeded]
+            fields = dict(self.appended_fields[rid])
+        created, modified = self.times.get(rid) or (self.created_at - (self.seeded - i) * 1000,) * 2
+        if self.modified_field is not None:
+            fields[self.modified_field] = modified
+        record = {'record_id': rid, 'fields': fields}
+        if automatic:
+            record['created_time'] = created
+            record['last_modified_time'] = modified
+        return record
+
+    def rows(self, automatic: bool = False):
+        return (self.get(i, automatic) for i in range(len(self)) if self.record_id(i) not in self.deleted)
+
+    def exists(self, rid: str) -> bool:
+        if rid in self.deleted:
+            return False
+        if rid in self.appended_fields:
+            return True
+        m = re.match(r'^rec(\d{9})$', rid)
+        return m is not None and int(m.group(1)) < self.seeded
+
+    def create(self, fields: Dict) -> str:
+        rid = self.record_id(len(self))
+        self.appended.append(rid)
+        self.appended_fields[rid] = dict(fields)
+        now = self._now()
+        self.times[rid] = (now, now)
+        return rid
+
+    def update(self, rid: str, fields: Dict) -> None:
+        if rid in self.appended_fields:
+            self.appended_fields[rid].update(fields)
+        else:
+            self.overrides.setdefault(rid, {}).update(fields)
+        created = self.times[rid][0] if rid in self.times else self.created_at - (self.seeded - int(rid[3:])) * 1000
+        self.times[rid] = (created, self._now())
+
+    def delete(self, rid: str) -> None:
+        self.deleted.add(rid)
+
+
+class Sheet:
+
+    def __init__(self, rows: int = 0, cols: int = 5, row_count: Optional[int] = None):
+        self.values = [[f'r{i}c{j}' if j else i for j in range(cols)] for i in range(rows)]
+        self.row_count = max(row_count or 0, rows, 200)
+        self.column_count = max(cols, 20)
+
+
+class MockFeishu:
+    """State and request handling of the mock, independent of the http server."""
+
+    def __init__(self, config: Optional[MockConfig] = None):
+        self.config = config or MockConfig()
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.nodes = {}
+            self.wiki = []
+            self.tables = {}
+            self.sheets = {}
+            self.tokens = {}
+            self.images = 0
+            self.webhooks = {}
+            self.stats = {}
+            # every records filter received, formulas and search filters alike
+            self.filters = []
+            self.random = random.Random(self.config.seed)
+            self._allowance = None
+            self._allowance_at = time.monotonic()
+
+    # ---- setup ----
+    def add_bitable(self, node_token: str, table_id: str, rows: int = 0, app_token: Optional[str] = None,
+                    modified_field: Optional[str] = None) -> str:
+        app_token = app_token or f'bas{node_token}'
+        with self.lock:
+            self.nodes[node_token] = (app_token, 'bitable')
+            self.tables[(app_token, table_id)] = Table(rows, modified_field)
+        return app_token
+
+    def add_wiki_node(self, space_id: str, node_token: str, obj_type: str = 'doc', obj_token: Optional[str] = None,
+                      parent: Optional[str] = None, title: Optional[str] = None) -> None:
+        """Place a node in the tree of a wiki space; add_bitable/add_sheet the node first for those types."""
+        obj_token = obj_token or self.nodes.get(node_token, (f'doc{node_token}', obj_type))[0]
+        with self.lock:
+            self.wiki.append({'space_id': space_id, 'node_token': node_token, 'obj_token': obj_token, 'obj_type': obj_type,
+                              'parent_node_token': parent or '', 'title': title or node_token})
+
+    def add_sheet(self, node_token: str, sheet_id: str, rows: int = 0, cols: int = 5, sheet_token: Optional[str] = None) -> str:
+        sheet_token = sheet_token or f'sht{node_token}'
+        with self.lock:
+            self.nodes[node_token] = (sheet_token, 'sheet')
+            self.sheets.setdefault(sheet_token, {})[sheet_id] = Sheet(rows, cols)
+        return sheet_token
+
+    # ---- bookkeeping ----
+    def _count(self, key, name, n=1):
+        s = self.stats.setdefault(key, {'requests': 0, 'bytes_in': 0, 'bytes_out': 0, 'throttled': 0, 'errors': 0})
+        s[name] += n
+
+    def _throttled(self) -> bool:
+        rate = self.config.rate_limit
+        if not rate:
+            return False
+        now = time.monotonic()
+        if self._allowance is None:
+            self._allowance = rate
+        self._allowance = min(rate, self._allowance + (now - self._allowance_at) * rate)
+        self._allowance_at = now
+        if self._allowance < 1:
+            return True
+        self._allowance -= 1
+        return False
+
+    def handle(self, method: str, path: str, query: Dict[str, str], body: bytes, headers) -> tuple:
+        """Returns ``(status, payload dict, extra headers)``."""
+        key = f'{method} {endpoint_of(path)}'
+        with self.lock:
+            self._count(key, 'requests')
+            self._count(key, 'bytes_in', len(body))
+            if path.startswith(PREFIX):
+                if self._throttled():
+                    self._count(key, 'throttled')
+                    return 429, {'code': 99991400, 'msg': 'request trigger frequency limit'}, {'Retry-After': '1'}
+                if self.config.error_rate and self.random.random() < self.config.error_rate:
+                    self._count(key, 'errors')
+                    return self.config.error_status, {'code': self.config.error_code, 'msg': 'injected error'}, {}
+        delay = self.config.latency + (self.random.random() * self.config.jitter if self.config.jitter else 0)
+        if delay and path.startswith(PREFIX):
+            time.sleep(delay)
+        try:
+            payload = json.loads(body) if body and 'json' in (headers.get('Content-Type') or '') else None
+            status, d = self._route(method, path, query, body, payload, headers)
+        except KeyError as e:
+            status, d = 404, {'code': 1254004, 'msg': f'not found: {e}'}
+        return status, d, {}
+
+    def _authorized(self, headers) -> bool:
+        auth = headers.get('Authorization') or ''
+        expires = self.tokens.get(auth[len('Bearer '):])
+        return expires is not None and expires > time.time()
+
+    def _route(self, method, path, query, body, payload, headers):
+        if path == '/_mock/stats':
+            with self.lock:
+                return 200, {'code': 0, 'data': {'endpoints': self.stats, 'config': asdict(self.config),
+                                                 'images': self.images, 'webhooks': self.webhooks}}
+        if path == '/_mock/config':
+            with self.lock:
+                for k, v in (payload or {}).items():
+                    assert hasattr(self.config, k), f'unknown config {k}'
+                    setattr(self.config, k, v)
+            return 200, {'code': 0, 'data': asdict(self.config)}
+        if path == '/_mock/reset':
+            self.reset()
+            return 200, {'code': 0}
+        if path == '/_mock/bitable':
+            app_token = self.add_bitable(payload['node_token'], payload['table_id'], payload.get('rows', 0))
+            return 200, {'code': 0, 'data': {'app_token': app_token}}
+        if path == '/_mock/sheet':
+            sheet_token = self.add_sheet(payload['node_token'], payload['sheet_id'], payload.get('rows', 0), payload.get('cols', 5))
+            return 200, {'code': 0, 'data': {'sheet_token': sheet_token}}
+        if path.startswith('/webhook/'):
+            name = path[len('/webhook/'):]
+            with self.lock:
+                self.webhooks[name] = self.webhooks.get(name, 0) + 1
+            return 200, {'StatusCode': 0, 'code': 0, 'msg': 'success'}
+        assert path.startswith(PREFIX), path
+        api = path[len(PREFIX):]
+        if api == '/auth/v3/tenant_access_token/internal':
+            token = f't-{self.random.getrandbits(64):016x}'
+            with self.lock:
+                self.tokens[token] = time.time() + self.config.token_expire
+            return 200, {'code': 0, 'msg': 'ok', 'tenant_access_token': token, 'expire': self.config.token_expire}
+        if not self._authorized(headers):
+            return 400, {'code': 99991663, 'msg': 'invalid access token'}
+        if api == '/wiki/v2/spaces/get_node':
+            obj_token, obj_type = self.nodes[query['token']]
+            return 200, {'code': 0, 'data': {'node': {'node_token': query['token'], 'obj_token': obj_token, 'obj_type': obj_type}}}
+        if api == '/im/v1/images':
+            with self.lock:
+                self.images += 1
+                n = self.images
+            return 200, {'code': 0, 'data': {'image_key': f'img_v2_{n:08d}'}}
+        m = re.match(r'^/sheets/v2/spreadsheets/([^/]+)/(metainfo|values_append|values_batch_get|values|dimension_range)(?:/(.+))?$', api)
+        if m:
+            return self._sheet(method, m.group(1), m.group(2), m.group(3), payload, query)
+        m = re.match(r'^/bitable/v1/apps/([^/]+)/tables/([^/]+)/records(?:/([^/]+))?$', api)
+        if m:
+            return self._records(method, m.group(1), m.group(2), m.group(3), query, payload)
+        m = re.match(r'^/bitable/v1/apps/([^/]+)/tables/([^/]+)/fields$', api)
+        if m:
+            table = self.tables[(m.group(1), m.group(2))]
+            with self.lock:
+                # fields only ever written are reported as text
+                names = {f['field_name'] for f in SEED_SCHEMA}
+                extra = dict.fromkeys(k for fields in table.appended_fields.values() for k in fields if k not in names)
+            items = SEED_SCHEMA + [{'field_id': f'fld{i}', 'field_name': k, 'type': 1} for i, k in enumerate(extra)]
+            if table.modified_field is not None:
+                items.append({'field_id': 'fldmodified', 'field_name': table.modified_field, 'type': 1002})
+            return 200, {'code': 0, 'data': self._page(items, query)}
+        m = re.match(r'^/bitable/v1/apps/([^/]+)/tables/?$', api)
+        if m:
+            items = [{'table_id': t, 'name': t} for (a, t) in self.tables if a == m.group(1)]
+            return 200, {'code': 0, 'data': self._page(items, query)}
+        if api == '/wiki/v2/spaces':
+            spaces = list(dict.fromkeys(n['space_id'] for n in self.wiki))
+            return 200, {'code': 0, 'data': self._page([{'space_id': sp, 'name': sp} for sp in spaces], query)}
+        m = re.match(r'^/wiki/v2/spaces/([^/]+)/nodes$', api)
+        if m:
+            parent = query.get('parent_node_token') or ''
+            with self.lock:
+                parents = {n['parent_node_token'] for n in self.wiki}
+                items = [{**n, 'has_child': n['node_token'] in parents} for n in self.wiki
+                         if n['space_id'] == m.group(1) and n['parent_node_token'] == parent]
+            return 200, {'code': 0, 'data': self._page(items, query)}
+        return 404, {'code': 1254004, 'msg': f'unknown api {method} {api}'}
+
+    def _page(self, items, query, default_size=20):
+        size = min(int(query.get('page_size') or default_size), self.config.page_limit)
+        start = int(query.get('page_token') or 0)
+        data = {'items': items[start:start + size], 'has_more': start + size < len(items)}
+        if data['has_more']:
+            data['page_token'] = str(start + size)
+        return data
+
+    # ---- bitable ----
+    def _records(self, method, app_token, table_id, action, query, payload):
+        table = self.tables[(app_token, table_id)]
+        if action is None and method == 'GET' or action == 'search':
+            payload = payload or {}
+            page_size = min(int(query.get('page_size') or 20), self.config.page_limit)
+            start = int(query.get('page_token') or 0)
+            names = payload.get('field_names')
+            if names is None and query.get('field_names'):
+                names = json.loads(query['field_names'])
+            automatic = bool(payload.get('automatic_fields')) or query.get('automatic_fields') == 'true'
+            predicate = None
+            received = query.get('filter') if action is None else payload.get('filter')
+            if received:
+                with self.lock:
+                    self.filters.append(received)
+                try:
+                    predicate = parse_formula(received) if action is None else parse_conditions(received)
+                except (ValueError, KeyError):
+                    return 400, {'code': 1254018, 'msg': f'invalid filter {received}'}
+            with self.lock:
+                if predicate is None and not table.deleted:
+                    end = min(len(table), start + page_size)
+                    items = [table.get(i, automatic) for i in range(start, end)]
+                    total = len(table)
+                else:
+                    matched = [r for r in table.rows(automatic) if predicate is None or predicate(r['fields'])]
+                    items = matched[start:start + page_size]
+                    end = start + len(items)
+                    total = len(matched)
+            if names is not None:
+                keep = set(names)
+                for item in items:
+                    item['fields'] = {k: v for k, v in item['fields'].items() if k in keep}
+            data = {'items': items, 'has_more': end < total, 'total': total}
+            if end < total:
+                data['page_token'] = str(end)
+            return 200, {'code': 0, 'data': data}
+        if action == 'batch_create':
+            records = payload['records']
+            if len(records) > 500:
+                return 400, {'code': 1254104, 'msg': 'records exceed 500'}
+            with self.lock:
+                client_token = query.get('client_token')
+                if client_token and client_token in table.client_tokens:
+                    return 200, {'code': 0, 'data': {'records': table.client_tokens[client_token]}}
+                created = [{'record_id': table.create(r['fields']), 'fields': r['fields']} for r in records]
+                if client_token:
+                    table.client_tokens[client_token] = created
+            return 200, {'code': 0, 'data': {'records': created}}
+        if action == 'batch_update':
+            records = payload['records']
+            if len(records) > 500:
+                return 400, {'code': 1254104, 'msg': 'records exceed 500'}
+            with self.lock:
+                missing = [r['record_id'] for r in records if not table.exists(r['record_id'])]
+                if missing:
+                    return 400, {'code': 1254043, 'msg': f'record not found {missing[0]}'}
+                for r in records:
+                    table.update(r['record_id'], r['fields'])
+            return 200, {'code': 0, 'data': {'records': records}}
+        if method == 'PUT' and action is not None:
+            with self.lock:
+                if not table.exists(action):
+                    return 400, {'code': 1254043, 'msg': f'record not found {action}'}
+                table.update(action, payload['fields'])
+            return 200, {'code': 0, 'data': {'record': {'record_id': action, 'fields': payload['fields']}}}
+        return 404, {'code': 1254004, 'msg': f'unknown records api {method} {action}'}
+
+    # ---- sheets ----
+    def _parse_range(self, sheet_token, sheet_range):
+        sheet_id, _, cells = unquote(sheet_range).partition('!')
+        sheet = self.sheets[sheet_token][sheet_id]
+        if not cells:
+            return sheet_id, sheet, 0, len(sheet.values), 0, sheet.column_count
+        m = re.match(r'^([A-Za-z]+)(\d+)?(?::([A-Za-z]+)(\d+)?)?$', cells)
+        c0, r0, c1, r1 = m.groups()
+        row0 = int(r0 or 1) - 1
+        row1 = int(r1) if r1 else (row0 + 1 if r0 and not c1 else sheet.row_count)
+        return sheet_id, sheet, row0, row1, _col_index(c0), _col_index(c1 or c0) + 1
+
+    def _value_range(self, sheet_token, sheet_range):
+        sheet_id, sheet, row0, row1, col0, col1 = self._parse_range(sheet_token, sheet_range)
+        width = col1 - col0
+        with self.lock:
+            # like the api, the whole requested grid comes back with None in empty cells
+            values = [row[col0:col1] + [None] * (width - len(row[col0:col1])) for row in sheet.values[row0:min(row1, len(sheet.values))]]
+            values.extend([None] * width for _ in range(max(0, min(row1, sheet.row_count) - row0 - len(values))))
+        rng = f'{sheet_id}!{_col_letter(col0)}{row0 + 1}:{_col_letter(col1 - 1)}{row0 + max(len(values), 1)}'
+        return {'range': rng, 'values': values, 'majorDimension': 'ROWS'}
+
+    def _sheet(self, method, sheet_token, action, rest, payload, query):
+        if action == 'metainfo':
+            sheets = [{'sheetId': sid, 'title': sid, 'index': i, 'rowCount': s.row_count, 'columnCount': s.column_count}
+                      for i, (sid, s) in enumerate(self.sheets[sheet_token].items())]
+            return 200, {'code': 0, 'data': {'spreadsheetToken': sheet_token, 'sheets': sheets, 'properties': {'sheetCount': len(sheets)}}}
+        if action == 'dimension_range':
+            dim = payload['dimension']
+            with self.lock:
+                sheet = self.sheets[sheet_token][dim['sheetId']]
+                if dim.get('majorDimension', 'ROWS') == 'ROWS':
+                    sheet.row_count += dim['length']
+                else:
+                    sheet.column_count += dim['length']
+            return 200, {'code': 0, 'data': {'addCount': dim['length'], 'majorDimension': dim.get('majorDimension', 'ROWS')}}
+        if action == 'values' and method == 'GET':
+            return 200, {'code': 0, 'data': {'valueRange': self._value_range(sheet_token, rest)}}
+        if action == 'values_batch_get':
+            ranges = [self._value_range(sheet_token, r) for r in query['ranges'].split(',')]
+            return 200, {'code': 0, 'data': {'spreadsheetToken': sheet_token, 'valueRanges': ranges}}
+        value_range = payload['valueRange']
+        values = value_range['values']
+        if len(values) > 5000:
+            return 400, {'code': 90221, 'msg': 'too many rows'}
+        width = max((len(r) for r in values), default=0)
+        with self.lock:
+            sheet_id, sheet, row0, row1, col0, col1 = self._parse_range(sheet_token, value_range['range'])
+            if action == 'values_append':
+                row0 = len(sheet.values)
+            elif row0 + len(values) > sheet.row_count:
+                return 400, {'code': 90202, 'msg': 'range exceeds the sheet grid'}
+            while len(sheet.values) < row0 + len(values):
+                sheet.values.append([])
+            for i, row in enumerate(values):
+                target = sheet.values[row0 + i]
+                if len(target) < col0 + len(row):
+                    target.extend([None] * (col0 + len(row) - len(target)))
+                target[col0:col0 + len(row)] = row
+            sheet.row_count = max(sheet.row_count, len(sheet.values))
+        updated = f'{sheet_id}!{_col_letter(col0)}{row0 + 1}:{_col_letter(col0 + max(width, 1) - 1)}{row0 + len(values)}'
+        updates = {'updatedRange': updated, 'updatedRows': len(values), 'updatedColumns': width,
+                   'updatedCells': sum(len(r) for r in values)}
+        if action == 'values_append':
+            return 200, {'code': 0, 'data': {'tableRange': updated, 'updates': updates}}
+        return 200, {'code': 0, 'data': updates}
+
+
+def endpoint_of(path: str) -> str:
+    # ids -> ':id', same shape as feishuconnector.scheduler.endpoint_key
+    if path.startswith(PREFIX):
+        path = path[len(PREFIX):]
+    return '/'.join(s if s in API_WORDS or re.match(r'^v\d+$', s) else ':id' for s in path.strip('/').split('/'))
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    mock: MockFeishu = None
+
+    def _serve(self, method):
+        url = urlparse(self.path)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        status, payload, headers = self.mock.handle(method, url.path, query, body, self.headers)
+        out = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        with self.mock.lock:
+            self.mock._count(f'{method} {endpoint_of(url.path)}', 'bytes_out', len(out))
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(out)))
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(out)
+
+    def do_GET(self):
+        self._serve('GET')
+
+    def do_POST(self):
+        self._serve('POST')
+
+    def do_PUT(self):
+        self._serve('PUT')
+
+    def log_message(self, *args):
+        pass
+
+
+class MockServer:
+    """Runs a ``MockFeishu`` on a threaded http server, in a background thread of this process."""
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, config: Optional[MockConfig] = None):
+        self.mock = MockFeishu(config)
+        handler = type('Handler', (_Handler,), {'mock': self.mock})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    @property
+    def base_url(self) -> str:
+        return f'{self.url}{PREFIX}'
+
+    def webhook_url(self, name: str = 'default') -> str:
+        return f'{self.url}/webhook/{name}'
+
+    def add_bitable(self, *args, **kwargs) -> str:
+        return self.mock.add_bitable(*args, **kwargs)
+
+    def add_sheet(self, *args, **kwargs) -> str:
+        return self.mock.add_sheet(*args, **kwargs)
+
+    def add_wiki_node(self, *args, **kwargs) -> None:
+        self.mock.add_wiki_node(*args, **kwargs)
+
+    def start(self) -> 'MockServer':
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name='feishu-mock-server', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8700)
+    for name, default in asdict(MockConfig()).items():
+        parser.add_argument(f'--{name.replace("_", "-")}', type=type(default) if default is not None else float, default=default)
+    args = vars(parser.parse_args(argv))
+    host, port = args.pop('host'), args.pop('port')
+    server = MockServer(host, port, MockConfig(**args))
+    print(f'mock feishu api on {server.base_url}')
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
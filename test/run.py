@@ -0,0 +1,829 @@
+"""Behaviour tests, run against the local mock server where they need the api.
+
+    python test/run.py
+    python test/run.py -k Token
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import decimal
+import threading
+import unittest
+
+import asyncio
+
+import numpy as np
+import pandas as pd
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from mock_server import MockConfig, MockServer  # noqa: E402
+
+from feishuconnector import AsyncFeishuConnector, BitableSnapshot, FeishuConnector, FileTokenStore, RequestScheduler  # noqa: E402
+from feishuconnector.auth import TokenManager, TokenStore  # noqa: E402
+from feishuconnector.scheduler import AdaptiveLimiter  # noqa: E402
+from feishuconnector.dataframe import df_to_records, iter_df_records  # noqa: E402
+from feishuconnector.export import WikiExporter, pa  # noqa: E402
+from feishuconnector.query import compile_filter, compile_local, match  # noqa: E402
+
+
+class MockTestCase(unittest.TestCase):
+    """One mock server per test class, emptied and reconfigured before every test."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = MockServer().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def setUp(self):
+        self.server.mock.config = MockConfig()
+        self.server.mock.reset()
+
+    def connector(self, **kwargs) -> FeishuConnector:
+        # a private scheduler with short backoffs, so retries don't slow the tests down
+        kwargs.setdefault('scheduler', RequestScheduler(base_delay=0.01, max_delay=0.05))
+        fc = FeishuConnector({'default': self.server.webhook_url()}, base_url=self.server.base_url, **kwargs)
+        fc.init('cli_test', 'secret')
+        self.addCleanup(fc.close)
+        return fc
+
+    def requests(self, endpoint: str) -> int:
+        return self.server.mock.stats.get(endpoint, {}).get('requests', 0)
+
+
+class TokenManagerTest(unittest.TestCase):
+
+    def manager(self, expire=7200, refresh_margin=300, store=None, delay=0.0):
+        calls = []
+
+        def fetch():
+            time.sleep(delay)
+            calls.append(1)
+            return f't{len(calls)}', expire
+
+        return TokenManager(fetch, store=store, refresh_margin=refresh_margin), calls
+
+    def test_token_is_cached_until_the_refresh_margin(self):
+        tokens, calls = self.manager()
+        self.assertEqual(tokens.get(), 't1')
+        self.assertEqual(tokens.get(), 't1')
+        self.assertEqual(len(calls), 1)
+
+        tokens, calls = self.manager(expire=100, refresh_margin=300)
+        self.assertEqual(tokens.get(), 't1')
+        self.assertEqual(tokens.get(), 't2')
+
+    def test_invalidate_only_drops_the_given_token(self):
+        tokens, calls = self.manager()
+        tokens.get()
+        tokens.invalidate('another')
+        self.assertEqual(tokens.get(), 't1')
+        tokens.invalidate('t1')
+        self.assertEqual(tokens.get(), 't2')
+        tokens.invalidate()
+        self.assertEqual(tokens.get(), 't3')
+
+    def test_concurrent_callers_refresh_once(self):
+        tokens, calls = self.manager(delay=0.05)
+        got = []
+        threads = [threading.Thread(target=lambda: got.append(tokens.get())) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(set(got), {'t1'})
+
+    def test_file_store_shares_the_token(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'token.json')
+            first, first_calls = self.manager(store=FileTokenStore(path))
+            second, second_calls = self.manager(store=FileTokenStore(path))
+            self.assertEqual(first.get(), 't1')
+            self.assertEqual(second.get(), 't1')
+            self.assertEqual(len(second_calls), 0)
+            second.invalidate('t1')
+            self.assertEqual(second.get(), 't1')
+            self.assertEqual(len(second_calls), 1)
+
+    @unittest.skipIf(os.name != 'posix', 'file modes')
+    def test_file_store_is_private(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'private', 'token.json')
+            store = FileTokenStore(path)
+            with store.lock():
+                store.save('t1', time.time() + 7200)
+            self.assertEqual(os.stat(path).st_mode & 0o777, 0o600)
+            self.assertEqual(os.stat(f'{path}.lock').st_mode & 0o777, 0o600)
+            self.assertEqual(os.stat(os.path.dirname(path)).st_mode & 0o777, 0o700)
+
+    def test_token_store_is_abstract(self):
+        with self.assertRaises(TypeError):
+            TokenStore()
+
+
+class TokenRefreshTest(MockTestCase):
+
+    def test_rejected_token_is_refreshed_once(self):
+        self.server.add_bitable('wik1', 'tbl1', rows=3)
+        fc = self.connector()
+        first = fc.token
+        # the server forgets every token, as after a revoke
+        self.server.mock.tokens.clear()
+        self.assertEqual(len(fc.get_bitable_records('wik1', 'tbl1')), 3)
+        self.assertNotEqual(fc.token, first)
+        self.assertEqual(self.requests('POST auth/v3/tenant_access_token/internal'), 2)
+
+
+class DfToRecordsTest(MockTestCase):
+
+    def frame(self):
+        return pd.DataFrame({
+            'int': np.array([1, 2, 3], dtype='int64'),
+            'float': [1.5, np.nan, 3.0],
+            'when': pd.to_datetime(['2024-01-01 00:00:00', None, '2024-01-01 00:00:01']),
+            'when_tz': pd.to_datetime(['2024-01-01 08:00:00'] * 3).tz_localize('Asia/Shanghai'),
+            'nullable': pd.array([1, None, 3], dtype='Int64'),
+            'flag': [True, False, True],
+            'status': pd.Categorical(['open', None, 'done']),
+            'text': ['a', None, 'c'],
+            'tags': [['x', 'y'], np.array(['z']), []],
+            'mixed': [np.int64(7), decimal.Decimal('2.5'), pd.NA],
+        })
+
+    def test_dtypes_become_native_values(self):
+        records = df_to_records(self.frame())
+        self.assertEqual(records[0], {
+            'int': 1, 'float': 1.5, 'when': 1704067200000, 'when_tz': 1704067200000, 'nullable': 1, 'flag': True,
+            'status': 'open', 'text': 'a', 'tags': ['x', 'y'], 'mixed': 7,
+        })
+        self.assertIs(type(records[0]['int']), int)
+        self.assertIs(type(records[0]['flag']), bool)
+        self.assertIs(type(records[0]['mixed']), int)
+        self.assertEqual(records[1]['mixed'], 2.5)
+        self.assertEqual(records[2]['when'], 1704067201000)
+        self.assertEqual(records[2]['tags'], [])
+
+    def test_missing_cells_are_left_out(self):
+        records = df_to_records(self.frame())
+        self.assertEqual(set(records[1]), {'int', 'when_tz', 'flag', 'tags', 'mixed'})
+        self.assertNotIn('mixed', records[2])
+
+    def test_frame_is_not_modified(self):
+        df = self.frame()
+        before = df.copy()
+        df_to_records(df)
+        pd.testing.assert_frame_equal(df, before)
+
+    def test_chunks_and_round_trip(self):
+        df = pd.DataFrame({'name': [f'n{i}' for i in range(7)], 'count': range(7)})
+        self.assertEqual([len(c) for c in iter_df_records(df, 3)], [3, 3, 1])
+        self.server.add_bitable('wik1', 'tbl1')
+        fc = self.connector()
+        self.assertEqual(fc.append_bitable_df('wik1', 'tbl1', df, chunk_size=3), 7)
+        back = fc.get_bitable_df('wik1', 'tbl1')
+        self.assertEqual(back['name'].tolist(), df['name'].tolist())
+        self.assertEqual(back['count'].tolist(), df['count'].tolist())
+
+
+class CompileFilterTest(MockTestCase):
+
+    def test_numbers_and_strings_become_formulas(self):
+        self.assertEqual(compile_filter({'name': 'item 1'}), ('CurrentValue.[name]="item 1"', []))
+        formula, local = compile_filter({'count': {'>=': 10, 'lt': 20}, 'status': {'in': ['open', 'done']}})
+        self.assertEqual(formula, 'AND(CurrentValue.[count]>=10, CurrentValue.[count]<20, '
+                                  'OR(CurrentValue.[status]="open", CurrentValue.[status]="done"))')
+        self.assertEqual(local, [])
+        self.assertEqual(compile_filter({}), (None, []))
+        self.assertEqual(compile_filter(None), (None, []))
+
+    def test_number_literals_are_plain_digits(self):
+        self.assertEqual(compile_filter({'n': 1e20})[0], 'CurrentValue.[n]=100000000000000000000')
+        self.assertEqual(compile_filter({'n': 1.5e-7})[0], 'CurrentValue.[n]=0.00000015')
+        self.assertEqual(compile_filter({'n': np.int64(3)})[0], 'CurrentValue.[n]=3')
+        self.assertEqual(compile_filter({'n': 0.1})[0], 'CurrentValue.[n]=0.1')
+
+    def test_inexpressible_conditions_stay_local(self):
+        conditions = {
+            'flag': True,
+            'n': float('nan'),
+            'big': {'<': float('inf')},
+            'quote': 'say "hi"',
+            'odd]name': 1,
+            'status': {'in': ['open', None]},
+            'count': lambda v: v is not None and v % 2 == 0,
+        }
+        formula, local = compile_filter(conditions)
+        self.assertIsNone(formula)
+        self.assertEqual([k for k, _ in local], list(conditions))
+        predicates = dict(local)
+        self.assertTrue(predicates['flag'](True))
+        self.assertFalse(predicates['flag'](False))
+        self.assertTrue(predicates['big'](1e300))
+        self.assertTrue(predicates['quote']('say "hi"'))
+        self.assertTrue(predicates['status'](None))
+        self.assertFalse(predicates['count'](3))
+
+    def test_mixed_conditions_split(self):
+        formula, local = compile_filter({'count': {'>': 1}, 'flag': False})
+        self.assertEqual(formula, 'CurrentValue.[count]>1')
+        self.assertEqual([k for k, _ in local], ['flag'])
+        self.assertTrue(match({'count': 2}, compile_local({'count': {'>': 1}, 'flag': None})))
+        self.assertFalse(match({'count': 1}, compile_local({'count': {'>': 1}})))
+
+    def test_dict_values_are_matched_not_read_as_operators(self):
+        link = {'link': 'https://example.com', 'text': 'example'}
+        formula, local = compile_filter({'url': link})
+        self.assertIsNone(formula)
+        self.assertTrue(dict(local)['url'](dict(link)))
+        self.assertFalse(dict(local)['url']({'link': 'https://example.com', 'text': 'other'}))
+        # aliases and 'in' still count as operators
+        self.assertEqual(compile_filter({'n': {'gte': 1, 'in': [1, 2]}})[0],
+                         'AND(CurrentValue.[n]>=1, OR(CurrentValue.[n]=1, CurrentValue.[n]=2))')
+        self.assertEqual(compile_filter({'n': {'>': 1, 'like': 2}})[0], None)
+
+        app_token = self.server.add_bitable('wik1', 'tbl1', rows=3)
+        table = self.server.mock.tables[(app_token, 'tbl1')]
+        table.create({'name': 'linked', 'url': link})
+        table.create({'name': 'other', 'url': {'link': 'https://example.org', 'text': 'other'}})
+        records = self.connector().get_filtered_records('wik1', 'tbl1', {'url': link}, field_names=['name'])
+        self.assertEqual([r['fields'] for r in records], [{'name': 'linked'}])
+
+    def test_formula_reaches_the_server(self):
+        self.server.add_bitable('wik1', 'tbl1', rows=30)
+        fc = self.connector()
+        records = fc.get_filtered_records('wik1', 'tbl1', {'count': {'<': 3}})
+        self.assertEqual([r['fields']['count'] for r in records], [0, 1, 2])
+        self.assertEqual(self.server.mock.filters, ['CurrentValue.[count]<3'])
+
+        result = fc.update_bitable_records('wik1', 'tbl1', {'count': {'<': 3}, 'status': 'open'}, {'name': 'first'})
+        self.assertEqual(result.succeeded, 1)
+        self.assertEqual(self.server.mock.filters[-1], 'AND(CurrentValue.[count]<3, CurrentValue.[status]="open")')
+        names = [r['fields']['name'] for r in fc.get_bitable_records('wik1', 'tbl1')]
+        self.assertEqual(names, ['first'] + [f'item {i}' for i in range(1, 30)])
+
+    def test_local_conditions_filter_fetched_records(self):
+        self.server.add_bitable('wik1', 'tbl1', rows=20)
+        fc = self.connector()
+        records = fc.get_filtered_records('wik1', 'tbl1', {'count': lambda v: v % 5 == 0}, field_names=['name'])
+        self.assertEqual([r['fields'] for r in records], [{'name': f'item {i}'} for i in (0, 5, 10, 15)])
+
+
+class UpsertTest(MockTestCase):
+    CREATE = 'POST bitable/v1/apps/:id/tables/:id/records/batch_create'
+    UPDATE = 'POST bitable/v1/apps/:id/tables/:id/records/batch_update'
+
+    def setUp(self):
+        super().setUp()
+        app_token = self.server.add_bitable('wik1', 'tbl1', rows=5)
+        self.table = self.server.mock.tables[(app_token, 'tbl1')]
+        self.records = [
+            {'name': 'item 0', 'count': 0},
+            # 1.0 and 1 are the same number
+            {'name': 'item 1', 'count': 1.0, 'status': 'in progress'},
+            {'name': 'item 2', 'count': 99, 'status': 'done'},
+            {'name': 'item 3', 'count': 30},
+            {'name': 'item 3', 'status': 'x'},
+            {'name': 'new', 'count': 5},
+            {'count': 7},
+        ]
+
+    def fields(self, fc):
+        return {r['fields']['name']: r['fields'] for r in fc.get_bitable_records('wik1', 'tbl1')}
+
+    def test_records_split_into_inserts_updates_and_unchanged(self):
+        fc = self.connector()
+        result = fc.upsert_bitable_records('wik1', 'tbl1', self.records, keys=['name'], dry_run=True)
+        plan = result.plan
+        self.assertEqual(plan.inserts, [{'name': 'new', 'count': 5}])
+        # only the changed fields are sent, never the key, and repeated keys are merged
+        self.assertEqual(plan.updates, [
+            {'record_id': 'rec000000002', 'fields': {'count': 99}},
+            {'record_id': 'rec000000003', 'fields': {'count': 30, 'status': 'x'}},
+        ])
+        self.assertEqual((plan.unchanged, plan.unkeyed), (2, 1))
+        self.assertEqual(self.requests(self.CREATE) + self.requests(self.UPDATE), 0)
+        self.assertEqual(len(self.table), 5)
+
+    def test_upsert_writes_the_plan(self):
+        fc = self.connector()
+        result = fc.upsert_bitable_records('wik1', 'tbl1', self.records, keys='name')
+        self.assertEqual((result.inserted.succeeded, result.updated.succeeded), (1, 2))
+        self.assertEqual((self.requests(self.CREATE), self.requests(self.UPDATE)), (1, 1))
+        fields = self.fields(fc)
+        self.assertEqual(len(fields), 6)
+        self.assertEqual(fields['item 2']['count'], 99)
+        self.assertEqual((fields['item 3']['count'], fields['item 3']['status']), (30, 'x'))
+        self.assertEqual(fields['new']['count'], 5)
+
+        again = fc.upsert_bitable_records('wik1', 'tbl1', self.records, keys='name')
+        self.assertEqual((len(again.plan.inserts), len(again.plan.updates), again.plan.unchanged), (0, 0, 5))
+        self.assertEqual((self.requests(self.CREATE), self.requests(self.UPDATE)), (1, 1))
+
+    def test_existing_duplicates_update_the_first(self):
+        self.table.create({'name': 'item 0', 'count': 500})
+        fc = self.connector()
+        result = fc.upsert_bitable_records('wik1', 'tbl1', [{'name': 'item 0', 'count': 1}], keys=['name'], dry_run=True)
+        self.assertEqual(result.duplicates, 1)
+        self.assertEqual(result.plan.updates, [{'record_id': 'rec000000000', 'fields': {'count': 1}}])
+
+    def test_compound_keys(self):
+        fc = self.connector()
+        plan = fc.upsert_bitable_records('wik1', 'tbl1', [{'name': 'item 1', 'count': 1, 'status': 'z'},
+                                                          {'name': 'item 1', 'count': 2, 'status': 'z'}],
+                                         keys=['name', 'count'], dry_run=True).plan
+        self.assertEqual(plan.updates, [{'record_id': 'rec000000001', 'fields': {'status': 'z'}}])
+        self.assertEqual(plan.inserts, [{'name': 'item 1', 'count': 2, 'status': 'z'}])
+
+
+@unittest.skipUnless(pa, 'export needs pyarrow')
+class ExportResumeTest(MockTestCase):
+    RECORDS = 'GET bitable/v1/apps/:id/tables/:id/records'
+
+    def setUp(self):
+        super().setUp()
+        # 5 pages of 10 records, one part file per page
+        self.server.mock.config = MockConfig(page_limit=10)
+        self.server.add_bitable('wik1', 'tbl1', rows=50)
+        self.server.add_wiki_node('spc1', 'wik1', 'bitable')
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, True)
+
+    def crash_after(self, fc, pages):
+        iter_records = fc.iter_bitable_records
+
+        def iter_then_crash(*args, **kwargs):
+            for i, page in enumerate(iter_records(*args, **kwargs)):
+                yield page
+                if i + 1 >= pages:
+                    raise ConnectionError('connection lost')
+
+        fc.iter_bitable_records = iter_then_crash
+
+    def test_rerun_continues_from_the_last_part(self):
+        fc = self.connector()
+        self.crash_after(fc, 2)
+        result = WikiExporter(fc, self.directory, pages_per_part=1).run('spc1')
+        self.assertEqual(list(result.failed), ['wik1_tbl1'])
+        state = WikiExporter(self.connector(), self.directory).manifest['tables']['wik1_tbl1']
+        self.assertEqual((state['status'], len(state['parts']), state['rows']), ('failed', 2, 20))
+
+        before = self.requests(self.RECORDS)
+        result = WikiExporter(self.connector(), self.directory, pages_per_part=1).run('spc1')
+        # the two written pages aren't fetched again
+        self.assertEqual(self.requests(self.RECORDS) - before, 3)
+        self.assertEqual((len(result.exported), result.rows), (1, 50))
+        table = pa.parquet.read_table(os.path.join(self.directory, result.exported[0]['path']))
+        self.assertEqual(table.column('record_id').to_pylist(), [f'rec{i:09d}' for i in range(50)])
+        self.assertEqual(table.column('count').to_pylist(), list(range(50)))
+
+        before = self.requests(self.RECORDS)
+        result = WikiExporter(self.connector(), self.directory, pages_per_part=1).run('spc1')
+        self.assertEqual((len(result.skipped), len(result.exported)), (1, 0))
+        self.assertEqual(self.requests(self.RECORDS), before)
+
+
+class JournalReplayTest(MockTestCase):
+    CREATE = 'POST bitable/v1/apps/:id/tables/:id/records/batch_create'
+
+    def setUp(self):
+        super().setUp()
+        self.app_token = self.server.add_bitable('wik1', 'tbl1')
+        self.table = self.server.mock.tables[(self.app_token, 'tbl1')]
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, True)
+        self.path = os.path.join(directory, 'writer.journal')
+        self.rows = [{'name': f'row {i}', 'count': i} for i in range(5)]
+
+    def journal(self, *entries, tail=b''):
+        with open(self.path, 'wb') as f:
+            for entry in ({'target': 'wik1/tbl1'},) + entries:
+                f.write(json.dumps(entry).encode() + b'\n')
+            f.write(tail)
+
+    def names(self):
+        return [self.table.get(i)['fields']['name'] for i in range(len(self.table))]
+
+    def test_pending_batch_is_resent_with_its_client_token(self):
+        fc = self.connector()
+        # the batch reached the server, the crash came before its ack
+        fc._append_bitable_record(self.app_token, 'tbl1', self.rows[:2], client_token='tok-1')
+        self.journal({'rows': self.rows[:2]}, {'rows': self.rows[2:]}, {'batch': 'tok-1', 'size': 2})
+        with fc.buffered_writer('wik1', 'tbl1', journal=self.path, max_delay=60) as writer:
+            self.assertTrue(writer.flush(timeout=10))
+            stats = writer.stats()
+        self.assertEqual((stats['replayed'], stats['sent'], stats['batches']), (5, 5, 2))
+        self.assertEqual(self.names(), [r['name'] for r in self.rows])
+        self.assertIn('tok-1', self.table.client_tokens)
+        self.assertEqual(len(self.table.client_tokens), 2)
+        self.assertEqual(self.requests(self.CREATE), 3)
+        # everything was acknowledged, the journal starts over
+        with open(self.path, 'rb') as f:
+            self.assertEqual([json.loads(line) for line in f], [{'target': 'wik1/tbl1'}])
+
+    def test_acknowledged_rows_and_a_torn_line_are_dropped(self):
+        self.journal({'rows': self.rows[:3]}, {'batch': 'tok-1', 'size': 2}, {'ack': 2}, {'rows': self.rows[3:4]},
+                     tail=b'{"rows": [{"name": "row 4"')
+        fc = self.connector()
+        with fc.buffered_writer('wik1', 'tbl1', journal=self.path, max_delay=60) as writer:
+            self.assertEqual(writer.stats()['replayed'], 2)
+            self.assertTrue(writer.flush(timeout=10))
+        self.assertEqual(self.names(), ['row 2', 'row 3'])
+        self.assertNotIn('tok-1', self.table.client_tokens)
+
+    def test_unsent_rows_stay_in_the_journal(self):
+        fc = self.connector()
+        writer = fc.buffered_writer('wik1', 'tbl1', journal=self.path, max_delay=60, retry_delay=60)
+        self.server.mock.config = MockConfig(error_rate=1.0)
+        writer.write(self.rows[:3])
+        self.assertFalse(writer.flush(timeout=10))
+        writer.close(timeout=1)
+        self.assertEqual(len(self.table), 0)
+
+        self.server.mock.config = MockConfig()
+        with self.connector().buffered_writer('wik1', 'tbl1', journal=self.path, max_delay=60) as writer:
+            self.assertTrue(writer.flush(timeout=10))
+        self.assertEqual(self.names(), ['row 0', 'row 1', 'row 2'])
+        self.assertEqual(len(self.table.client_tokens), 1)
+
+    def sheet_writer(self, **kwargs):
+        sheet_token = self.server.add_sheet('wik2', 'sh1', rows=1, cols=3)
+        self.sheet = self.server.mock.sheets[sheet_token]['sh1']
+        self.sheet_token = sheet_token
+        fc = self.connector()
+        return fc, fc.buffered_writer('wik2', sheet_range='sh1!A1:C1', max_delay=60, retry_delay=0.01, **kwargs)
+
+    def test_failed_sheet_batch_waits_for_resume(self):
+        fc, writer = self.sheet_writer(journal=self.path)
+        self.server.mock.config = MockConfig(error_rate=1.0, error_status=502)
+        writer.write([['a', 1, 2], ['b', 3, 4]])
+        self.assertFalse(writer.flush(timeout=10))
+        time.sleep(0.1)
+        # a 502 may come after the rows were appended, nothing is resent on its own
+        self.assertEqual(self.requests('POST sheets/v2/spreadsheets/:id/values_append'), 1)
+        self.assertIsNotNone(writer.error)
+        with self.assertRaises(AssertionError):
+            writer.write([['c', 5, 6]])
+
+        self.server.mock.config = MockConfig()
+        writer.resume(resend=True)
+        self.assertTrue(writer.flush(timeout=10))
+        writer.write([['c', 5, 6]])
+        writer.close()
+        self.assertEqual(self.sheet.values[1:], [['a', 1, 2], ['b', 3, 4], ['c', 5, 6]])
+
+    def test_replayed_sheet_batch_waits_for_resume(self):
+        rows = [['a', 1, 2], ['b', 3, 4], ['c', 5, 6]]
+        target = 'wik2/sh1!A1:C1'
+        with open(self.path, 'wb') as f:
+            for entry in ({'target': target}, {'rows': rows}, {'batch': None, 'size': 2}):
+                f.write(json.dumps(entry).encode() + b'\n')
+        fc, writer = self.sheet_writer(journal=self.path)
+        # the batch made it to the sheet before the crash
+        fc._append_sheet_data(self.sheet_token, 'sh1!A1:C1', rows[:2])
+        self.assertEqual(writer.stats()['replayed'], 3)
+        self.assertFalse(writer.flush(timeout=1))
+        self.assertEqual(self.requests('POST sheets/v2/spreadsheets/:id/values_append'), 1)
+
+        writer.resume(resend=False)
+        self.assertTrue(writer.flush(timeout=10))
+        writer.close()
+        self.assertEqual(self.sheet.values[1:], rows)
+        with open(self.path, 'rb') as f:
+            self.assertEqual([json.loads(line) for line in f], [{'target': target}])
+
+    def test_stopped_sheet_writer_closes_and_keeps_its_rows(self):
+        fc, writer = self.sheet_writer(journal=self.path)
+        self.server.mock.config = MockConfig(error_rate=1.0, error_status=504)
+        writer.write([['a', 1, 2]])
+        self.assertFalse(writer.flush(timeout=10))
+        started = time.monotonic()
+        writer.close(timeout=10)
+        self.assertLess(time.monotonic() - started, 5)
+
+        self.server.mock.config = MockConfig()
+        writer = fc.buffered_writer('wik2', sheet_range='sh1!A1:C1', journal=self.path)
+        self.assertIsNotNone(writer.error)
+        writer.resume(resend=True)
+        self.assertTrue(writer.flush(timeout=10))
+        self.assertEqual(self.sheet.values[1:], [['a', 1, 2]])
+
+    def test_journal_of_another_target_is_refused(self):
+        self.journal()
+        self.server.add_bitable('wik1', 'tbl2', app_token=self.app_token)
+        with self.assertRaises(AssertionError):
+            self.connector().buffered_writer('wik1', 'tbl2', journal=self.path)
+
+
+class SheetAppendTest(MockTestCase):
+    APPEND = 'POST sheets/v2/spreadsheets/:id/values_append'
+    PUT = 'PUT sheets/v2/spreadsheets/:id/values'
+    GROW = 'POST sheets/v2/spreadsheets/:id/dimension_range'
+
+    def setUp(self):
+        super().setUp()
+        sheet_token = self.server.add_sheet('wik1', 'sh1', rows=3, cols=3)
+        self.sheet = self.server.mock.sheets[sheet_token]['sh1']
+        self.rows = [[f'new {i}', i, i * 2] for i in range(450)]
+
+    def appended(self):
+        return self.sheet.values[3:]
+
+    def test_serial_chunks_are_appended_in_order(self):
+        fc = self.connector()
+        self.assertEqual(fc.append_sheet_data('wik1', 'sh1', self.rows[:12], chunk_size=5), 12)
+        self.assertEqual(self.appended(), self.rows[:12])
+        self.assertEqual((self.requests(self.APPEND), self.requests(self.PUT), self.requests(self.GROW)), (3, 0, 0))
+
+    def test_failed_append_is_not_resent(self):
+        fc = self.connector()
+        fc.get_app_token('wik1')
+        self.server.mock.config = MockConfig(error_rate=1.0, error_status=502)
+        with self.assertRaises(AssertionError):
+            fc.append_sheet_data('wik1', 'sh1', self.rows[:12], chunk_size=5)
+        # the 502 may come after the rows were written, a second append could duplicate them
+        self.assertEqual(self.requests(self.APPEND), 1)
+
+    def test_concurrent_chunks_fill_row_ranges_and_grow_the_grid(self):
+        fc = self.connector()
+        self.assertEqual(self.sheet.row_count, 200)
+        self.assertEqual(fc.append_sheet_data('wik1', 'sh1', self.rows, chunk_size=100, concurrency=4), 450)
+        self.assertEqual(self.appended(), self.rows)
+        self.assertGreaterEqual(self.sheet.row_count, 453)
+        self.assertEqual((self.requests(self.APPEND), self.requests(self.PUT)), (1, 4))
+        self.assertGreaterEqual(self.requests(self.GROW), 1)
+
+
+class SyncTest(MockTestCase):
+    SEARCH = 'POST bitable/v1/apps/:id/tables/:id/records/search'
+
+    def setUp(self):
+        super().setUp()
+        app_token = self.server.add_bitable('wik1', 'tbl1', rows=5, modified_field='modified')
+        self.table = self.server.mock.tables[(app_token, 'tbl1')]
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, True)
+        self.snapshot = BitableSnapshot(os.path.join(directory, 'snapshot.db'), 'wik1', 'tbl1')
+        self.addCleanup(self.snapshot.close)
+
+    def test_first_sync_pulls_the_whole_table(self):
+        fc = self.connector()
+        result = fc.sync_bitable(self.snapshot, modified_field='modified')
+        self.assertEqual((result.changed, result.deleted, result.full_scan, result.requests), (5, 0, True, 1))
+        # the latest modified time seen, the last seeded record's
+        self.assertEqual(result.high_water_mark, self.table.created_at - 1000)
+        self.assertEqual(len(self.snapshot), 5)
+        self.assertEqual(self.snapshot.get('rec000000003')['fields']['name'], 'item 3')
+        self.assertEqual(self.server.mock.filters, [])
+
+    def test_incremental_sync_fetches_changes_since_the_mark(self):
+        fc = self.connector()
+        hwm = fc.sync_bitable(self.snapshot, modified_field='modified').high_water_mark
+        self.table.update('rec000000001', {'name': 'renamed'})
+        rid = self.table.create({'name': 'added', 'count': 9})
+
+        result = fc.sync_bitable(self.snapshot, modified_field='modified', full_scan_interval=3600)
+        self.assertFalse(result.full_scan)
+        self.assertEqual(result.requests, 1)
+        # the two writes, plus the record sitting exactly on the old mark
+        self.assertEqual(result.changed, 3)
+        self.assertEqual(result.high_water_mark, self.table.times[rid][1])
+        self.assertEqual(self.snapshot.get('rec000000001')['fields']['name'], 'renamed')
+        self.assertEqual(self.snapshot.get(rid)['fields']['count'], 9)
+        self.assertEqual(len(self.snapshot), 6)
+        # the api filters dates by day, the connector drops what's before the mark
+        self.assertEqual(self.server.mock.filters[-1], {
+            'conjunction': 'and',
+            'conditions': [{'field_name': 'modified', 'operator': 'isGreaterEqual', 'value': ['ExactDate', str(hwm)]}],
+        })
+
+        result = fc.sync_bitable(self.snapshot, modified_field='modified', full_scan_interval=3600)
+        self.assertEqual(result.changed, 1)
+
+    def test_id_scan_detects_deletions(self):
+        fc = self.connector()
+        fc.sync_bitable(self.snapshot, modified_field='modified')
+        self.table.delete('rec000000002')
+        result = fc.sync_bitable(self.snapshot, modified_field='modified', full_scan_interval=3600)
+        self.assertEqual((result.deleted, result.full_scan), (0, False))
+        self.assertIsNotNone(self.snapshot.get('rec000000002'))
+
+        result = fc.sync_bitable(self.snapshot, modified_field='modified', full_scan_interval=0)
+        self.assertEqual((result.deleted, result.full_scan, result.requests), (1, True, 2))
+        self.assertIsNone(self.snapshot.get('rec000000002'))
+        self.assertEqual(len(self.snapshot), 4)
+
+    def test_without_modified_field_every_sync_is_full(self):
+        fc = self.connector()
+        fc.sync_bitable(self.snapshot)
+        self.table.delete('rec000000000')
+        result = fc.sync_bitable(self.snapshot)
+        self.assertEqual((result.changed, result.deleted, result.full_scan), (4, 1, True))
+        self.assertEqual(self.requests(self.SEARCH), 2)
+
+
+class RetryTest(MockTestCase):
+    CREATE = 'POST bitable/v1/apps/:id/tables/:id/records/batch_create'
+    RECORDS = 'GET bitable/v1/apps/:id/tables/:id/records'
+
+    def setUp(self):
+        super().setUp()
+        self.app_token = self.server.add_bitable('wik1', 'tbl1', rows=3)
+        self.table = self.server.mock.tables[(self.app_token, 'tbl1')]
+        self.fc = self.connector(scheduler=RequestScheduler(max_retries=3, base_delay=0.01, max_delay=0.05))
+        self.fc.get_app_token('wik1')
+
+    def fail(self, status, code=1254607):
+        self.server.mock.config = MockConfig(error_rate=1.0, error_status=status, error_code=code)
+
+    def test_post_without_client_token_is_not_resent_after_5xx(self):
+        self.fail(500)
+        with self.assertRaises(AssertionError):
+            self.fc._append_bitable_record(self.app_token, 'tbl1', [{'name': 'x'}])
+        self.assertEqual(self.requests(self.CREATE), 1)
+
+    def test_post_with_client_token_is_retried_after_5xx(self):
+        self.fail(502)
+        with self.assertRaises(AssertionError):
+            self.fc._append_bitable_record(self.app_token, 'tbl1', [{'name': 'x'}], client_token='tok-1')
+        self.assertEqual(self.requests(self.CREATE), 4)
+
+    def test_get_is_retried_after_5xx(self):
+        self.fail(503)
+        with self.assertRaises(AssertionError):
+            self.fc.get_bitable_records('wik1', 'tbl1')
+        self.assertEqual(self.requests(self.RECORDS), 4)
+
+    def test_throttled_post_is_retried(self):
+        self.fail(429, 99991400)
+        with self.assertRaises(AssertionError):
+            self.fc._append_bitable_record(self.app_token, 'tbl1', [{'name': 'x'}])
+        self.assertEqual(self.requests(self.CREATE), 4)
+
+        # rejected calls wrote nothing, so retrying them never duplicates
+        self.server.mock.config = MockConfig(rate_limit=20)
+        fc = self.connector(scheduler=RequestScheduler(max_retries=20, base_delay=0.01, max_delay=0.05))
+        for i in range(40):
+            fc._append_bitable_record(self.app_token, 'tbl1', [{'name': f'n{i}'}])
+        self.assertGreater(self.server.mock.stats[self.CREATE]['throttled'], 0)
+        names = [self.table.get(i)['fields']['name'] for i in range(3, len(self.table))]
+        self.assertEqual(names, [f'n{i}' for i in range(40)])
+
+    def test_network_failures_shrink_the_concurrency_cap(self):
+        scheduler = RequestScheduler(max_retries=2, base_delay=0.0, max_delay=0.0, limiter=AdaptiveLimiter(initial=8))
+
+        def unreachable():
+            raise requests.ConnectionError('connection refused')
+
+        with self.assertRaises(requests.ConnectionError):
+            scheduler.execute('GET x', unreachable, idempotent=True)
+        self.assertEqual(scheduler.state()['requests'], 3)
+        self.assertEqual(scheduler.limiter.limit, 1.0)
+
+        limiter = AdaptiveLimiter(initial=8)
+        limiter.acquire()
+        limiter.release(failed=True)
+        self.assertEqual(limiter.limit, 8.0)
+        limiter.acquire()
+        limiter.release()
+        self.assertGreater(limiter.limit, 8.0)
+
+
+class AsyncConnectorTest(unittest.IsolatedAsyncioTestCase):
+    RECORDS = 'GET bitable/v1/apps/:id/tables/:id/records'
+    CREATE = 'POST bitable/v1/apps/:id/tables/:id/records/batch_create'
+    APPEND = 'POST sheets/v2/spreadsheets/:id/values_append'
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = MockServer().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    async def asyncSetUp(self):
+        self.server.mock.config = MockConfig()
+        self.server.mock.reset()
+        self.app_token = self.server.add_bitable('wik1', 'tbl1', rows=3)
+        self.server.add_sheet('wik2', 'sh1', rows=2, cols=3)
+        self.fc = AsyncFeishuConnector({'default': self.server.webhook_url()}, base_url=self.server.base_url,
+                                       timeout=0.3, max_retries=3, base_delay=0.01, max_delay=0.05)
+        await self.fc.init('cli_test', 'secret')
+        await self.fc.get_app_token('wik1')
+        await self.fc.get_app_token('wik2')
+
+    async def asyncTearDown(self):
+        await self.fc.close()
+
+    def requests(self, endpoint: str) -> int:
+        return self.server.mock.stats.get(endpoint, {}).get('requests', 0)
+
+    async def test_idempotent_calls_are_retried_after_a_timeout(self):
+        self.server.mock.config = MockConfig(latency=1.0)
+        with self.assertRaises(asyncio.TimeoutError):
+            await self.fc.get_bitable_records('wik1', 'tbl1')
+        self.assertEqual(self.requests(self.RECORDS), 4)
+
+        self.server.mock.config = MockConfig()
+        fc = AsyncFeishuConnector({'default': self.server.webhook_url()}, base_url=self.server.base_url,
+                                  timeout=0.3, max_retries=10, base_delay=0.05, max_delay=0.05)
+        try:
+            await fc.init('cli_test', 'secret')
+            await fc.get_app_token('wik1')
+            # the network recovers while the call is backing off
+            self.server.mock.config = MockConfig(latency=1.0)
+            asyncio.get_running_loop().call_later(0.4, setattr, self.server.mock, 'config', MockConfig())
+            self.assertEqual(len(await fc.get_bitable_records('wik1', 'tbl1')), 3)
+        finally:
+            await fc.close()
+
+    async def test_non_idempotent_calls_are_not_resent_after_a_timeout(self):
+        self.server.mock.config = MockConfig(latency=1.0)
+        with self.assertRaises(asyncio.TimeoutError):
+            await self.fc.append_sheet_data('wik2', 'sh1', [['a', 1, 2]])
+        self.assertEqual(self.requests(self.APPEND), 1)
+
+    async def test_failed_chunks_are_reported_one_by_one(self):
+        # a permanent code isn't retried, every chunk makes one call
+        self.server.mock.config = MockConfig(error_rate=1.0, error_status=400, error_code=1254104)
+        result = await self.fc.batch_append_bitable_records('wik1', 'tbl1', [{'name': f'n{i}'} for i in range(5)], chunk_size=2)
+        self.assertEqual((result.succeeded, len(result.failed), result.requests), (0, 5, 3))
+        self.assertEqual(self.requests(self.CREATE), 3)
+        self.assertIn('1254104', result.failed[0].error)
+
+        self.server.mock.config = MockConfig()
+        result = await self.fc.batch_append_bitable_records('wik1', 'tbl1', [{'name': f'n{i}'} for i in range(5)], chunk_size=2)
+        self.assertEqual((result.succeeded, result.requests), (5, 3))
+        # chunks are in flight together, their rows may land in any order
+        names = [r['fields']['name'] for r in await self.fc.get_bitable_records('wik1', 'tbl1')]
+        self.assertEqual(sorted(names[3:]), [f'n{i}' for i in range(5)])
+
+    async def test_list_calls_fetch_every_page(self):
+        self.server.mock.config = MockConfig(page_limit=2)
+        for i in range(4):
+            self.server.add_bitable('wik1', f'tbl{i + 2}', app_token=self.app_token)
+            self.server.add_wiki_node('spc1', f'node{i}', parent='root' if i else None)
+        self.server.add_wiki_node('spc2', 'other')
+        tables = await self.fc.get_bitable_tables(self.app_token)
+        self.assertEqual([t['table_id'] for t in tables], ['tbl1', 'tbl2', 'tbl3', 'tbl4', 'tbl5'])
+        self.assertEqual([s['space_id'] for s in await self.fc.get_wiki_spaces()], ['spc1', 'spc2'])
+        self.assertEqual([n['node_token'] for n in await self.fc.get_nodes('spc1', 'root')], ['node1', 'node2', 'node3'])
+
+
+class SheetReadTest(MockTestCase):
+    VALUES = 'GET sheets/v2/spreadsheets/:id/values/:id'
+    BATCH = 'GET sheets/v2/spreadsheets/:id/values_batch_get'
+
+    def setUp(self):
+        super().setUp()
+        sheet_token = self.server.add_sheet('wik1', 'sh1', rows=23, cols=3)
+        self.server.add_sheet('wik1', 'sh2', rows=4, cols=2, sheet_token=sheet_token)
+        self.sheet = self.server.mock.sheets[sheet_token]['sh1']
+        self.fc = self.connector()
+
+    def test_blocks_are_reassembled_in_order(self):
+        values = self.fc.get_sheet_data('wik1', 'sh1', block_rows=5, concurrency=3)
+        self.assertEqual(values, self.sheet.values)
+        # 200 grid rows in blocks of 5, the empty ones below the data included
+        self.assertEqual(self.requests(self.VALUES), 40)
+        blocks = list(self.fc.iter_sheet_data('wik1', 'sh1!A1:C', block_rows=5, concurrency=3))
+        self.assertEqual([first for first, _ in blocks], [1, 6, 11, 16, 21])
+        self.assertEqual([row for _, rows in blocks for row in rows], self.sheet.values)
+
+    def test_empty_rows_inside_the_data_are_kept(self):
+        # rows 10 and 11 are empty, across the boundary of two blocks
+        self.sheet.values[9] = [None, None, None]
+        self.sheet.values[10] = [None, '', None]
+        blocks = list(self.fc.iter_sheet_data('wik1', 'sh1!A1:C', block_rows=5))
+        self.assertEqual([first for first, _ in blocks], [1, 6, 10, 16, 21])
+        self.assertEqual([row for _, rows in blocks for row in rows], self.sheet.values)
+
+    def test_open_ended_ranges_are_trimmed(self):
+        self.assertEqual(self.fc.get_sheet_data('wik1', 'sh1!B20:C', block_rows=4), [row[1:] for row in self.sheet.values[19:]])
+        # no columns given, the empty columns of the 20 column grid are dropped too
+        self.assertEqual(len(self.fc.get_sheet_data('wik1', 'sh1')[0]), 3)
+
+    def test_explicit_ranges_come_back_as_requested(self):
+        values = self.fc.get_sheet_data('wik1', 'sh1!A20:E30', block_rows=4)
+        self.assertEqual(values, [row + [None, None] for row in self.sheet.values[19:]] + [[None] * 5] * 7)
+        self.assertEqual(self.fc.get_sheet_data('wik1', 'sh1!A40:B41'), [[None, None], [None, None]])
+
+    def test_batch_get_keeps_the_input_order(self):
+        ranges = [f'sh1!A{i}:B{i}' for i in range(23, 0, -1)] * 3 + ['sh2!B2:B3', 'sh1!C5:C5']
+        values = self.fc.get_sheet_ranges('wik1', ranges, concurrency=4)
+        self.assertEqual(self.requests(self.BATCH), 2)
+        expected = [[self.sheet.values[i - 1][:2]] for i in range(23, 0, -1)] * 3
+        self.assertEqual(values, expected + [[['r1c1'], ['r2c1']], [['r4c2']]])
+
+
+if __name__ == '__main__':
+    unittest.main()